@@ -1,5 +1,8 @@
 import pytest
 
+from airsift.data.ingest import decode_readings, upsert_readings
+from airsift.data.models import Dustbox
+from airsift.data.tests.factories import DustboxFactory
 from airsift.users.models import User
 from airsift.users.tests.factories import UserFactory
 
@@ -12,3 +15,20 @@ def media_storage(settings, tmpdir):
 @pytest.fixture
 def user() -> User:
     return UserFactory()
+
+
+@pytest.fixture
+def dustbox(db) -> Dustbox:
+    return DustboxFactory(id='dustbox')
+
+
+@pytest.fixture
+def write_readings(db):
+    '''
+    Write readings, in the shape the citizensense api gives them, through the sync's ingest path
+    '''
+    def write(readings):
+        columns, _ = decode_readings(readings)
+        upsert_readings(columns)
+
+    return write
@@ -0,0 +1,407 @@
+'''
+Aggregates of a dustbox's readings, as the aggregates endpoint serves them: the mean of some measures
+over each date_trunc (or date_part) of a unit of time.
+
+An AggregateQuery is validated from the endpoint's parameters and compiled to a single query, of the
+whole buckets of the rollup tiers with the detail it needs (see airsift.data.rollups), and of the
+readings and the archive (see airsift.data.archive) only where the dates don't line up with any.
+
+Only the whitelisted names of units, measures and orderings make it into the SQL, and every value
+is a bound parameter, so nothing from the request can change what a query does, and its text only
+depends on its shape. (psycopg2 binds the parameters on the client, so the database still plans
+each query afresh.) Only the measures asked for are averaged.
+'''
+import datetime
+
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from airsift.data.archive import ArchivedReadings
+from airsift.data.models import Dustbox, DustboxReading
+from airsift.data.rollups import ARCHIVE_HORIZON, ROLLUP_MEASURES, rollup_spans
+
+FUNCTIONS = {'trunc': 'date_trunc', 'part': 'date_part'}
+
+# The units each of date_trunc and date_part accept
+MEANS = {
+    'trunc': (
+        'microseconds', 'milliseconds', 'second', 'minute', 'hour', 'day', 'week', 'month', 'quarter', 'year',
+        'decade', 'century', 'millennium',
+    ),
+    'part': (
+        'microseconds', 'milliseconds', 'second', 'minute', 'hour', 'day', 'week', 'month', 'quarter', 'year',
+        'decade', 'century', 'millennium', 'dow', 'doy', 'epoch', 'isodow', 'isoyear', 'timezone',
+        'timezone_hour', 'timezone_minute',
+    ),
+}
+
+# Measures can be asked for by their name in the api's (camelCase) responses too
+MEASURE_ALIASES = {'pm25': 'pm2_5'}
+
+DUSTBOX_NUMBER = f'(SELECT number FROM {Dustbox._meta.db_table} WHERE id = %s)'
+
+# The most dustboxes a batch of aggregates can compare
+MAX_BATCH_DUSTBOXES = 50
+
+
+class InvalidAggregate(ValueError):
+    '''
+    A parameter of an aggregate that can't be compiled
+    '''
+
+    def __init__(self, param, message):
+        super().__init__(f'{param}: {message}')
+        self.param = param
+        self.message = message
+
+
+class AggregateQuery:
+    '''
+    The mean of `measures` of a dustbox's readings between two datetimes (`after` and `before`, both
+    optional), by date_trunc or date_part (by `mode`) of `mean`, in `ordering` and at most `limit` rows.
+    '''
+    # Columns the aggregates are grouped by, besides the datetime
+    key_columns = ()
+
+    def __init__(
+        self, dustbox_id, mean='minute', mode='trunc', measures=ROLLUP_MEASURES, after=None, before=None,
+        ordering=('-created_at',), limit=1,
+    ):
+        if mode not in FUNCTIONS:
+            raise InvalidAggregate('mode', f'must be one of {", ".join(FUNCTIONS)}')
+
+        if mean not in MEANS[mode]:
+            raise InvalidAggregate('mean', f'must be one of {", ".join(MEANS[mode])} with mode {mode}')
+
+        measures = [MEASURE_ALIASES.get(measure, measure) for measure in measures]
+        unknown = [measure for measure in measures if measure not in ROLLUP_MEASURES]
+        if unknown or not measures:
+            raise InvalidAggregate('measure', f'must be some of {", ".join(ROLLUP_MEASURES)}')
+
+        order_by = []
+        for field in ordering:
+            name = MEASURE_ALIASES.get(field.lstrip('-'), field.lstrip('-'))
+            if name != 'created_at' and name not in measures:
+                raise InvalidAggregate('ordering', 'must be created_at or one of the measures, optionally with a -')
+
+            order_by.append(f'{name} DESC' if field.startswith('-') else name)
+
+        if limit < 0:
+            raise InvalidAggregate('limit', 'must not be negative')
+
+        self.dustbox_id = dustbox_id
+        self.mean = mean
+        self.mode = mode
+        # In the order of the columns, so the same measures always compile to the same query
+        self.measures = [measure for measure in ROLLUP_MEASURES if measure in measures]
+        self.after = after
+        self.before = before
+        self.order_by = order_by
+        self.limit = limit
+
+    @classmethod
+    def from_params(cls, dustbox_id, params, limit=1):
+        '''
+        An AggregateQuery from the query parameters of the aggregates endpoint, with a default `limit`
+        '''
+        return cls(dustbox_id, **query_params(params, limit))
+
+    def spans(self):
+        '''
+        The spans (model, start, end) the query aggregates: whole buckets of rollup models, and the readings
+        (model None) at the edges where buckets don't fit (see airsift.data.rollups.rollup_spans)
+        '''
+        # Readings at `before` itself are included
+        end = None if self.before is None else self.before + datetime.timedelta(microseconds=1)
+
+        return rollup_spans(self.mean, self.mode, self.after, end) or [(None, self.after, end)]
+
+    def reading_spans(self):
+        return [(start, end) for model, start, end in self.spans() if model is None]
+
+    def compile(self, archived=()):
+        '''
+        The SQL of the query and its parameters, aggregating `archived` (see archived()) with the
+        readings and the rollups
+        '''
+        sql, params = self.grouped(archived)
+
+        return f'{sql} ORDER BY {", ".join(self.order_by)} LIMIT %s', [*params, self.limit]
+
+    def grouped(self, archived):
+        # The aggregates, grouped by the key columns and the datetime, of the sums and counts of each span
+        sources, params = [], []
+
+        for model, start, end in self.spans():
+            if model is not None:
+                source, source_params = self.rollup_source(model, start, end)
+                sources.append(source)
+                params += source_params
+
+        if self.reading_spans():
+            readings_sources, readings_params = self.readings_source(self.reading_spans(), archived)
+            sources += readings_sources
+            params += readings_params
+
+        keys = ''.join(f'{key}, ' for key in self.key_columns)
+        groups = ', '.join(str(position) for position in range(1, len(self.key_columns) + 2))
+        averages = [f'sum({measure}_sum) / NULLIF(sum({measure}_count), 0) AS {measure}' for measure in self.measures]
+
+        sql = f'''
+            SELECT {keys}{FUNCTIONS[self.mode]}(%s, created_at) AS created_at, {', '.join(averages)}
+            FROM ({' UNION ALL '.join(sources)}) AS spans
+            GROUP BY {groups}
+        '''
+
+        return sql, [self.mean, *params]
+
+    def dustbox_condition(self):
+        return f'dustbox_number = {DUSTBOX_NUMBER}', [self.dustbox_id]
+
+    def rollup_source(self, rollup, start, end):
+        # Buckets start at their datetime, so one starting at `end` is after it
+        condition, params = self.dustbox_condition()
+        conditions = [condition]
+
+        if start is not None:
+            conditions.append('bucket >= %s')
+            params.append(start)
+        if end is not None:
+            conditions.append('bucket < %s')
+            params.append(end)
+
+        keys = ''.join(f'{key}, ' for key in self.key_columns)
+        columns = ', '.join(f'{measure}_sum, {measure}_count' for measure in self.measures)
+
+        return f'''
+            SELECT {keys}bucket AS created_at, {columns}
+            FROM {rollup._meta.db_table}
+            WHERE {" AND ".join(conditions)}
+        ''', params
+
+    def readings_source(self, spans, archived):
+        # The readings (as sums and counts of one) in any of the spans, and their archived readings
+        condition, params = self.dustbox_condition()
+        ranges = []
+
+        for start, end in spans:
+            bounds = []
+
+            if start is not None:
+                bounds.append('created_at >= %s')
+                params.append(start)
+            if end is not None:
+                bounds.append('created_at < %s')
+                params.append(end)
+
+            ranges.append(f'({" AND ".join(bounds) or "TRUE"})')
+
+        # Readings before the archive horizon are read from the archive instead
+        conditions = [condition, f'({" OR ".join(ranges)})', f'created_at >= {ARCHIVE_HORIZON}']
+
+        keys = ''.join(f'{key}, ' for key in self.key_columns)
+        readings = f'''
+            SELECT
+                {keys}created_at,
+                {', '.join(f'{measure}::float8, ({measure} IS NOT NULL)::integer' for measure in self.measures)}
+            FROM {DustboxReading._meta.db_table}
+            WHERE {" AND ".join(conditions)}
+        '''
+
+        archived_columns = self.archived_columns(archived)
+        if archived_columns is None:
+            return [readings], params
+
+        # The archived readings are sent as array parameters, and aggregated with the readings in one query
+        key_arrays, created_at, measures = archived_columns
+        params += [created_at, *key_arrays, *(measures[measure] for measure in self.measures)]
+
+        return [readings, f'''
+            SELECT
+                {keys}TIMESTAMPTZ 'epoch' + created_at * INTERVAL '1 millisecond',
+                {', '.join(f"NULLIF({m}, 'NaN')::float8, ({m} <> 'NaN')::integer" for m in self.measures)}
+            FROM unnest(
+                %s::bigint[],
+                {''.join('%s::integer[], ' for _ in self.key_columns)}
+                {', '.join('%s::real[]' for _ in self.measures)}
+            ) AS archived (created_at, {', '.join((*self.key_columns, *self.measures))})
+        '''], params
+
+    def archived(self):
+        '''
+        The archived readings the query needs, as (key, ArchivedReadings) of the spans it reads readings in
+        '''
+        return [(None, readings) for readings in archived_spans(self.dustbox_id, self.reading_spans())]
+
+    def archived_columns(self, archived):
+        # The arrays of the key columns, created_at and the measures of the archived readings, if any
+        archived = [(key, readings) for key, readings in archived if len(readings) > 0]
+        if not archived:
+            return None
+
+        keys, created_at, measures = [], [], {measure: [] for measure in self.measures}
+
+        for key, readings in archived:
+            columns = readings.columns()
+            keys += [key] * len(columns.created_at)
+            created_at += columns.created_at.tolist()
+
+            for measure in self.measures:
+                measures[measure] += columns.measures[measure].tolist()
+
+        return [keys] if self.key_columns else [], created_at, measures
+
+    def execute(self):
+        '''
+        The aggregated rows, as dicts of the key columns, created_at and the measures
+        '''
+        sql, params = self.compile(self.archived())
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            names = [column.name for column in cursor.description]
+
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+class BatchAggregateQuery(AggregateQuery):
+    '''
+    An AggregateQuery of several Dustboxes at once, in one query, as a series of each of them on the same
+    datetimes: the first `limit` datetimes in `ordering` that any of them have aggregates at.
+    '''
+    key_columns = ('dustbox_number',)
+
+    def __init__(self, dustboxes, **kwargs):
+        super().__init__(None, **kwargs)
+
+        # A shared axis can only be in time order
+        if any(field.split()[0] != 'created_at' for field in self.order_by):
+            raise InvalidAggregate('ordering', 'must be created_at or -created_at')
+
+        self.dustboxes = dustboxes
+
+    @classmethod
+    def from_params(cls, params, limit=1):
+        '''
+        A BatchAggregateQuery from the query parameters of the batch aggregates endpoint: those of the
+        aggregates endpoint, and the ids of the dustboxes
+        '''
+        ids = list(dict.fromkeys(
+            dustbox_id
+            for value in params.getlist('dustboxes')
+            for dustbox_id in value.split(',')
+            if dustbox_id
+        ))
+
+        if not ids:
+            raise InvalidAggregate('dustboxes', 'must be one or more dustbox ids, comma separated')
+        if len(ids) > MAX_BATCH_DUSTBOXES:
+            raise InvalidAggregate('dustboxes', f'must be at most {MAX_BATCH_DUSTBOXES} dustboxes')
+
+        # Unknown dustboxes are left out, like a single one has no aggregates
+        dustboxes = Dustbox.objects.in_bulk(ids)
+
+        return cls(
+            [dustboxes[dustbox_id] for dustbox_id in ids if dustbox_id in dustboxes], **query_params(params, limit)
+        )
+
+    def compile(self, archived=()):
+        sql, params = self.grouped(archived)
+        order_by = ', '.join(self.order_by)
+
+        return f'''
+            WITH aggregates AS ({sql})
+            SELECT * FROM aggregates
+            WHERE created_at IN (SELECT DISTINCT created_at FROM aggregates ORDER BY {order_by} LIMIT %s)
+            ORDER BY {order_by}
+        ''', [*params, self.limit]
+
+    def dustbox_condition(self):
+        return 'dustbox_number = ANY(%s)', [[dustbox.number for dustbox in self.dustboxes]]
+
+    def archived(self):
+        spans = self.reading_spans()
+
+        return [
+            (dustbox.number, readings) for dustbox in self.dustboxes for readings in archived_spans(dustbox.id, spans)
+        ]
+
+    def execute(self):
+        '''
+        The datetimes of the series, and a list of each Dustbox and its series: a list of the mean of each
+        measure at those datetimes (None where it has none)
+        '''
+        if not self.dustboxes:
+            return [], []
+
+        rows = super().execute()
+        datetimes = list(dict.fromkeys(row['created_at'] for row in rows))
+        positions = {created_at: position for position, created_at in enumerate(datetimes)}
+
+        series = {
+            dustbox.number: {measure: [None] * len(datetimes) for measure in self.measures}
+            for dustbox in self.dustboxes
+        }
+        for row in rows:
+            for measure in self.measures:
+                series[row['dustbox_number']][measure][positions[row['created_at']]] = row[measure]
+
+        return datetimes, [(dustbox, series[dustbox.number]) for dustbox in self.dustboxes]
+
+
+def archived_spans(dustbox_id, spans):
+    # The ArchivedReadings of a dustbox in each span (whose bounds are inclusive, so they end just before `end`)
+    return [
+        ArchivedReadings(
+            dustbox_id, after=start, before=None if end is None else end - datetime.timedelta(microseconds=1),
+        )
+        for start, end in spans
+    ]
+
+
+def query_params(params, limit):
+    # The arguments of an AggregateQuery from the query parameters of the aggregates endpoints
+    measures = [
+        measure
+        for value in params.getlist('measure')
+        for measure in value.split(',')
+        if measure
+    ]
+    ordering = [field for field in (params.get('ordering') or '-created_at').split(',') if field]
+
+    try:
+        limit = int(params.get('limit') or limit)
+    except ValueError:
+        raise InvalidAggregate('limit', 'must be a whole number')
+
+    return {
+        'mean': params.get('mean') or 'minute',
+        'mode': params.get('mode') or 'trunc',
+        'measures': measures or ROLLUP_MEASURES,
+        'after': parse_date_param('date_after', params.get('date_after')),
+        'before': parse_date_param('date_before', params.get('date_before')),
+        'ordering': ordering,
+        'limit': limit,
+    }
+
+
+def parse_date_param(param, value):
+    '''
+    An aware datetime from a query parameter (in the current timezone if it doesn't have one), or None if
+    it isn't given
+    '''
+    if not value:
+        return None
+
+    try:
+        date = parse_datetime(value)
+        if date is None and parse_date(value) is not None:
+            date = datetime.datetime.combine(parse_date(value), datetime.time())
+    except ValueError:
+        date = None
+
+    if date is None:
+        raise InvalidAggregate(param, 'must be a date or datetime')
+
+    return date if timezone.is_aware(date) else timezone.make_aware(date)
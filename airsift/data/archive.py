@@ -0,0 +1,380 @@
+'''
+A columnar archive of old readings, which archive_readings moves out of the database a month at a time.
+
+The readings of a dustbox in an archived month are a directory of NumPy arrays, one per column,
+sorted by created_at:
+
+    <READINGS_ARCHIVE_ROOT>/2021-03/<dustbox id>/created_at.npy  epoch milliseconds (int64)
+                                                 id.npy          utf-8 bytes
+                                                 pm1.npy, ...    float32, NaN where missing
+
+They are memory-mapped when read, so a scan of a long history only reads the columns (and the
+months) it needs, sequentially.
+
+Months are archived oldest first and recorded as ArchivedMonth rows, so every reading before the
+"horizon" (the end of the last archived month) is in the archive. Their rollups stay in the
+database, so aggregates only read the archive at dates that don't line up with rollup buckets.
+Readings written before the horizon after all (e.g. by re-syncing a stream) stay out of the api
+and the rollups until archive_readings folds them into the archive.
+'''
+import math
+import os
+import shutil
+from urllib.parse import quote
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from airsift.data.ingest import ReadingColumns
+from airsift.data.models import ArchivedMonth, Dustbox, DustboxReading
+from airsift.data.partitions import add_months, detach_partition, drop_partition, list_partitions
+from airsift.data.rollups import refresh_rollups
+
+ARCHIVE_MEASURES = ('humidity', 'pm1', 'pm2_5', 'pm10', 'temperature')
+
+
+def month_directory(month, dustbox_id):
+    # Upstream ids are free-form strings, so they are quoted to be safe as file names
+    return os.path.join(settings.READINGS_ARCHIVE_ROOT, f'{month:%Y-%m}', quote(dustbox_id, safe=''))
+
+
+def write_month(month, dustbox_id, columns):
+    '''
+    Write the ReadingColumns (sorted by created_at) of a dustbox's month, replacing any already archived
+    '''
+    directory = month_directory(month, dustbox_id)
+    staging = f'{directory}.{os.getpid()}.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    np.save(os.path.join(staging, 'id.npy'), np.array([reading_id.encode() for reading_id in columns.ids]))
+    np.save(os.path.join(staging, 'created_at.npy'), columns.created_at.astype(np.int64))
+
+    for measure in ARCHIVE_MEASURES:
+        np.save(os.path.join(staging, f'{measure}.npy'), columns.measures[measure].astype(np.float32))
+
+    # A directory can't be renamed over another one, so the old month is moved aside first
+    if os.path.exists(directory):
+        replaced = f'{directory}.{os.getpid()}.old'
+        os.rename(directory, replaced)
+        os.rename(staging, directory)
+        shutil.rmtree(replaced)
+    else:
+        os.rename(staging, directory)
+
+
+def read_month(month, dustbox_id):
+    '''
+    The memory-mapped arrays of a dustbox's archived month (by column), or None if it has no readings there
+    '''
+    directory = month_directory(month, dustbox_id)
+
+    if not os.path.isdir(directory):
+        return None
+
+    return {
+        column: np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')
+        for column in ('id', 'created_at', *ARCHIVE_MEASURES)
+    }
+
+
+def month_columns(arrays, dustbox_id, start=0, stop=None):
+    '''
+    Rows [start, stop) of the arrays of an archived month, as ReadingColumns
+    '''
+    ids = arrays['id'][start:stop]
+
+    return ReadingColumns(
+        np.char.decode(ids, 'utf-8').astype(object),
+        np.array(arrays['created_at'][start:stop]),
+        np.full(len(ids), dustbox_id, dtype=object),
+        {measure: np.array(arrays[measure][start:stop]) for measure in ARCHIVE_MEASURES},
+    )
+
+
+def concatenate_columns(pieces, dustbox_id):
+    if len(pieces) == 0:
+        return ReadingColumns(
+            np.array([], dtype=object),
+            np.array([], dtype=np.int64),
+            np.array([], dtype=object),
+            {measure: np.array([], dtype=np.float32) for measure in ARCHIVE_MEASURES},
+        )
+
+    return ReadingColumns(
+        np.concatenate([piece.ids for piece in pieces]),
+        np.concatenate([piece.created_at for piece in pieces]),
+        np.full(sum(len(piece) for piece in pieces), dustbox_id, dtype=object),
+        {measure: np.concatenate([piece.measures[measure] for piece in pieces]) for measure in ARCHIVE_MEASURES},
+    )
+
+
+class ArchivedReadings:
+    '''
+    The archived readings of a dustbox, optionally between two datetimes (inclusive), in created_at order.
+
+    Only the bounds of each month are looked up when it's created; rows are read when sliced.
+    '''
+
+    def __init__(self, dustbox_id, after=None, before=None):
+        self.dustbox_id = dustbox_id
+        self.months = []
+
+        months = list(ArchivedMonth.objects.values_list('month', flat=True))
+        self.horizon = add_months(months[-1], 1) if months else None
+
+        for month in months:
+            if (after is not None and add_months(month, 1) <= after) or (before is not None and month > before):
+                continue
+
+            arrays = read_month(month, dustbox_id)
+            if arrays is None:
+                continue
+
+            created_at = arrays['created_at']
+            start = np.searchsorted(created_at, math.ceil(after.timestamp() * 1000)) if after else 0
+            stop = (
+                np.searchsorted(created_at, math.floor(before.timestamp() * 1000), side='right')
+                if before else len(created_at)
+            )
+
+            if stop > start:
+                self.months.append((arrays, int(start), int(stop)))
+
+    def __len__(self):
+        return sum(stop - start for _, start, stop in self.months)
+
+    def columns(self, start=0, stop=None):
+        '''
+        The readings at positions [start, stop) as ReadingColumns
+        '''
+        stop = len(self) if stop is None else min(stop, len(self))
+        pieces = []
+        offset = 0
+
+        for arrays, month_start, month_stop in self.months:
+            size = month_stop - month_start
+            first, last = max(start - offset, 0), min(stop - offset, size)
+
+            if first < last:
+                pieces.append(month_columns(arrays, self.dustbox_id, month_start + first, month_start + last))
+
+            offset += size
+
+        return concatenate_columns(pieces, self.dustbox_id)
+
+
+def real_value(value):
+    # The shortest repr of the float32, as Postgres gives real columns, rather than its exact double value
+    return None if np.isnan(value) else float(str(value))
+
+
+def reading_instances(columns, dustbox):
+    '''
+    Unsaved DustboxReadings of ReadingColumns, for serializing like readings from the database
+    '''
+    return [
+        DustboxReading(
+            id=columns.ids[i],
+            created_at=columns.created_at_datetime(i),
+            dustbox=dustbox,
+            **{measure: real_value(columns.measures[measure][i]) for measure in ARCHIVE_MEASURES},
+        )
+        for i in range(len(columns))
+    ]
+
+
+class ReadingsWithArchive:
+    '''
+    A queryset of a dustbox's readings after the archive horizon, and its archived readings, which
+    pagination can count and slice like one queryset: newest first, the archived readings follow
+    those in the database, and oldest first they come before them.
+    '''
+
+    def __init__(self, queryset, archived, dustbox, newest_first=True):
+        self.queryset = queryset
+        self.archived = archived
+        self.dustbox = dustbox
+        self.newest_first = newest_first
+        self.database_count = None
+
+    def count(self):
+        if self.database_count is None:
+            self.database_count = self.queryset.count()
+
+        return self.database_count + len(self.archived)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        start, stop = index.start or 0, index.stop if index.stop is not None else self.count()
+        self.count()
+
+        if self.newest_first:
+            readings = list(self.queryset[start:min(stop, self.database_count)]) if start < self.database_count else []
+            archived_start, archived_stop = max(start - self.database_count, 0), max(stop - self.database_count, 0)
+
+            # Archived positions count back from the newest archived reading
+            size = len(self.archived)
+            columns = self.archived.columns(max(size - archived_stop, 0), size - archived_start)
+            return readings + reading_instances(columns.take(slice(None, None, -1)), self.dustbox)
+
+        archived = reading_instances(self.archived.columns(start, stop), self.dustbox)
+        database_start, database_stop = max(start - len(self.archived), 0), max(stop - len(self.archived), 0)
+        readings = list(self.queryset[database_start:database_stop]) if database_stop > database_start else []
+
+        return archived + readings
+
+
+def with_archive(queryset, dustbox_id, after=None, before=None):
+    '''
+    A dustbox's readings queryset (ordered by created_at), followed or preceded by its archived readings
+    between `after` and `before` (inclusive), which should be the bounds the queryset is filtered by
+    '''
+    archived = ArchivedReadings(dustbox_id, after, before)
+
+    if archived.horizon is None:
+        return queryset
+
+    dustbox = Dustbox.objects.filter(id=dustbox_id).first()
+    newest_first = tuple(queryset.query.order_by)[:1] != ('created_at',)
+
+    return ReadingsWithArchive(
+        queryset.filter(created_at__gte=archived.horizon), archived, dustbox, newest_first=newest_first,
+    )
+
+
+def archive_month(month):
+    '''
+    Move the readings of the month starting at `month` out of the database and into the archive.
+
+    Readings of a month that is already archived are merged into it, replacing archived readings
+    with the same id. Returns the number of readings moved.
+    '''
+    end = add_months(month, 1)
+    table = DustboxReading._meta.db_table
+    already_archived = ArchivedMonth.objects.filter(month=month).exists()
+    moved = 0
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                SELECT dustbox.id, dustbox.number
+                FROM {Dustbox._meta.db_table} dustbox
+                WHERE dustbox.number IN (
+                    SELECT DISTINCT dustbox_number FROM {table} WHERE created_at >= %s AND created_at < %s
+                )
+                ''',
+                [month, end],
+            )
+            dustboxes = cursor.fetchall()
+
+        for dustbox_id, number in dustboxes:
+            moved += archive_dustbox_month(month, dustbox_id, number, merge=already_archived)
+
+        archived, _ = ArchivedMonth.objects.get_or_create(month=month, defaults={'archived_at': timezone.now()})
+        archived.readings += moved
+        archived.archived_at = timezone.now()
+        archived.save()
+
+        # The archived readings are still readings of their dustboxes, so the summaries are kept
+        for partition in list_partitions():
+            if partition.start == month:
+                detach_partition(partition, summaries=False)
+                drop_partition(partition)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE created_at >= %s AND created_at < %s', [month, end])
+
+    return moved
+
+
+def archive_dustbox_month(month, dustbox_id, number, merge=False):
+    '''
+    Write the readings of one dustbox in a month to the archive, merged with the archived ones if
+    `merge`, and (then) recompute the rollups of those that were written after the month was archived.
+
+    Returns the number of readings taken from the database.
+    '''
+    table = DustboxReading._meta.db_table
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            SELECT id, (extract(epoch FROM created_at) * 1000)::bigint, {', '.join(ARCHIVE_MEASURES)}
+            FROM {table}
+            WHERE dustbox_number = %s AND created_at >= %s AND created_at < %s
+            ''',
+            [number, month, add_months(month, 1)],
+        )
+        rows = cursor.fetchall()
+
+    if len(rows) == 0:
+        return 0
+
+    fields = list(zip(*rows))
+    columns = ReadingColumns(
+        np.array(fields[0], dtype=object),
+        np.array(fields[1], dtype=np.int64),
+        np.full(len(rows), dustbox_id, dtype=object),
+        {measure: np.array(fields[2 + i], dtype=np.float32) for i, measure in enumerate(ARCHIVE_MEASURES)},
+    )
+
+    archived = read_month(month, dustbox_id) if merge else None
+    replaced = 0
+
+    if archived is not None:
+        archived = month_columns(archived, dustbox_id)
+        kept = ~np.isin(archived.ids, columns.ids)
+        replaced = len(archived) - int(kept.sum())
+        columns = concatenate_columns([archived.take(kept), columns], dustbox_id)
+
+    columns = columns.take(np.argsort(columns.created_at, kind='stable'))
+    write_month(month, dustbox_id, columns)
+
+    if merge:
+        refresh_archived_rollups(number, columns, [reading_id for reading_id, *_ in rows])
+
+    # Replaced readings were counted again when they were written
+    if replaced:
+        Dustbox.objects.filter(number=number).update(reading_count=F('reading_count') - replaced)
+
+    return len(rows)
+
+
+def refresh_archived_rollups(number, columns, written_ids):
+    '''
+    Recompute the rollup buckets of readings written to an archived month, from the month's
+    archived readings (ReadingColumns)
+    '''
+    staging = 'archived_readings'
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {staging}')
+        cursor.execute(
+            f'''
+            CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS
+            SELECT
+                id,
+                %s::integer AS dustbox_number,
+                TIMESTAMPTZ 'epoch' + created_at * INTERVAL '1 millisecond' AS created_at,
+                {', '.join(f"NULLIF({measure}, 'NaN') AS {measure}" for measure in ARCHIVE_MEASURES)}
+            FROM unnest(%s::varchar[], %s::bigint[], %s::real[], %s::real[], %s::real[], %s::real[], %s::real[])
+                AS archived (id, created_at, {', '.join(ARCHIVE_MEASURES)})
+            ''',
+            [
+                number,
+                list(columns.ids),
+                columns.created_at.tolist(),
+                *(columns.measures[measure].tolist() for measure in ARCHIVE_MEASURES),
+            ],
+        )
+
+    refresh_rollups(
+        f'SELECT dustbox_number, created_at FROM {staging} WHERE id = ANY(%s)', [written_ids], archived=staging,
+    )
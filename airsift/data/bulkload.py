@@ -0,0 +1,187 @@
+import csv
+import io
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from airsift.data.ingest import READING_COLUMNS, READING_KEY, STORED_COLUMNS, summarised_upsert, upsert_updates
+from airsift.data.models import Dustbox, DustboxReading
+from airsift.data.rollups import refresh_rollups
+
+
+class CopyLoader:
+    '''
+    Load readings by streaming them with COPY into a staging table, and merging that into the
+    readings table with a single set-based upsert.
+
+    The staging table is a temporary table, so (like an UNLOGGED table) it isn't written to
+    the WAL, is private to this database connection and disappears with it. It has no indexes,
+    so COPY is only bounded by how fast rows can be sent.
+
+        with CopyLoader() as loader:
+            loader.write(columns)
+            ...
+
+    Rows are merged when the loader exits, and whenever `merge_every` rows have been staged.
+    '''
+
+    def __init__(self, merge_every=1000000):
+        self.table = DustboxReading._meta.db_table
+        self.staging_table = f'{self.table}_staging'
+        self.merge_every = merge_every
+        self.staged = 0
+        self.inserted = 0
+        self.updated = 0
+
+    def __enter__(self):
+        with connection.cursor() as cursor:
+            # Staged readings refer to their dustbox by id, the merge looks up its number
+            cursor.execute(
+                f'''
+                CREATE TEMPORARY TABLE IF NOT EXISTS {self.staging_table} (
+                    id varchar(36), created_at timestamptz, humidity real, pm1 real, pm2_5 real, pm10 real,
+                    dustbox_id varchar(36), temperature real
+                )
+                '''
+            )
+            cursor.execute(f'TRUNCATE {self.staging_table}')
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.merge()
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.staging_table}')
+
+    def write(self, columns):
+        '''
+        COPY ReadingColumns into the staging table.
+
+        Returns the number of rows staged.
+        '''
+        if len(columns) == 0:
+            return 0
+
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert(
+                f'COPY {self.staging_table} ({", ".join(READING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)',
+                CsvRowStream(columns.csv_rows()),
+            )
+
+        self.staged += len(columns)
+
+        if self.staged >= self.merge_every:
+            self.merge()
+
+        return len(columns)
+
+    def merge(self):
+        '''
+        Upsert everything staged so far into the readings table.
+
+        Returns the number of rows (inserted, updated).
+        '''
+        if self.staged == 0:
+            return 0, 0
+
+        values = ', '.join(
+            'dustbox.number' if column == 'dustbox_id' else f'staged.{column}' for column in READING_COLUMNS
+        )
+        key = ', '.join(f'staged.{column}' for column in READING_KEY)
+        staged = f'{self.staging_table} staged JOIN {Dustbox._meta.db_table} dustbox ON dustbox.id = staged.dustbox_id'
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Where a reading was staged more than once, the copy staged last wins
+            cursor.execute(summarised_upsert(
+                f'INSERT INTO {self.table} ({", ".join(STORED_COLUMNS)}) '
+                f'SELECT DISTINCT ON ({key}) {values} FROM {staged} ORDER BY {key}, staged.ctid DESC '
+                f'ON CONFLICT ({", ".join(READING_KEY)}) DO UPDATE SET {upsert_updates()}'
+            ))
+            inserted, updated = cursor.fetchone()
+
+            refresh_rollups(f'SELECT dustbox.number, staged.created_at FROM {staged}')
+            cursor.execute(f'TRUNCATE {self.staging_table}')
+
+        self.inserted += inserted
+        self.updated += updated
+        self.staged = 0
+
+        return inserted, updated
+
+
+class CsvRowStream(io.RawIOBase):
+    '''
+    A file-like object that encodes rows of strings as CSV as COPY reads them, rather than all up front
+    '''
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b''
+        self.text = io.StringIO()
+        self.writer = csv.writer(self.text)
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self.buffer) < len(target):
+            row = next(self.rows, None)
+            if row is None:
+                break
+
+            self.writer.writerow(row)
+            self.buffer += self.text.getvalue().encode('utf-8')
+            self.text.seek(0)
+            self.text.truncate()
+
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+
+        return size
+
+
+@contextmanager
+def deferred_indexes():
+    '''
+    Drop the secondary indexes of the readings table for the duration of a bulk load, and
+    rebuild them (once, rather than row by row) afterwards.
+
+    Only the primary key, which the upsert relies on, is kept. Queries that need the dropped
+    indexes will be slow until the load finishes, so this is meant for initial loads and
+    maintenance windows.
+    '''
+    table = DustboxReading._meta.db_table
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+            SELECT idx.relname, pg_get_indexdef(idx.oid)
+            FROM pg_index
+            JOIN pg_class idx ON idx.oid = pg_index.indexrelid
+            WHERE pg_index.indrelid = %s::regclass
+            AND NOT pg_index.indisprimary
+            AND NOT pg_index.indisunique
+            ''',
+            [table],
+        )
+        indexes = cursor.fetchall()
+
+        for name, _ in indexes:
+            print(f'Dropping index {name} for the bulk load')
+            cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+    try:
+        yield indexes
+
+    finally:
+        with connection.cursor() as cursor:
+            for name, definition in indexes:
+                print(f'Rebuilding index {name}')
+                # The definitions of indexes on the partitioned table are ON ONLY the parent,
+                # but they were dropped from every partition too
+                cursor.execute(definition.replace(' ON ONLY ', ' ON ', 1))
+
+            cursor.execute(f'ANALYZE {table}')
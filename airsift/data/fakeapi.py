@@ -0,0 +1,218 @@
+'''
+A local stand-in for the citizensense data api, for tests and benchmarks.
+
+It serves `/streams` and `/collections/stream/<id>` in the same shape as the real api, with
+paging, `limit=off`, configurable latency and injected errors:
+
+    with FakeCitizenSenseApi(synthetic_fixture(streams=10, readings=1000)) as api:
+        call_command('sync_data', ...)  # with CITIZENSENSE_DATA_API (or DATA_API_URL) = api.url
+'''
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class SyntheticReadings:
+    '''
+    A lazily generated, newest first, history of readings for one stream
+    '''
+
+    def __init__(self, stream_id, count, interval=60, seed=0):
+        self.stream_id = stream_id
+        self.count = count
+        self.interval = interval
+        self.seed = seed
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+
+        if index < 0:
+            index += self.count
+
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+
+        # Index 0 is the newest reading
+        n = self.count - 1 - index
+        digest = hashlib.blake2b(f'{self.seed}:{self.stream_id}:{n}'.encode(), digest_size=16).digest()
+        values = [byte / 4 for byte in digest]
+
+        return {
+            'id': str(uuid.UUID(bytes=digest)),
+            'streamId': self.stream_id,
+            'createdAt': int((EPOCH.timestamp() + n * self.interval) * 1000),
+            'pm1': values[0],
+            'pm2.5': values[1],
+            'pm10': values[2],
+            'humidity': values[3] if n % 97 else '',
+            'temperature': values[4] - 20,
+        }
+
+
+def synthetic_fixture(streams=10, readings=1000, interval=60, seed=0):
+    '''
+    A fixture of `streams` streams, each with `readings` readings taken every `interval` seconds
+    '''
+    fixture = {'streams': [], 'readings': {}}
+
+    for i in range(streams):
+        stream_id = str(uuid.UUID(int=random.Random(f'{seed}:{i}').getrandbits(128)))
+        history = SyntheticReadings(stream_id, readings, interval=interval, seed=seed)
+        last_entry_at = history[0]['createdAt'] if readings > 0 else 'never'
+
+        fixture['streams'].append({
+            'id': stream_id,
+            'createdAt': int(EPOCH.timestamp() * 1000),
+            'description': f'Synthetic dustbox {i}',
+            'deviceNumber': str(i),
+            'entriesNumber': readings,
+            'lastEntryAt': {'timestamp': last_entry_at},
+            'location': {'latitude': 51.5 + i / 1000, 'longitude': -0.1 + i / 1000},
+            'publicKey': f'synthetic-{i}',
+            'slug': f'synthetic-{i}',
+            'title': f'Synthetic {i}',
+            'updatedAt': int(EPOCH.timestamp() * 1000),
+        })
+        fixture['readings'][stream_id] = history
+
+    return fixture
+
+
+class FakeCitizenSenseApi:
+    '''
+    Serve a fixture over http on a background thread.
+
+    latency: seconds to wait before answering each request
+    error_rate: chance (0-1) of answering a request with a 500
+    failing_streams: ids of streams whose readings always fail with a 500
+    '''
+
+    def __init__(self, fixture, host='127.0.0.1', port=0, latency=0, error_rate=0, failing_streams=(), seed=0):
+        self.fixture = fixture
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failing_streams = set(failing_streams)
+        self.random = random.Random(seed)
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def handler_class(self):
+        api = self
+
+        class Handler(FakeApiRequestHandler):
+            pass
+
+        Handler.api = api
+        return Handler
+
+
+class FakeApiRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        with self.api.lock:
+            self.api.requests.append(self.path)
+
+        if self.api.latency:
+            threading.Event().wait(self.api.latency)
+
+        if url.path == '/streams':
+            return self.send_page(self.api.fixture['streams'], params)
+
+        match = re.fullmatch(r'/collections/stream/([^/]+)', url.path)
+        if match is None:
+            return self.send_json(404, {'error': 'Not found'})
+
+        stream_id = match.group(1)
+        if stream_id in self.api.failing_streams or self.api.should_fail():
+            return self.send_json(500, {'error': 'Injected error'})
+
+        return self.send_page(self.api.fixture['readings'].get(stream_id, []), params)
+
+    def send_page(self, items, params):
+        limit = params.get('limit', '50')
+
+        if limit == 'off':
+            return self.send_stream(items)
+
+        limit = int(limit)
+        page = int(params.get('page', 0))
+
+        return self.send_json(200, {'data': list(items[page * limit:(page + 1) * limit])})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, items, chunk_size=1000):
+        '''
+        Send a `limit=off` response as it is generated (chunked), so that huge histories
+        don't have to be built in memory
+        '''
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        self.write_chunk(b'{"data": [')
+
+        for start in range(0, len(items), chunk_size):
+            chunk = ', '.join(json.dumps(item) for item in items[start:start + chunk_size])
+            self.write_chunk(((', ' if start > 0 else '') + chunk).encode())
+
+        self.write_chunk(b']}')
+        self.write_chunk(b'')
+
+    def write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
@@ -0,0 +1,382 @@
+import datetime
+import math
+from itertools import islice
+
+import ijson
+import numpy as np
+from django.contrib.gis.geos import Point
+from django.db import connection, transaction
+
+from airsift.data.models import Dustbox, DustboxLatestReading, DustboxReading
+from airsift.data.rollups import refresh_rollups_of_columns
+
+# Column order of the tuples produced by `decode_reading`, and of the staged readings of bulk loads
+READING_COLUMNS = ('id', 'created_at', 'humidity', 'pm1', 'pm2_5', 'pm10', 'dustbox_id', 'temperature')
+
+# The same columns in the readings table, which refers to dustboxes by number rather than id
+STORED_COLUMNS = ('id', 'created_at', 'humidity', 'pm1', 'pm2_5', 'pm10', 'dustbox_number', 'temperature')
+
+# The primary key of the readings table, which is partitioned by created_at, so upserts conflict on it
+READING_KEY = ('id', 'created_at')
+
+# Reading measure columns, and their keys in the citizensense api
+MEASURES = (
+    ('humidity', 'humidity'),
+    ('pm1', 'pm1'),
+    ('pm2_5', 'pm2.5'),
+    ('pm10', 'pm10'),
+    ('temperature', 'temperature'),
+)
+
+
+class ReadingColumns:
+    '''
+    A batch of readings as column arrays, in the order the api returned them.
+
+    created_at is in epoch milliseconds, and missing measures are NaN.
+    '''
+
+    def __init__(self, ids, created_at, dustbox_ids, measures):
+        self.ids = ids
+        self.created_at = created_at
+        self.dustbox_ids = dustbox_ids
+        self.measures = measures
+
+    def __len__(self):
+        return len(self.ids)
+
+    def take(self, index):
+        '''
+        Select readings by slice, boolean mask or index array
+        '''
+        return ReadingColumns(
+            self.ids[index],
+            self.created_at[index],
+            self.dustbox_ids[index],
+            {column: values[index] for column, values in self.measures.items()},
+        )
+
+    def created_at_datetime(self, index):
+        return datetime.datetime.fromtimestamp(self.created_at[index] / 1000, tz=datetime.timezone.utc)
+
+    def without_duplicates(self, visited=None):
+        '''
+        Drop the readings whose id is in `visited` or earlier in the batch, adding the rest to `visited`
+        '''
+        if visited is None:
+            visited = set()
+
+        keep = np.zeros(len(self), dtype=bool)
+
+        for i, reading_id in enumerate(self.ids):
+            if reading_id not in visited:
+                visited.add(reading_id)
+                keep[i] = True
+
+        return self.take(keep)
+
+    def csv_rows(self):
+        '''
+        The readings as rows of strings (see READING_COLUMNS), as COPY's csv format expects them
+        '''
+        created_at = np.datetime_as_string(self.created_at.astype('datetime64[ms]'), unit='ms', timezone='UTC')
+        measures = {
+            column: np.where(np.isnan(values), '', values.astype(str))
+            for column, values in self.measures.items()
+        }
+
+        return zip(
+            self.ids,
+            created_at,
+            measures['humidity'],
+            measures['pm1'],
+            measures['pm2_5'],
+            measures['pm10'],
+            self.dustbox_ids,
+            measures['temperature'],
+        )
+
+
+def decode_readings(readings):
+    '''
+    Convert a batch of readings from the citizensense api into ReadingColumns, converting each
+    column in one pass.
+
+    Has the same semantics as decode_reading: readings without a timestamp, or with a value
+    that isn't a number, are rejected. Returns (columns, ids of rejected readings).
+    '''
+    ids = np.array([data.get('id') for data in readings], dtype=object)
+    rejected = np.array([reading_id is None for reading_id in ids], dtype=bool)
+
+    created_at, invalid = to_float_array([data.get('createdAt') for data in readings], missing=('never',))
+    rejected |= invalid | np.isnan(created_at)
+
+    measures = {}
+    for column, key in MEASURES:
+        measures[column], invalid = to_float_array([data.get(key) for data in readings])
+        rejected |= invalid
+
+    columns = ReadingColumns(
+        ids,
+        # Rejected timestamps are NaN, which doesn't survive the cast, but they are dropped below
+        np.nan_to_num(created_at).astype(np.int64),
+        np.array([data.get('streamId') for data in readings], dtype=object),
+        measures,
+    )
+
+    return columns.take(~rejected), list(ids[rejected])
+
+
+def to_float_array(values, missing=()):
+    '''
+    Convert a list of api values to a float array, with None and '' (or `missing`) as NaN.
+
+    Returns (array, mask of the values that aren't numbers).
+    '''
+    invalid = np.zeros(len(values), dtype=bool)
+
+    try:
+        # The fast path: numbers, numeric strings and None (which becomes NaN)
+        array = np.array(values, dtype=np.float64)
+
+        if array.shape == (len(values),):
+            return array, invalid
+
+    except (TypeError, ValueError):
+        pass
+
+    array = np.empty(len(values), dtype=np.float64)
+
+    for i, value in enumerate(values):
+        try:
+            array[i] = math.nan if value in missing else convert_float(value, math.nan)
+        except (TypeError, ValueError):
+            array[i] = math.nan
+            invalid[i] = True
+
+    return array, invalid
+
+
+def decode_reading(data):
+    '''
+    Convert a reading from the citizensense api into a row tuple (see READING_COLUMNS).
+
+    This is the reference for the semantics of decode_readings, which the sync uses.
+    '''
+    created_at = convert_timestamp(data.get('createdAt'))
+    if created_at is None:
+        raise ValueError(f'Reading {data.get("id")} has no timestamp')
+
+    return (
+        data['id'],
+        created_at,
+        convert_float(data.get('humidity')),
+        convert_float(data.get('pm1')),
+        convert_float(data.get('pm2.5')),
+        convert_float(data.get('pm10')),
+        data.get('streamId'),
+        convert_float(data.get('temperature')),
+    )
+
+
+def decode_dustbox(data):
+    '''
+    Convert a stream from the citizensense api into a dict of Dustbox field values
+    '''
+    return {
+        'created_at': convert_timestamp(data.get('createdAt')),
+        'description': data.get('description'),
+        'device_number': data.get('deviceNumber'),
+        'entries_number': convert_int(data.get('entriesNumber'), 0),
+        'last_entry_at': convert_timestamp((data.get('lastEntryAt') or {}).get('timestamp')),
+        'location': convert_point(data.get('location')),
+        'public_key': data.get('publicKey'),
+        'slug': data.get('slug'),
+        'title': data.get('title'),
+        'updated_at': convert_timestamp(data.get('updatedAt')),
+    }
+
+
+def iter_readings(response):
+    '''
+    Incrementally parse the readings out of a streamed `/collections/stream/<id>` response
+    '''
+    response.raw.decode_content = True
+    return ijson.items(response.raw, 'data.item', use_float=True)
+
+
+def iter_batches(iterable, size):
+    '''
+    Group an iterable into lists of at most `size` items
+    '''
+    iterator = iter(iterable)
+
+    while True:
+        batch = list(islice(iterator, size))
+        if len(batch) == 0:
+            return
+
+        yield batch
+
+
+def existing_reading_ids(ids):
+    '''
+    Return the subset of `ids` that are already stored, using a single query
+    '''
+    if len(ids) == 0:
+        return set()
+
+    return set(
+        DustboxReading.objects.filter(id__in=ids).values_list('id', flat=True)
+    )
+
+
+def upsert_readings(columns):
+    '''
+    Write ReadingColumns in one INSERT ... ON CONFLICT (id, created_at) DO UPDATE statement, passing each
+    column as an array parameter. Readings of dustboxes that don't exist are left out.
+
+    Returns the number of rows (inserted, updated).
+    '''
+    if len(columns) == 0:
+        return 0, 0
+
+    table = DustboxReading._meta.db_table
+    # The rollups are refreshed in the same transaction, so aggregates never miss readings
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            summarised_upsert(
+                f'''
+                INSERT INTO {table} ({', '.join(STORED_COLUMNS)})
+                SELECT
+                    page.id,
+                    TIMESTAMPTZ 'epoch' + page.created_at * INTERVAL '1 millisecond',
+                    NULLIF(page.humidity, 'NaN'),
+                    NULLIF(page.pm1, 'NaN'),
+                    NULLIF(page.pm2_5, 'NaN'),
+                    NULLIF(page.pm10, 'NaN'),
+                    dustbox.number,
+                    NULLIF(page.temperature, 'NaN')
+                FROM unnest(
+                    %s::varchar[], %s::bigint[], %s::float8[], %s::float8[], %s::float8[], %s::float8[],
+                    %s::varchar[], %s::float8[]
+                ) AS page ({', '.join(READING_COLUMNS)})
+                JOIN {Dustbox._meta.db_table} dustbox ON dustbox.id = page.dustbox_id
+                ON CONFLICT ({', '.join(READING_KEY)}) DO UPDATE SET {upsert_updates()}
+                '''
+            ),
+            [
+                list(columns.ids),
+                columns.created_at.tolist(),
+                columns.measures['humidity'].tolist(),
+                columns.measures['pm1'].tolist(),
+                columns.measures['pm2_5'].tolist(),
+                columns.measures['pm10'].tolist(),
+                list(columns.dustbox_ids),
+                columns.measures['temperature'].tolist(),
+            ],
+        )
+        inserted, updated = cursor.fetchone()
+
+        refresh_rollups_of_columns(columns)
+
+    return inserted, updated
+
+
+def upsert_updates():
+    '''
+    The SET clause of an upsert of readings: every column but the key
+    '''
+    return ', '.join(f'{column} = EXCLUDED.{column}' for column in STORED_COLUMNS if column not in READING_KEY)
+
+
+def summarised_upsert(upsert):
+    '''
+    Wrap an `INSERT INTO <readings> ... ON CONFLICT (id, created_at) DO UPDATE` statement so that it also
+    brings the summary columns of the affected dustboxes (reading_count, first/last_reading_at and
+    has_data), and their DustboxLatestReading, up to date in the same statement.
+
+    The statement returns one row: the number of readings (inserted, updated).
+    '''
+    dustbox_table = Dustbox._meta.db_table
+    latest_table = DustboxLatestReading._meta.db_table
+    latest_columns = ('created_at', *(column for column, _ in MEASURES))
+
+    # xmax is only set on the row versions written by the update branch
+    return f'''
+        WITH upserted AS (
+            {upsert}
+            RETURNING (xmax = 0) AS inserted, id, dustbox_number, {', '.join(latest_columns)}
+        ),
+        summary AS (
+            SELECT
+                dustbox_number,
+                count(*) FILTER (WHERE inserted) AS inserted,
+                min(created_at) AS first_reading_at,
+                max(created_at) AS last_reading_at
+            FROM upserted
+            GROUP BY dustbox_number
+        ),
+        latest AS (
+            SELECT DISTINCT ON (dustbox_number) dustbox_number, id, {', '.join(latest_columns)}
+            FROM upserted
+            ORDER BY dustbox_number, created_at DESC
+        ),
+        summarised AS (
+            UPDATE {dustbox_table} dustbox SET
+                reading_count = dustbox.reading_count + summary.inserted,
+                has_data = TRUE,
+                first_reading_at = LEAST(dustbox.first_reading_at, summary.first_reading_at),
+                last_reading_at = GREATEST(dustbox.last_reading_at, summary.last_reading_at)
+            FROM summary
+            WHERE dustbox.number = summary.dustbox_number
+        ),
+        latest_readings AS (
+            INSERT INTO {latest_table} AS current (dustbox_number, reading_id, {', '.join(latest_columns)})
+            SELECT dustbox_number, id, {', '.join(latest_columns)} FROM latest
+            ON CONFLICT (dustbox_number) DO UPDATE SET
+                reading_id = EXCLUDED.reading_id,
+                {', '.join(f'{column} = EXCLUDED.{column}' for column in latest_columns)}
+            WHERE EXCLUDED.created_at >= current.created_at
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+    '''
+
+
+def convert_timestamp(timestamp):
+    if timestamp == 'never':
+        return None
+
+    ts_float = convert_float(timestamp)
+    if ts_float is None:
+        return None
+
+    return datetime.datetime.fromtimestamp(ts_float / 1000, tz=datetime.timezone.utc)
+
+
+def convert_point(json):
+    if json is None:
+        return None
+
+    y = convert_float(json.get('latitude'))
+    x = convert_float(json.get('longitude'))
+
+    if x is None or y is None:
+        return None
+
+    # Match the srid of the stored points, so that unchanged locations compare equal
+    return Point(x=float(x), y=float(y), srid=4326)
+
+
+def convert_float(json, default=None):
+    if json is None or json == '':
+        return default
+
+    return float(json)
+
+
+def convert_int(json, default=None):
+    if json is None or json == '':
+        return default
+
+    return int(json)
@@ -0,0 +1,53 @@
+'''
+Postgres advisory locks that coordinate sync processes, which may run on different hosts.
+
+Session locks are held by a database connection until they are released, or the connection
+closes (so a crashed sync doesn't leave its streams locked).
+'''
+import zlib
+from contextlib import contextmanager
+
+from django.db import connection
+
+# The first key of every advisory lock taken here, so they don't clash with other users of
+# advisory locks in the same database
+STREAM_LOCKS = 0x5a1c0001
+BOX_SYNC_LOCK = 0x5a1c0002
+
+
+@contextmanager
+def stream_lock(stream_id):
+    '''
+    Try to lock a stream for syncing, without waiting. Yields whether the lock was acquired.
+
+    Stream ids are hashed into the lock key, so two streams can (very rarely) share a lock,
+    which only means one of them waits for the next run.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s, hashtext(%s))', [STREAM_LOCKS, stream_id])
+        (acquired,) = cursor.fetchone()
+
+    try:
+        yield acquired
+
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s, hashtext(%s))', [STREAM_LOCKS, stream_id])
+
+
+def lock_box_sync():
+    '''
+    Wait for other processes to finish writing dustboxes, and keep them waiting until the
+    current transaction ends
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, 0)', [BOX_SYNC_LOCK])
+
+
+def in_shard(stream_id, shard):
+    '''
+    Whether a stream belongs to a shard, given as (index, count) with 0 <= index < count
+    '''
+    index, count = shard
+    return zlib.crc32(stream_id.encode()) % count == index
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from airsift.data.archive import archive_month
+from airsift.data.models import ArchivedMonth, DustboxReading
+from airsift.data.partitions import add_months, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the readings of old months out of the database, into the columnar archive in '
+        'settings.READINGS_ARCHIVE_ROOT. The api keeps serving them from there. Run it regularly (e.g. monthly).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than',
+            default=12,
+            type=int,
+            help='Archive the months that ended at least this many months ago',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = add_months(month_start(timezone.now()), -options['older_than'])
+
+        for month in self.months_to_archive(cutoff):
+            started = time.monotonic()
+            moved = archive_month(month)
+
+            print(f'Archived {moved} readings of {month:%Y-%m} in {time.monotonic() - started:.1f}s')
+
+    def months_to_archive(self, cutoff):
+        '''
+        Every month from the first one that isn't archived up to the cutoff, and the archived months
+        that readings have been written to since
+        '''
+        table = DustboxReading._meta.db_table
+        horizon = ArchivedMonth.horizon()
+
+        with connection.cursor() as cursor:
+            if horizon is None:
+                cursor.execute(f'SELECT min(created_at) FROM {table}')
+                (first,) = cursor.fetchone()
+                late = []
+
+            else:
+                first = horizon
+                cursor.execute(
+                    f'SELECT DISTINCT date_trunc(\'month\', created_at) FROM {table} WHERE created_at < %s',
+                    [horizon],
+                )
+                late = sorted(month for (month,) in cursor.fetchall())
+
+        months = list(late)
+        month = month_start(first) if first is not None else cutoff
+
+        while month < cutoff:
+            months.append(month)
+            month = add_months(month, 1)
+
+        return months
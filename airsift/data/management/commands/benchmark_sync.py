@@ -0,0 +1,148 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from airsift.data.fakeapi import FakeCitizenSenseApi, synthetic_fixture
+from airsift.data.models import Dustbox, DustboxReading, SyncRun
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark sync_data against a local fake citizensense api, at several fleet sizes and '
+        'history lengths. This deletes all dustboxes and readings, so only run it on a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fleet',
+            default='10,100',
+            type=str,
+            help='Comma separated numbers of dustboxes to benchmark',
+        )
+        parser.add_argument(
+            '--history',
+            default='1000,10000',
+            type=str,
+            help='Comma separated numbers of readings per dustbox to benchmark',
+        )
+        parser.add_argument(
+            '--latency',
+            default=0.0,
+            type=float,
+            help='Seconds of latency the fake api adds to every request',
+        )
+        parser.add_argument(
+            '--error-rate',
+            default=0.0,
+            type=float,
+            help='Chance (0-1) of the fake api failing a readings request',
+        )
+        parser.add_argument(
+            '--sync-args',
+            default='',
+            type=str,
+            help='Extra arguments for sync_data, e.g. "--concurrency 8 --copy"',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the results as JSON to this path',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Confirm that all dustboxes and readings in the database may be deleted',
+        )
+
+    def handle(self, *args, **options):
+        if not options.get('reset') and Dustbox.objects.exists():
+            raise CommandError('The database has dustboxes, which benchmarking deletes. Pass --reset to confirm.')
+
+        fleets = [int(size) for size in options['fleet'].split(',')]
+        histories = [int(length) for length in options['history'].split(',')]
+        sync_args = options.get('sync_args', '').split()
+        results = []
+
+        for fleet in fleets:
+            for history in histories:
+                fixture = synthetic_fixture(streams=fleet, readings=history)
+
+                with FakeCitizenSenseApi(
+                    fixture, latency=options['latency'], error_rate=options['error_rate']
+                ) as api:
+                    reset_database()
+
+                    # A full backfill, and then a steady state run with nothing new to sync
+                    for mode, mode_args in (('backfill', ['--all']), ('incremental', [])):
+                        result = self.run_sync(api, mode_args + sync_args)
+                        result.update(mode=mode, fleet=fleet, history=history, requests=len(api.requests))
+                        api.requests.clear()
+
+                        results.append(result)
+                        print(
+                            f'{mode:<12} fleet={fleet:<5} history={history:<8} '
+                            f'{result["seconds"]:>8.2f}s {result["readings_per_second"]:>10.0f} readings/sec '
+                            f'{result["pages_per_second"]:>8.1f} pages/sec, {result["rows"]} rows written, '
+                            f'peak RSS {result["peak_rss_mb"]:.0f}MB, {result["requests"]} requests'
+                        )
+
+        reset_database()
+
+        if options.get('output'):
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+    def run_sync(self, api, sync_args):
+        rows_before = DustboxReading.objects.count()
+        environment = dict(os.environ, CITIZENSENSE_DATA_API=api.url)
+        manage_py = os.path.join(settings.ROOT_DIR, 'manage.py')
+
+        started_at = timezone.now()
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, manage_py, 'sync_data', *sync_args],
+            env=environment,
+            stdout=subprocess.DEVNULL,
+        )
+
+        # wait4 gives the resource usage of this one sync process, rather than all children
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = status
+        seconds = time.perf_counter() - started
+
+        if status != 0:
+            raise CommandError(f'sync_data {" ".join(sync_args)} failed (wait status {status})')
+
+        rows = DustboxReading.objects.count() - rows_before
+        run = SyncRun.objects.filter(started_at__gte=started_at).first()
+
+        if run is None:
+            raise CommandError(f'sync_data {" ".join(sync_args)} saved no report')
+
+        # An incremental run writes next to nothing, so its throughput is in what it fetched rather than wrote
+        totals = run.report['totals']
+        fetched = sum(totals[key] for key in ('inserted', 'updated', 'skipped', 'rejected'))
+
+        return {
+            'args': sync_args,
+            'seconds': round(seconds, 3),
+            'rows': rows,
+            'pages': totals['pages'],
+            'readings': fetched,
+            'pages_per_second': round(totals['pages'] / max(seconds, 1e-6), 1),
+            'readings_per_second': round(fetched / max(seconds, 1e-6), 1),
+            # ru_maxrss is in kilobytes on linux
+            'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        }
+
+
+def reset_database():
+    # Deleting readings first lets Django do it in one query, rather than cascading row by row
+    DustboxReading.objects.all().delete()
+    Dustbox.objects.all().delete()
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from airsift.data.models import Dustbox
+from airsift.data.retention import compact_dustbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Replace raw readings that are older than their retention policy keeps with rollups. '
+        'Each day of a dustbox is compacted in its own short transaction. Run it regularly (e.g. daily).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-days',
+            type=int,
+            help='Compact at most this many days of each dustbox in this run',
+        )
+        parser.add_argument(
+            '--batchsize',
+            default=10000,
+            type=int,
+            help='Number of re-synced readings of compacted days to delete at a time',
+        )
+        parser.add_argument('ids', nargs='*', type=str, help='Dustboxes to compact (by default, all)')
+
+    def handle(self, *args, **options):
+        dustboxes = Dustbox.objects.select_related('retention').order_by('id')
+
+        if len(options.get('ids') or ()) > 0:
+            dustboxes = dustboxes.filter(id__in=options['ids'])
+
+        now = timezone.now()
+
+        for dustbox in dustboxes:
+            started = time.monotonic()
+            days, deleted = compact_dustbox(
+                dustbox, now, max_days=options.get('max_days'), batch_size=options['batchsize'],
+            )
+
+            if days > 0 or deleted > 0:
+                print(
+                    f'Compacted {days} days ({deleted} readings) of dustbox {dustbox.id} '
+                    f'in {time.monotonic() - started:.1f}s'
+                )
@@ -0,0 +1,177 @@
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from contextlib import nullcontext
+
+import ijson
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from airsift.data.bulkload import CopyLoader, deferred_indexes
+from airsift.data.ingest import decode_readings, iter_batches, upsert_readings
+from airsift.data.models import Dustbox
+
+FORMATS = ('json', 'ndjson', 'csv')
+
+
+class Command(BaseCommand):
+    help = 'Import readings from citizensense api dumps (json, ndjson or csv, optionally gzipped)'
+
+    bail_on_error = False
+    copy = False
+    defer_indexes = False
+    batchsize = 5000
+    dustbox_id = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', type=str)
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Format of the files (by default, guessed from the file extension)',
+        )
+        parser.add_argument(
+            '--dustbox',
+            type=str,
+            help='Import all readings into this dustbox, instead of the streamId of each reading',
+        )
+        parser.add_argument(
+            '--batchsize',
+            default=5000,
+            type=int,
+            help='Number of readings to write at a time',
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Load readings through COPY and a staging table (fastest for large imports)',
+        )
+        parser.add_argument(
+            '--defer-indexes',
+            action='store_true',
+            help='Drop secondary reading indexes during the import and rebuild them at the end',
+        )
+        parser.add_argument(
+            '--bail',
+            action='store_true',
+            help='Bail when an error occurs',
+        )
+
+    def handle(self, *args, **options):
+        self.bail_on_error = options.get('bail', False)
+        self.batchsize = options.get('batchsize') or 5000
+        self.copy = options.get('copy', False)
+        self.defer_indexes = options.get('defer_indexes', False)
+        self.dustbox_id = options.get('dustbox', None)
+
+        self.dustbox_ids = set(Dustbox.objects.values_list('id', flat=True))
+
+        if self.dustbox_id is not None and self.dustbox_id not in self.dustbox_ids:
+            raise CommandError(f'Dustbox {self.dustbox_id} does not exist')
+
+        with deferred_indexes() if self.defer_indexes else nullcontext():
+            for path in options['paths']:
+                self.import_file(path, options.get('format') or guess_format(path))
+
+    def import_file(self, path, file_format):
+        print(f'Importing {path} ({file_format})...')
+
+        started = time.monotonic()
+        written = 0
+        rejected = 0
+
+        loader = CopyLoader() if self.copy else nullcontext()
+
+        with open_dump(path) as file, loader:
+            write = loader.write if self.copy else upsert_readings
+
+            for readings_data in iter_batches(iter_dump(file, file_format), self.batchsize):
+                if self.dustbox_id is not None:
+                    for data in readings_data:
+                        data['streamId'] = self.dustbox_id
+
+                columns, failed = decode_readings(readings_data)
+
+                for reading_id in failed:
+                    print(f'Failed to import reading {reading_id}: it has no timestamp or a malformed value')
+
+                    rejected += 1
+                    self.handle_exception()
+
+                known = np.array([dustbox_id in self.dustbox_ids for dustbox_id in columns.dustbox_ids], dtype=bool)
+
+                for reading_id, dustbox_id in zip(columns.ids[~known], columns.dustbox_ids[~known]):
+                    print(f'Failed to import reading {reading_id}: unknown dustbox {dustbox_id}')
+
+                    rejected += 1
+                    self.handle_exception()
+
+                # Later copies of a reading win, as they would when syncing
+                backwards = slice(None, None, -1)
+                columns = columns.take(known).take(backwards).without_duplicates().take(backwards)
+
+                try:
+                    write(columns)
+                    written += len(columns)
+
+                except Exception as ex:
+                    print(f'Failed to import {len(columns)} readings')
+                    print(ex)
+
+                    rejected += len(columns)
+                    self.handle_exception()
+
+                print(f'{written} readings ({rate(written, started):.0f} rows/sec)')
+
+        print(
+            f'Imported {written} readings from {path} in {time.monotonic() - started:.1f}s '
+            f'({rate(written, started):.0f} rows/sec, {rejected} rejected)'
+        )
+
+    def handle_exception(self):
+        if self.bail_on_error:
+            exit(1)
+
+
+def guess_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lstrip('.').lower()
+
+    if extension in ('ndjson', 'jsonl'):
+        return 'ndjson'
+
+    if extension in FORMATS:
+        return extension
+
+    raise CommandError(f'Cannot tell the format of {path}, use --format')
+
+
+def open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+
+    return open(path, 'rb')
+
+
+def iter_dump(file, file_format):
+    '''
+    Stream the reading dicts out of an open (binary) dump file
+    '''
+    if file_format == 'ndjson':
+        return (json.loads(line) for line in file if line.strip())
+
+    if file_format == 'csv':
+        return csv.DictReader(io.TextIOWrapper(file, encoding='utf-8', newline=''))
+
+    # Either a bare list of readings, or the `{"data": [...]}` shape of an api response
+    file = io.BufferedReader(file) if not hasattr(file, 'peek') else file
+    prefix = 'item' if file.peek(64).lstrip()[:1] == b'[' else 'data.item'
+
+    return ijson.items(file, prefix, use_float=True)
+
+
+def rate(rows, started):
+    return rows / max(time.monotonic() - started, 1e-6)
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from airsift.data.partitions import (
+    DEFAULT_PARTITION, add_months, create_partition, detach_partition, list_partitions, month_start,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the monthly partitions of the readings table ahead of time, and detach old ones. '
+        'Run it regularly (e.g. daily) from cron. To move old months out of the database while still '
+        'serving them, use archive_readings instead.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ahead',
+            default=3,
+            type=int,
+            help='Number of months to create partitions for, after the current one',
+        )
+        parser.add_argument(
+            '--older-than',
+            type=int,
+            help='Detach the partitions of months that ended at least this many months ago',
+        )
+        parser.add_argument(
+            '--detach',
+            action='store_true',
+            help='Detach old partitions, leaving their readings in plain tables',
+        )
+
+    def handle(self, *args, **options):
+        self.create_partitions(options['ahead'])
+
+        if options.get('older_than') is not None:
+            self.remove_partitions(options['older_than'], detach=options['detach'])
+
+        self.check_default_partition()
+
+    def create_partitions(self, ahead):
+        existing = {partition.name for partition in list_partitions()}
+        current = month_start(timezone.now())
+
+        for months in range(ahead + 1):
+            name = create_partition(add_months(current, months))
+
+            if name not in existing:
+                print(f'Created partition {name}')
+
+    def remove_partitions(self, older_than, detach=False):
+        cutoff = add_months(month_start(timezone.now()), -older_than)
+        old = [partition for partition in list_partitions() if partition.end is not None and partition.end <= cutoff]
+
+        for partition in old:
+            if detach:
+                with transaction.atomic():
+                    detach_partition(partition)
+
+                print(f'Detached partition {partition.name}')
+
+            else:
+                print(
+                    f'Partition {partition.name} is older than {older_than} months '
+                    f'(pass --detach, or move it to the archive with archive_readings)'
+                )
+
+    def check_default_partition(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {DEFAULT_PARTITION}')
+            (count,) = cursor.fetchone()
+
+        if count > 0:
+            # Partitions can't be created for months that have readings in the default partition
+            print(f'Warning: {count} readings are outside the monthly partitions, in {DEFAULT_PARTITION}')
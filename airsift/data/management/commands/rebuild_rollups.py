@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from airsift.data.models import Dustbox
+from airsift.data.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the minute, hour and day rollups of readings from scratch, e.g. after migrating '
+        'or a bulk load. Rollups of readings that are no longer in the database (archived) are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='Only rebuild rollups from this date, e.g. 2021-01-01 (by default, from each first reading)',
+        )
+        parser.add_argument('ids', nargs='*', type=str, help='Dustboxes to rebuild (by default, all)')
+
+    def handle(self, *args, **options):
+        since = options.get('since', None)
+        dustboxes = Dustbox.objects.order_by('id')
+
+        if len(options.get('ids') or ()) > 0:
+            dustboxes = dustboxes.filter(id__in=options['ids'])
+
+        dustbox_ids = list(dustboxes.values_list('id', flat=True))
+
+        for i, dustbox_id in enumerate(dustbox_ids, start=1):
+            started = time.monotonic()
+
+            # One transaction per dustbox, so that aggregates never see half rebuilt rollups
+            with transaction.atomic():
+                rebuild_rollups(dustbox_id, since=since)
+
+            seconds = time.monotonic() - started
+            print(f'Rebuilt rollups of dustbox {dustbox_id} in {seconds:.1f}s ({i}/{len(dustbox_ids)})')
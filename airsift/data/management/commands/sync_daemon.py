@@ -0,0 +1,248 @@
+import heapq
+import math
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.utils import timezone
+
+from airsift.data.management.commands.sync_data import Command as SyncCommand, create_session
+from airsift.data.models import Dustbox
+from airsift.data.telemetry import SyncReport
+
+
+class Command(SyncCommand):
+    help = 'Keep syncing data from the citizensense api, polling each stream about as often as it reports'
+
+    min_interval = 60
+    max_interval = 24 * 60 * 60
+    refresh_interval = 15 * 60
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bail',
+            action='store_true',
+            help='Exit when an error occurs',
+        )
+        parser.add_argument(
+            '--pagesize',
+            default=50,
+            type=int,
+            help='Size of pages to fetch',
+        )
+        parser.add_argument(
+            '--concurrency',
+            default=4,
+            type=int,
+            help='Number of streams to sync in parallel',
+        )
+        parser.add_argument(
+            '--min-interval',
+            default=60,
+            type=int,
+            help='Seconds between polls of the most active streams',
+        )
+        parser.add_argument(
+            '--max-interval',
+            default=24 * 60 * 60,
+            type=int,
+            help='Seconds between polls of dormant streams',
+        )
+        parser.add_argument(
+            '--refresh',
+            default=15 * 60,
+            type=int,
+            help='Seconds between refreshes of the stream list and its metadata',
+        )
+        parser.add_argument(
+            '--report',
+            type=str,
+            help='Write a JSON report of the syncs since the last refresh to this path',
+        )
+        parser.add_argument(
+            '--prometheus',
+            type=str,
+            help='Write metrics of the syncs since the last refresh to this path (Prometheus textfile format)',
+        )
+        parser.add_argument('ids', nargs='*', type=str)
+
+    def handle(self, *args, **options):
+        self.bail_on_error = options.get('bail', False)
+        self.pagesize = options.get('pagesize') or 50
+        self.numpages = math.inf
+        self.ids_to_sync = options.get('ids', ())
+        self.concurrency = max(options.get('concurrency') or 1, 1)
+        self.min_interval = options.get('min_interval') or 60
+        self.max_interval = max(options.get('max_interval') or 0, self.min_interval)
+        self.refresh_interval = options.get('refresh') or 15 * 60
+        self.report_path = options.get('report', None)
+        self.prometheus_path = options.get('prometheus', None)
+        self.report = None
+
+        # The session and the worker threads' database connections are kept for the
+        # lifetime of the daemon
+        self.session = create_session(pool_size=self.concurrency)
+        self.aborted = threading.Event()
+
+        signal.signal(signal.SIGTERM, lambda *args: self.aborted.set())
+        signal.signal(signal.SIGINT, lambda *args: self.aborted.set())
+
+        self.start_schedule()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            next_refresh = 0
+
+            while not self.aborted.is_set():
+                if time.monotonic() >= next_refresh:
+                    # Each refresh interval is reported as one run
+                    if self.report is not None:
+                        self.finish_report()
+
+                    self.report = SyncReport('sync_daemon')
+                    self.refresh_streams()
+                    next_refresh = time.monotonic() + self.refresh_interval
+
+                self.collect_finished()
+                self.dispatch_due(executor)
+
+                self.aborted.wait(timeout=1)
+
+            print('Stopping, waiting for running syncs to finish...')
+
+        self.collect_finished()
+
+        if self.report is not None:
+            self.finish_report()
+
+        print('Sync daemon stopped')
+
+    def start_schedule(self):
+        self.streams = {}
+        self.observed = {}
+        # (due, stream id) heap, and the ids in it
+        self.schedule = []
+        self.scheduled = set()
+        self.in_flight = {}
+
+    def schedule_poll(self, stream_id, due):
+        # A stream has at most one entry in the schedule, even if it disappears and comes back before it's due
+        heapq.heappush(self.schedule, (due, stream_id))
+        self.scheduled.add(stream_id)
+
+    def refresh_streams(self):
+        try:
+            self.sync_boxes()
+
+        except Exception as ex:
+            print('Failed to refresh streams')
+            print(ex)
+
+            self.handle_exception()
+
+        streams = Dustbox.objects.select_related('sync_state')
+
+        if len(self.ids_to_sync) > 0:
+            streams = streams.filter(id__in=self.ids_to_sync)
+
+        now = time.monotonic()
+        streams = {stream.id: stream for stream in streams}
+
+        for stream in streams.values():
+            observed_at, entries_number = self.observed.get(stream.id, (None, None))
+
+            # Estimate how often the stream reports from its entry count over (at most) the
+            # last max_interval seconds
+            if (
+                observed_at is None
+                or now - observed_at > self.max_interval
+                or stream.entries_number < entries_number
+            ):
+                self.observed[stream.id] = (now, stream.entries_number)
+
+            if stream.id not in self.scheduled and stream.id not in self.in_flight:
+                self.schedule_poll(stream.id, now)
+
+        self.streams = streams
+        print(f'Scheduled {len(self.streams)} streams')
+
+    def dispatch_due(self, executor):
+        now = time.monotonic()
+
+        while len(self.schedule) > 0 and self.schedule[0][0] <= now:
+            due, stream_id = heapq.heappop(self.schedule)
+            self.scheduled.discard(stream_id)
+            stream = self.streams.get(stream_id)
+
+            # Streams that have disappeared upstream drop out of the schedule
+            if stream is None or stream_id in self.in_flight:
+                continue
+
+            self.in_flight[stream_id] = executor.submit(self.poll_stream, stream)
+
+    def should_sync(self, stream):
+        # Streams are polled on a schedule, rather than when their metadata changes
+        return True
+
+    def poll_stream(self, stream):
+        run = self.sync_stream(stream, 1, 1)
+
+        # Another sync held the stream, it's polled again as usual
+        if run is None:
+            return None
+
+        if len(run.errors) > 0 and not connection.is_usable():
+            # Reconnect on the next query, rather than failing every following poll
+            connection.close()
+
+        return run
+
+    def collect_finished(self):
+        for stream_id, future in list(self.in_flight.items()):
+            if not future.done():
+                continue
+
+            del self.in_flight[stream_id]
+
+            # Re-raises the exit of a stream that bailed
+            future.result()
+
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                continue
+
+            interval = poll_interval(
+                last_entry_at=stream.last_entry_at,
+                seconds_per_entry=self.seconds_per_entry(stream),
+                now=timezone.now(),
+                minimum=self.min_interval,
+                maximum=self.max_interval,
+            )
+
+            self.log_v(f'Next poll of stream {stream_id} in {interval}s')
+            self.schedule_poll(stream_id, time.monotonic() + interval)
+
+    def seconds_per_entry(self, stream):
+        observed_at, entries_number = self.observed.get(stream.id, (None, None))
+
+        if observed_at is None or stream.entries_number <= entries_number:
+            return None
+
+        return (time.monotonic() - observed_at) / (stream.entries_number - entries_number)
+
+
+def poll_interval(last_entry_at, seconds_per_entry, now, minimum, maximum):
+    '''
+    Seconds to wait before polling a stream again.
+
+    Streams are polled about as often as they report, and back off the longer they have been
+    silent: a stream that last reported four hours ago is polled hourly, four days ago daily.
+    '''
+    if last_entry_at is None:
+        return maximum
+
+    silence = max((now - last_entry_at).total_seconds(), 0)
+    interval = max(seconds_per_entry or minimum, silence / 4)
+
+    return int(min(max(interval, minimum), maximum))
@@ -1,25 +1,57 @@
-import datetime
 import math
-
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from queue import Empty, Queue
+
+import numpy as np
 import requests
-from django.core.management.base import BaseCommand
+from requests.adapters import HTTPAdapter
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from django.contrib.gis.geos import Point
-
-from airsift.data.models import Dustbox, DustboxReading
+from django.db import connection, transaction
+from django.utils import timezone
+
+from airsift.data.bulkload import CopyLoader, deferred_indexes
+from airsift.data.ingest import (
+    convert_timestamp, decode_dustbox, decode_readings, existing_reading_ids, iter_batches, iter_readings,
+    upsert_readings,
+)
+from airsift.data.locks import in_shard, lock_box_sync, stream_lock
+from airsift.data.models import ArchivedMonth, Dustbox, DustboxReading, DustboxSyncState
+from airsift.data.telemetry import StreamStats, SyncReport
 
 DATA_API_URL = settings.CITIZENSENSE_DATA_API
 
+# Seconds to wait for the api to respond (or send more data) before giving up
+HTTP_TIMEOUT = 60
+
 class Command(BaseCommand):
     help = 'Sync data from the citizensense api'
 
     sync_all = False
+    force = False
+    reconcile = False
+    copy = False
+    defer_indexes = False
     bail_on_error = False
     verbose = False
     max = None
     pagesize = 50
+    batchsize = 1000
     numpages = 1
     ids_to_sync = ()
+    shard = None
+    skipped = 0
+    concurrency = 1
+    page_window = 1
+    session = None
+    aborted = None
+    report = None
+    report_path = None
+    prometheus_path = None
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -27,6 +59,26 @@ class Command(BaseCommand):
             action='store_true',
             help='Fetch all readings',
         )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Fetch readings even for streams whose metadata is unchanged since the last sync',
+        )
+        parser.add_argument(
+            '--reconcile',
+            action='store_true',
+            help='Find readings missing between synced ones (e.g. after a run bailed) and fetch only those pages',
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='With --all, load readings through COPY and a staging table (fastest for large backfills)',
+        )
+        parser.add_argument(
+            '--defer-indexes',
+            action='store_true',
+            help='Drop secondary reading indexes during the sync and rebuild them at the end',
+        )
         parser.add_argument(
             '--bail',
             action='store_true',
@@ -44,163 +96,573 @@ class Command(BaseCommand):
             type=int,
             help='Size of pages to fetch',
         )
+        parser.add_argument(
+            '--batchsize',
+            default=1000,
+            type=int,
+            help='Number of readings to write at a time when streaming with --all or fetching with --page-window',
+        )
+        parser.add_argument(
+            '--concurrency',
+            default=1,
+            type=int,
+            help='Number of streams to sync in parallel',
+        )
+        parser.add_argument(
+            '--page-window',
+            default=1,
+            type=int,
+            help='Number of pages of a stream to fetch in parallel (e.g. to backfill a long stream quickly)',
+        )
+        parser.add_argument(
+            '--report',
+            type=str,
+            help='Write a JSON report of the run to this path',
+        )
+        parser.add_argument(
+            '--prometheus',
+            type=str,
+            help='Write the run metrics to this path, in the Prometheus textfile format',
+        )
+        parser.add_argument(
+            '--shard',
+            type=str,
+            help='Only sync this share of the streams, e.g. 1/3 on the second of three hosts (counting from 0)',
+        )
         parser.add_argument('ids', nargs='*', type=str)
 
     def handle(self, *args, **options):
         self.sync_all = options.get('all', False)
+        self.force = options.get('force', False)
+        self.reconcile = options.get('reconcile', False)
+        self.copy = options.get('copy', False)
+        self.defer_indexes = options.get('defer_indexes', False)
         self.bail_on_error = options.get('bail', False)
         self.pagesize = options.get('pagesize', None)
+        self.batchsize = options.get('batchsize') or 1000
         self.max = options.get('max', None)
         self.ids_to_sync = options.get('ids', ())
+        self.shard = parse_shard(options['shard']) if options.get('shard') else None
+        self.concurrency = max(options.get('concurrency') or 1, 1)
+        self.page_window = max(options.get('page_window') or 1, 1)
+        self.session = create_session(pool_size=self.concurrency * self.page_window)
+        self.aborted = threading.Event()
+        self.report_path = options.get('report', None)
+        self.prometheus_path = options.get('prometheus', None)
+        self.report = SyncReport('sync_data')
 
         if self.max is not None:
             self.numpages = self.max / self.pagesize
         else:
             self.numpages = math.inf
 
+        try:
+            self.sync_boxes()
+
+            with deferred_indexes() if self.defer_indexes else nullcontext():
+                self.sync_readings()
+
+        finally:
+            # Also report runs that bailed
+            self.finish_report()
+
+        print(f'Sync completed! ({self.skipped} unchanged streams skipped)')
+
+    def finish_report(self):
+        self.report.finish()
+        totals = self.report.totals()
 
-        self.sync_boxes()
-        self.sync_readings()
-        print('Sync completed!')
+        print(
+            f'Wrote {totals["inserted"]} new and {totals["updated"]} updated readings '
+            f'in {self.report.seconds:.1f}s ({totals["rows_per_second"]} rows/sec)'
+        )
+
+        try:
+            self.report.save()
+
+            if self.report_path is not None:
+                self.report.write_json(self.report_path)
+
+            if self.prometheus_path is not None:
+                self.report.write_prometheus(self.prometheus_path)
+
+        except Exception as ex:
+            print('Failed to write the sync report')
+            print(ex)
 
     def sync_boxes(self):
         print('Sync streams...')
 
-        streams = requests.get(DATA_API_URL + '/streams', params={
-            'limit': 'off'
-        }).json().get('data', [])
+        streams = self.fetch('/streams', limit='off').json().get('data', [])
 
         print(f'Found {len(streams)} boxes to sync')
 
-        for data in streams:
-            self.log_v(data)
+        # Overlapping syncs would otherwise race to create the same new boxes
+        with transaction.atomic():
+            lock_box_sync()
 
-            try:
+            existing = Dustbox.objects.in_bulk()
+            created = []
+            # Changed boxes, grouped by the fields that changed so that only those are written
+            changed = {}
+
+            for data in streams:
+                self.log_v(data)
+
+                try:
+                    values = decode_dustbox(data)
+
+                except Exception as ex:
+                    print(f'Failed to sync data for stream {data["id"]}')
+                    print(ex)
+
+                    self.handle_exception()
+                    continue
+
+                model = existing.get(data['id'])
+
+                if model is None:
+                    created.append(Dustbox(id=data['id'], **values))
+                    continue
+
+                fields = tuple(field for field, value in values.items() if getattr(model, field) != value)
+
+                if len(fields) > 0:
+                    for field in fields:
+                        setattr(model, field, values[field])
+
+                    changed.setdefault(fields, []).append(model)
+
+            self.save_boxes(created, lambda models: Dustbox.objects.bulk_create(models, batch_size=500))
+
+            for fields, models in changed.items():
+                self.save_boxes(models, lambda models: Dustbox.objects.bulk_update(models, fields, batch_size=500))
+
+        self.report.boxes_created = len(created)
+        self.report.boxes_updated = sum(len(models) for models in changed.values())
+
+        print(f'Created {self.report.boxes_created} boxes, updated {self.report.boxes_updated} boxes')
+
+    def save_boxes(self, models, save):
+        if len(models) == 0:
+            return
+
+        try:
+            with transaction.atomic():
+                save(models)
+
+        except Exception:
+            # Retry one at a time so that a bad stream doesn't prevent the others syncing
+            for model in models:
                 try:
-                    model = Dustbox.objects.get(id=data['id'])
-                except Dustbox.DoesNotExist:
-                    model = Dustbox(id=data['id'])
-
-                model.created_at = convert_timestamp(data.get('createdAt'))
-                model.description = data.get('description')
-                model.device_number = data.get('deviceNumber')
-                model.entries_number = convert_int(data.get('entriesNumber'), 0)
-                model.last_entry_at = convert_timestamp(data.get('lastEntryAt', {}).get('timestamp'))
-                model.location = convert_point(data.get('location'))
-                model.public_key = data.get('publicKey')
-                model.slug = data.get('slug')
-                model.title = data.get('title')
-                model.updated_at = convert_timestamp(data.get('updatedAt'))
-
-                model.save()
+                    with transaction.atomic():
+                        save([model])
+
+                except Exception as ex:
+                    print(f'Failed to sync data for stream {model.id}')
+                    print(ex)
+
+                    self.handle_exception()
+
+    def sync_readings(self):
+        streams = Dustbox.objects.select_related('sync_state')
+
+        if len(self.ids_to_sync) > 0:
+            streams = streams.filter(id__in=self.ids_to_sync)
+
+        streams = list(streams)
+
+        if self.shard is not None:
+            streams = [stream for stream in streams if in_shard(stream.id, self.shard)]
+
+        changed = [stream for stream in streams if self.should_sync(stream)]
+
+        self.skipped = len(streams) - len(changed)
+        self.report.streams_skipped = self.skipped
+        if self.skipped > 0:
+            print(f'Skipping {self.skipped} streams with no new readings')
+
+        streams = changed
+        total = len(streams)
+
+        if self.concurrency == 1:
+            for i, stream in enumerate(streams, start=1):
+                self.sync_stream(stream, i, total)
+
+            return
+
+        queue = Queue()
+        for i, stream in enumerate(streams, start=1):
+            queue.put((i, stream))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            workers = [executor.submit(self.sync_worker, queue, total) for _ in range(self.concurrency)]
+
+        # Re-raise the exit of a worker that bailed
+        for worker in workers:
+            worker.result()
+
+    def sync_worker(self, queue, total):
+        try:
+            while not self.aborted.is_set():
+                try:
+                    i, stream = queue.get_nowait()
+                except Empty:
+                    return
+
+                self.sync_stream(stream, i, total)
+
+        except BaseException:
+            # Stop the other workers picking up new streams
+            self.aborted.set()
+            raise
+
+        finally:
+            # Django opens a database connection per thread, so release this worker's one
+            connection.close()
+
+    def should_sync(self, stream):
+        return self.sync_all or self.force or self.reconcile or not is_unchanged(stream)
+
+    def sync_stream(self, stream, i, total):
+        # Another sync process (e.g. an overlapping cron run, or a worker on another host) may
+        # be syncing this stream, in which case it's left to that one
+        with stream_lock(stream.id) as locked:
+            if not locked:
+                print(f'Skipping stream {stream.id}, which another sync is working on ({i}/{total})')
+                self.report.add_locked_stream()
+                return None
+
+            # The sync state may have moved on while we waited for the stream
+            state = DustboxSyncState.objects.filter(dustbox_id=stream.id).first()
+            if state is not None:
+                stream.sync_state = state
+
+            if not self.should_sync(stream):
+                print(f'Skipping stream {stream.id}, which another sync just synced ({i}/{total})')
+                self.report.add_locked_stream()
+                return None
+
+            return self.sync_locked_stream(stream, i, total)
+
+    def sync_locked_stream(self, stream, i, total):
+        print(f'Sync readings from stream {stream.id} ({i}/{total})')
+
+        run = StreamRun(stream, get_sync_state(stream))
+
+        try:
+            try:
+                with run.stats.timer('seconds'):
+                    self.sync_stream_reading(run)
 
             except Exception as ex:
-                print(f'Failed to sync data for stream {data["id"]}')
+                print(f'Failed to sync readings for stream {stream.id}')
                 print(ex)
 
+                run.errors.append(ex)
                 self.handle_exception()
 
-    def sync_readings(self):
-        i = 1
+        finally:
+            self.save_sync_state(run)
 
-        if len(self.ids_to_sync) == 0:
-            total = len(Dustbox.objects.all())
+            run.stats.status = 'failed' if len(run.errors) > 0 else 'synced'
+            self.report.add_stream(stream.id, run.stats)
 
-            for stream in Dustbox.objects.all():
-                print(f'Sync readings from stream {stream.id} ({i}/{total})')
-                self.sync_stream_reading(stream)
-                i += 1
-        else:
-            total = len(self.ids_to_sync)
+        return run
 
-            for stream in Dustbox.objects.filter(id__in=self.ids_to_sync):
-                print(f'Sync readings from stream {stream.id} ({i}/{total})')
-                self.sync_stream_reading(stream)
-                i += 1
-
-    def sync_stream_reading(self, stream):
+    def sync_stream_reading(self, run):
         if self.sync_all:
-            self.sync_all_stream_readings(stream)
+            run.complete = self.sync_all_stream_readings(run)
+
+        elif self.reconcile:
+            run.complete = self.reconcile_stream_readings(run)
+
+        elif self.page_window > 1:
+            self.sync_stream_reading_window(run)
 
         else:
             page = 0
-            visited = set()
 
-            while page < self.numpages and self.sync_stream_reading_page(stream, page=page, visited=visited):
+            while (
+                page < self.numpages
+                and not self.aborted.is_set()
+                and self.sync_stream_reading_page(run, page=page)
+            ):
                 page += 1
 
-    def sync_stream_reading_page(self, stream, page, visited):
-        print(f'Page {page}...')
-
-        readings_data = requests.get(DATA_API_URL + '/collections/stream/' + str(stream.id), params={
-            'page': page,
-            'limit': self.pagesize,
-        }).json().get('data', [])
+    def sync_stream_reading_page(self, run, page):
+        readings_data = self.fetch_page(run, page)
+        run.stats.add('pages', 1)
 
         # Finish syncing, at latest, when we reach the end of the data
         if len(readings_data) == 0:
-            print(f'Synced all readings for stream {stream.id}')
+            print(f'Synced all readings for stream {run.stream.id}')
+            run.complete = True
             return False
 
-        return self.sync_stream_readings(stream, readings_data, visited=visited)
+        return self.sync_stream_readings(run, readings_data, visited=run.visited)
+
+    def sync_stream_reading_window(self, run):
+        '''
+        Fetch a sliding window of `page_window` pages at once, so that a long stream syncs at
+        the speed of the connection rather than one round trip per page.
+
+        Pages are still written in order, in batches of about `batchsize` readings, so the
+        de-duplication of readings and stopping at the first synced one work as in sequence.
+        '''
+        pending = deque()
+        next_page = 0
+        batch = []
+
+        with ThreadPoolExecutor(max_workers=self.page_window) as executor:
+            try:
+                while not self.aborted.is_set():
+                    while len(pending) < self.page_window and next_page < self.numpages:
+                        pending.append(executor.submit(self.fetch_page, run, next_page))
+                        next_page += 1
+
+                    if len(pending) == 0:
+                        break
+
+                    readings_data = pending.popleft().result()
+                    run.stats.add('pages', 1)
+
+                    # Finish syncing, at latest, when we reach the end of the data
+                    end = len(readings_data) == 0
+                    batch += readings_data
+
+                    if (end or len(batch) >= self.batchsize or len(pending) == 0) and len(batch) > 0:
+                        if not self.sync_stream_readings(run, batch, visited=run.visited):
+                            return
+
+                        batch = []
+
+                    if end:
+                        print(f'Synced all readings for stream {run.stream.id}')
+                        run.complete = True
+                        return
+
+            finally:
+                # Don't wait for pages that are no longer needed
+                for future in pending:
+                    future.cancel()
+
+    def fetch_page(self, run, page):
+        print(f'Stream {run.stream.id}: page {page}...')
+
+        response = self.fetch(
+            '/collections/stream/' + str(run.stream.id), stats=run.stats, page=page, limit=self.pagesize
+        )
+
+        with run.stats.timer('decode_seconds'):
+            return response.json().get('data', [])
+
+    def sync_all_stream_readings(self, run):
+        response = self.fetch(
+            '/collections/stream/' + str(run.stream.id), stats=run.stats, streaming=True, limit='off'
+        )
+        loader = CopyLoader() if self.copy else nullcontext()
+        batches = iter_batches(iter_readings(response), self.batchsize)
+
+        # Parse the (possibly huge) response as it arrives instead of buffering it
+        with response, loader:
+            if self.copy:
+                run.write = loader.write
+
+            while not self.aborted.is_set():
+                with run.stats.timer('transfer_seconds'):
+                    readings_data = next(batches, None)
+
+                if readings_data is None:
+                    break
+
+                run.stats.add('pages', 1)
+                print(f'Stream {run.stream.id}: writing {len(readings_data)} readings...')
+
+                # Duplicates only need to be excluded within a batch, so we don't keep every
+                # id of the stream in memory
+                self.sync_stream_readings(run, readings_data)
+
+            # The loader merges when it exits
+            merge_started = time.perf_counter()
+
+        if self.copy:
+            run.stats.add('db_seconds', time.perf_counter() - merge_started)
+            run.stats.add('inserted', loader.inserted)
+            run.stats.add('updated', loader.updated)
+
+        return not self.aborted.is_set()
+
+    def reconcile_stream_readings(self, run):
+        '''
+        Find the ranges of upstream readings that are missing locally, and fetch only the pages
+        that hold them.
+
+        The api has no per-day counts, but its readings are listed newest first, so the reading
+        at upstream index k (one `limit=1` probe) should have k + 1 local readings at or after
+        it. Fewer means readings up to k are missing, which lets us bisect for where each gap
+        starts and ends. A gap costs about 2 * log2(entries) probes and the pages it spans.
+
+        Readings before the archive horizon or the stream's compaction aren't in the readings
+        table any more, so only the readings after both are reconciled.
+        '''
+        probe = ReadingProbe(self, run)
+        total = run.stream.entries_number
+        local = DustboxReading.objects.filter(dustbox=run.stream)
+        run.floor = reconcile_floor(run.stream)
+
+        if run.floor is not None:
+            total = bisect(0, total, lambda k: probe.created_at(k) is None or probe.created_at(k) < run.floor)
+            local = local.filter(created_at__gte=run.floor)
+
+        local = local.count()
+
+        if local >= total:
+            print(f'Stream {run.stream.id}: all {total} readings are synced')
+            return True
+
+        print(f'Stream {run.stream.id}: {total - local} of {total} readings are missing, looking for gaps...')
+
+        start = 0
+
+        while start < total and not self.aborted.is_set():
+            missing = probe.missing(total - 1)
+
+            if missing is None:
+                print(f'Stream {run.stream.id}: the api has fewer readings than it reports, stopping')
+                return False
+
+            if missing == 0:
+                break
+
+            # Everything before `start` is synced, so the first gap starts at the first index
+            # with readings missing, and ends at the last index where all readings since are missing
+            first = bisect(start, total, lambda k: probe.missing(k) > 0)
+            last = bisect(first, total, lambda k: probe.missing(k) < k - first + 1) - 1
+
+            print(
+                f'Stream {run.stream.id}: readings {first}-{last} are missing '
+                f'({probe.created_at(last):%Y-%m-%d %H:%M} to {probe.created_at(first):%Y-%m-%d %H:%M})'
+            )
+
+            for page in range(first // self.pagesize, last // self.pagesize + 1):
+                if self.aborted.is_set():
+                    return False
+
+                self.sync_stream_reading_page(run, page=page)
 
-    def sync_all_stream_readings(self, stream):
-        readings_data = requests.get(DATA_API_URL + '/collections/stream/' + str(stream.id), params={
-            'limit': 'off'
-        }).json().get('data', [])
+            start = last + 1
 
-        return self.sync_stream_readings(stream, readings_data)
+        return not self.aborted.is_set()
 
-    def sync_stream_readings(self, stream, readings_data, visited=None):
+    def sync_stream_readings(self, run, readings_data, visited=None):
         for data in readings_data:
             self.log_v(data)
 
-            if visited is None:
-                visited = set()
+        with run.stats.timer('decode_seconds'):
+            columns, rejected = decode_readings(readings_data)
 
             # Handle pagination alignment errors
-            if data['id'] in visited:
-                continue
+            columns = columns.without_duplicates(visited)
 
-            try:
-                model = DustboxReading.objects.filter(id=data['id']).first()
-
-                # Finish syncing this stream if we've got this reading in the database
-                #
-                # This assumes that the API repsonse is ordered by date of reading so that
-                # having a reading implies also having all earlier readings.
-                #
-                # (and that our script never bailed. the --all switch can be used to backfill
-                # manually if that happens)
-                if model is not None and not self.sync_all:
-                    print(f'Dustbox {stream.id} is up to date')
-                    return False
+            # Readings before the floor are archived or compacted, and writing them again would count them twice
+            if run.floor is not None:
+                columns = columns.take(columns.created_at >= run.floor.timestamp() * 1000)
 
-                if model is None:
-                    model = DustboxReading()
-                    model.id = data['id']
+        for reading_id in rejected:
+            print(f'Failed to sync data for stream reading {reading_id}: it has no timestamp or a malformed value')
 
-                model.created_at = convert_timestamp(data.get('createdAt'))
-                model.humidity = convert_float(data.get('humidity'))
-                model.pm1 = convert_float(data.get('pm1'))
-                model.pm2_5 = convert_float(data.get('pm2.5'))
-                model.pm10 = convert_float(data.get('pm10'))
-                model.dustbox_id = data.get('streamId')
-                model.temperature = convert_float(data.get('temperature'))
+            # A malformed reading will never sync, so it doesn't hold back the watermark
+            run.stats.add('rejected', 1)
+            self.handle_exception()
 
-                model.save()
-                visited.add(model.id)
+        up_to_date = False
 
-            except Exception as ex:
-                print(f'Failed to sync data for stream reading {data["id"]}')
-                print(ex)
+        if not self.sync_all and not self.reconcile:
+            # Finish syncing this stream once we reach a reading we already have in the database
+            #
+            # This assumes that the API repsonse is ordered by date of reading so that
+            # having a reading implies also having all earlier readings. If a run left a gap
+            # behind, --reconcile finds and fills it.
+            i = run.first_synced(columns)
 
-                self.handle_exception()
+            if i is not None:
+                run.stats.add('skipped', len(columns) - i)
+                columns = columns.take(slice(0, i))
+                up_to_date = True
+
+        try:
+            with run.stats.timer('db_seconds'):
+                written = run.write(columns)
+
+            # The COPY loader only counts rows once they are merged
+            if isinstance(written, tuple):
+                run.stats.add('inserted', written[0])
+                run.stats.add('updated', written[1])
+
+            run.add(columns)
+
+        except Exception as ex:
+            print(f'Failed to sync {len(columns)} readings for stream {run.stream.id}')
+            print(ex)
+
+            run.errors.append(ex)
+            self.handle_exception()
+
+        if up_to_date:
+            print(f'Dustbox {run.stream.id} is up to date')
+            run.complete = True
+            return False
 
         return True
 
+    def save_sync_state(self, run):
+        now = timezone.now()
+        state = run.state or DustboxSyncState(dustbox=run.stream)
+        state.last_run_at = now
+
+        if len(run.errors) > 0:
+            state.last_error = str(run.errors[-1])
+
+        else:
+            state.last_error = ''
+            state.last_success_at = now
+
+            # Only move the watermark when everything between it and the newest reading was
+            # synced, otherwise a partial run (e.g. with --max) would leave a gap behind it
+            if run.complete:
+                state.entries_number = run.stream.entries_number
+                state.last_entry_at = run.stream.last_entry_at
+
+                if run.newest is not None and (
+                    state.last_reading_at is None or run.newest[1] >= state.last_reading_at
+                ):
+                    state.last_reading_id, state.last_reading_at = run.newest
+
+        state.save()
+        run.stream.sync_state = state
+
+    def fetch(self, path, stats=None, streaming=False, **params):
+        started = time.perf_counter()
+        response = self.session.get(DATA_API_URL + path, params=params, stream=streaming, timeout=HTTP_TIMEOUT)
+
+        if stats is not None:
+            # elapsed is the time until the response headers arrived; without streaming the
+            # rest of the time went on downloading the body
+            latency = response.elapsed.total_seconds()
+            stats.add_latency(latency)
+
+            if not streaming:
+                stats.add('transfer_seconds', max(time.perf_counter() - started - latency, 0))
+
+        response.raise_for_status()
+        return response
+
     def handle_exception(self):
         if self.bail_on_error:
+            # exit() only stops the current thread, so stop the others too; the main thread
+            # re-raises it from the worker's future
+            self.aborted.set()
             exit(1)
 
     def log_v(self, *args):
@@ -208,36 +670,153 @@ class Command(BaseCommand):
             print(*args)
 
 
-def convert_timestamp(timestamp):
-    if timestamp == 'never':
-        return None
+def parse_shard(shard):
+    '''
+    Parse a shard given as "INDEX/COUNT" into (index, count)
+    '''
+    try:
+        index, count = (int(part) for part in shard.split('/'))
+    except ValueError:
+        raise CommandError(f'Invalid shard {shard}, expected INDEX/COUNT (e.g. 0/3)')
 
-    ts_float = convert_float(timestamp)
-    if ts_float is None:
-        return None
+    if not 0 <= index < count:
+        raise CommandError(f'Invalid shard {shard}, INDEX must be between 0 and COUNT - 1')
+
+    return index, count
 
-    return datetime.datetime.fromtimestamp(ts_float / 1000, tz=datetime.timezone.utc)
 
-def convert_point(json):
-    if json is None:
+def get_sync_state(stream):
+    try:
+        return stream.sync_state
+    except DustboxSyncState.DoesNotExist:
         return None
 
-    y = convert_float(json.get('latitude'))
-    x = convert_float(json.get('longitude'))
 
-    if x is None or y is None:
-        return None
+def reconcile_floor(stream):
+    '''
+    The archive horizon or the end of the stream's compacted readings, whichever is later (None
+    if neither): the readings before it are no longer all in the readings table
+    '''
+    return max(
+        (floor for floor in (ArchivedMonth.horizon(), stream.compacted_before) if floor is not None), default=None,
+    )
+
+
+def is_unchanged(stream):
+    '''
+    Whether the stream's upstream metadata is the same as when its readings were last synced
+    '''
+    state = get_sync_state(stream)
+
+    return (
+        state is not None
+        and state.entries_number == stream.entries_number
+        and state.last_entry_at == stream.last_entry_at
+    )
+
+
+class StreamRun:
+    '''
+    The progress of syncing the readings of one stream
+    '''
+
+    def __init__(self, stream, state=None):
+        self.stream = stream
+        self.state = state
+        self.visited = set()
+        self.errors = []
+        self.stats = StreamStats()
+        self.complete = False
+        # Writes ReadingColumns to the database
+        self.write = upsert_readings
+        # (id, created_at) of the newest reading written during this run
+        self.newest = None
+        # Readings before this aren't written (see reconcile_floor)
+        self.floor = None
+
+    def first_synced(self, columns):
+        '''
+        The index of the first reading that a previous run already synced, if any
+        '''
+        if self.state is None or self.state.last_reading_at is None:
+            # No watermark yet (e.g. the first run of a stream), so look the readings up
+            existing = existing_reading_ids(list(columns.ids))
+            synced = np.array([reading_id in existing for reading_id in columns.ids], dtype=bool)
+        else:
+            watermark = self.state.last_reading_at.timestamp() * 1000
+            synced = (columns.ids == self.state.last_reading_id) | (columns.created_at < watermark)
+
+        indexes = np.flatnonzero(synced)
+
+        return int(indexes[0]) if len(indexes) > 0 else None
+
+    def add(self, columns):
+        if len(columns) == 0:
+            return
+
+        i = int(np.argmax(columns.created_at))
+        created_at = columns.created_at_datetime(i)
 
-    return Point(x=float(x), y=float(y))
+        if self.newest is None or created_at > self.newest[1]:
+            self.newest = (columns.ids[i], created_at)
 
-def convert_float(json, default=None):
-    if json is None or json == '':
-        return default
 
-    return float(json)
+class ReadingProbe:
+    '''
+    Compares single upstream readings, by index, with the local readings of a stream
+    '''
+
+    def __init__(self, command, run):
+        self.command = command
+        self.run = run
+        # Upstream index -> created_at, which doesn't change while we fill gaps
+        self.timestamps = {}
+
+    def created_at(self, index):
+        if index not in self.timestamps:
+            response = self.command.fetch(
+                '/collections/stream/' + str(self.run.stream.id), stats=self.run.stats, page=index, limit=1
+            )
+            readings_data = response.json().get('data', [])
+            self.timestamps[index] = convert_timestamp(readings_data[0].get('createdAt')) if readings_data else None
+
+        return self.timestamps[index]
+
+    def missing(self, index):
+        '''
+        How many of the upstream readings 0..index are missing locally (None past the end of the api's readings)
+        '''
+        created_at = self.created_at(index)
+        if created_at is None:
+            return None
+
+        local = DustboxReading.objects.filter(dustbox=self.run.stream, created_at__gte=created_at).count()
+
+        return max(index + 1 - local, 0)
+
+
+def bisect(low, high, predicate):
+    '''
+    The first index in [low, high) for which `predicate` holds (assuming it holds for every
+    index after that one too), or high if there is none
+    '''
+    while low < high:
+        middle = (low + high) // 2
+
+        if predicate(middle):
+            high = middle
+        else:
+            low = middle + 1
+
+    return low
 
-def convert_int(json, default=None):
-    if json is None or json == '':
-        return default
 
-    return int(json)
+def create_session(pool_size=1):
+    '''
+    A keep-alive http session that can be shared between `pool_size` threads
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 10))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
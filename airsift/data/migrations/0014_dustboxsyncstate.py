@@ -0,0 +1,26 @@
+# Generated by Django 3.0.11 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0013_dustboxpage_map_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DustboxSyncState',
+            fields=[
+                ('dustbox', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sync_state', serialize=False, to='data.Dustbox')),
+                ('last_reading_id', models.CharField(max_length=36, null=True)),
+                ('last_reading_at', models.DateTimeField(null=True)),
+                ('entries_number', models.IntegerField(null=True)),
+                ('last_run_at', models.DateTimeField(null=True)),
+                ('last_success_at', models.DateTimeField(null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
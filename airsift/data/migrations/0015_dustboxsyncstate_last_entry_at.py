@@ -0,0 +1,18 @@
+# Generated by Django 3.0.11 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0014_dustboxsyncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dustboxsyncstate',
+            name='last_entry_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.11 on 2026-10-18 12:41
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0015_dustboxsyncstate_last_entry_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=64)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('report', django.contrib.postgres.fields.jsonb.JSONField()),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
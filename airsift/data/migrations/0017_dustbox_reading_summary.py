@@ -0,0 +1,77 @@
+# Generated by Django 3.0.11 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0016_syncrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dustbox',
+            name='reading_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dustbox',
+            name='has_data',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='dustbox',
+            name='first_reading_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dustbox',
+            name='last_reading_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dustbox',
+            name='latest_pm1',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dustbox',
+            name='latest_pm2_5',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dustbox',
+            name='latest_pm10',
+            field=models.FloatField(null=True),
+        ),
+        # Summarise the readings synced so far, from then on the sync keeps the columns up to date
+        migrations.RunSQL(
+            '''
+            UPDATE data_dustbox dustbox SET
+                reading_count = summary.reading_count,
+                has_data = TRUE,
+                first_reading_at = summary.first_reading_at,
+                last_reading_at = summary.last_reading_at,
+                latest_pm1 = latest.pm1,
+                latest_pm2_5 = latest.pm2_5,
+                latest_pm10 = latest.pm10
+            FROM (
+                SELECT
+                    dustbox_id,
+                    count(*) AS reading_count,
+                    min(created_at) AS first_reading_at,
+                    max(created_at) AS last_reading_at
+                FROM data_dustboxreading
+                GROUP BY dustbox_id
+            ) AS summary
+            JOIN (
+                SELECT DISTINCT ON (dustbox_id) dustbox_id, pm1, pm2_5, pm10
+                FROM data_dustboxreading
+                ORDER BY dustbox_id, created_at DESC
+            ) AS latest USING (dustbox_id)
+            WHERE dustbox.id = summary.dustbox_id
+            ''',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 3.0.11 on 2026-10-18 14:20
+
+from django.db import migrations
+
+# Partition the readings table by month of created_at, moving the existing readings into it.
+#
+# Postgres can only enforce unique constraints on a partitioned table if they include the
+# partition key, so the primary key becomes (id, created_at). Partitions are created for every
+# month from the first reading (but not before 2000, bogus timestamps go to the default
+# partition) to three months from now; `manage_partitions` creates them from then on.
+PARTITION_READINGS = '''
+ALTER TABLE data_dustboxreading RENAME TO data_dustboxreading_unpartitioned;
+
+CREATE TABLE data_dustboxreading (LIKE data_dustboxreading_unpartitioned INCLUDING DEFAULTS)
+PARTITION BY RANGE (created_at);
+
+CREATE TABLE data_dustboxreading_default PARTITION OF data_dustboxreading DEFAULT;
+
+DO $$
+DECLARE
+    month timestamptz;
+    last_month timestamptz := date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' + interval '3 months';
+BEGIN
+    SELECT date_trunc('month', min(created_at) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' INTO month
+    FROM data_dustboxreading_unpartitioned
+    WHERE created_at >= '2000-01-01 00:00:00+00';
+
+    month := LEAST(COALESCE(month, last_month), last_month);
+
+    WHILE month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF data_dustboxreading FOR VALUES FROM (%L) TO (%L)',
+            'data_dustboxreading_p' || to_char(month AT TIME ZONE 'UTC', 'YYYY_MM'),
+            month,
+            (month AT TIME ZONE 'UTC' + interval '1 month') AT TIME ZONE 'UTC'
+        );
+        month := (month AT TIME ZONE 'UTC' + interval '1 month') AT TIME ZONE 'UTC';
+    END LOOP;
+END $$;
+
+INSERT INTO data_dustboxreading SELECT * FROM data_dustboxreading_unpartitioned;
+
+DROP TABLE data_dustboxreading_unpartitioned;
+
+ALTER TABLE data_dustboxreading ADD PRIMARY KEY (id, created_at);
+
+ALTER TABLE data_dustboxreading ADD CONSTRAINT data_dustboxreading_dustbox_id_fk_data_dustbox_id
+FOREIGN KEY (dustbox_id) REFERENCES data_dustbox (id) DEFERRABLE INITIALLY DEFERRED;
+
+CREATE INDEX data_dustboxreading_dustbox_id ON data_dustboxreading (dustbox_id);
+
+ANALYZE data_dustboxreading;
+'''
+
+UNPARTITION_READINGS = '''
+ALTER TABLE data_dustboxreading RENAME TO data_dustboxreading_partitioned;
+
+CREATE TABLE data_dustboxreading (LIKE data_dustboxreading_partitioned INCLUDING DEFAULTS);
+
+INSERT INTO data_dustboxreading SELECT * FROM data_dustboxreading_partitioned;
+
+DROP TABLE data_dustboxreading_partitioned;
+
+ALTER TABLE data_dustboxreading ADD PRIMARY KEY (id);
+
+ALTER TABLE data_dustboxreading ADD CONSTRAINT data_dustboxreading_dustbox_id_fk_data_dustbox_id
+FOREIGN KEY (dustbox_id) REFERENCES data_dustbox (id) DEFERRABLE INITIALLY DEFERRED;
+
+CREATE INDEX data_dustboxreading_dustbox_id ON data_dustboxreading (dustbox_id);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0017_dustbox_reading_summary'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_READINGS, UNPARTITION_READINGS),
+    ]
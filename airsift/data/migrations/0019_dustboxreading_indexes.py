@@ -0,0 +1,69 @@
+# Generated by Django 3.0.11 on 2026-10-18 15:02
+
+from django.db import migrations
+
+TABLE = 'data_dustboxreading'
+
+# Readings are read per dustbox and time range, newest first; the measures are included so
+# that those reads (and aggregates over them) can be answered from the index alone
+DUSTBOX_CREATED_INDEX = (
+    'dustbox_created',
+    'USING btree (dustbox_id, created_at DESC) INCLUDE (pm1, pm2_5, pm10, humidity, temperature)',
+)
+
+# Readings arrive roughly in time order, so a tiny BRIN index serves scans of a time range
+# across all dustboxes
+CREATED_BRIN_INDEX = ('created_brin', 'USING brin (created_at)')
+
+
+def partitions(cursor):
+    cursor.execute(
+        'SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass',
+        [TABLE],
+    )
+    return [name for (name,) in cursor.fetchall()]
+
+
+def create_index_concurrently(cursor, suffix, definition):
+    '''
+    Postgres can't build an index on a partitioned table concurrently, so build it on each
+    partition concurrently and attach those to an (until then invalid) index on the parent
+    '''
+    index = f'{TABLE}_{suffix}'
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {index} ON ONLY {TABLE} {definition}')
+
+    for partition in partitions(cursor):
+        partition_index = f'{partition}_{suffix}'
+        cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} {definition}')
+        cursor.execute(f'ALTER INDEX {index} ATTACH PARTITION {partition_index}')
+
+
+def create_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for suffix, definition in (DUSTBOX_CREATED_INDEX, CREATED_BRIN_INDEX):
+            create_index_concurrently(cursor, suffix, definition)
+
+        # Lookups by dustbox (e.g. cascading deletes) use the composite index instead
+        cursor.execute(f'DROP INDEX IF EXISTS {TABLE}_dustbox_id')
+
+
+def drop_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        create_index_concurrently(cursor, 'dustbox_id', '(dustbox_id)')
+
+        for suffix, _ in (DUSTBOX_CREATED_INDEX, CREATED_BRIN_INDEX):
+            cursor.execute(f'DROP INDEX IF EXISTS {TABLE}_{suffix}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('data', '0018_partition_dustboxreading'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
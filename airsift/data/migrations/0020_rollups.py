@@ -0,0 +1,110 @@
+# Generated by Django 3.0.11 on 2026-10-18 15:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0019_dustboxreading_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DustboxReadingMinute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('pm1_sum', models.FloatField(null=True)),
+                ('pm1_count', models.IntegerField(default=0)),
+                ('pm1_min', models.FloatField(null=True)),
+                ('pm1_max', models.FloatField(null=True)),
+                ('pm2_5_sum', models.FloatField(null=True)),
+                ('pm2_5_count', models.IntegerField(default=0)),
+                ('pm2_5_min', models.FloatField(null=True)),
+                ('pm2_5_max', models.FloatField(null=True)),
+                ('pm10_sum', models.FloatField(null=True)),
+                ('pm10_count', models.IntegerField(default=0)),
+                ('pm10_min', models.FloatField(null=True)),
+                ('pm10_max', models.FloatField(null=True)),
+                ('humidity_sum', models.FloatField(null=True)),
+                ('humidity_count', models.IntegerField(default=0)),
+                ('humidity_min', models.FloatField(null=True)),
+                ('humidity_max', models.FloatField(null=True)),
+                ('temperature_sum', models.FloatField(null=True)),
+                ('temperature_count', models.IntegerField(default=0)),
+                ('temperature_min', models.FloatField(null=True)),
+                ('temperature_max', models.FloatField(null=True)),
+                ('dustbox', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='data.Dustbox')),
+            ],
+            options={
+                'abstract': False,
+                'unique_together': {('dustbox', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DustboxReadingHour',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('pm1_sum', models.FloatField(null=True)),
+                ('pm1_count', models.IntegerField(default=0)),
+                ('pm1_min', models.FloatField(null=True)),
+                ('pm1_max', models.FloatField(null=True)),
+                ('pm2_5_sum', models.FloatField(null=True)),
+                ('pm2_5_count', models.IntegerField(default=0)),
+                ('pm2_5_min', models.FloatField(null=True)),
+                ('pm2_5_max', models.FloatField(null=True)),
+                ('pm10_sum', models.FloatField(null=True)),
+                ('pm10_count', models.IntegerField(default=0)),
+                ('pm10_min', models.FloatField(null=True)),
+                ('pm10_max', models.FloatField(null=True)),
+                ('humidity_sum', models.FloatField(null=True)),
+                ('humidity_count', models.IntegerField(default=0)),
+                ('humidity_min', models.FloatField(null=True)),
+                ('humidity_max', models.FloatField(null=True)),
+                ('temperature_sum', models.FloatField(null=True)),
+                ('temperature_count', models.IntegerField(default=0)),
+                ('temperature_min', models.FloatField(null=True)),
+                ('temperature_max', models.FloatField(null=True)),
+                ('dustbox', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='data.Dustbox')),
+            ],
+            options={
+                'abstract': False,
+                'unique_together': {('dustbox', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DustboxReadingDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('pm1_sum', models.FloatField(null=True)),
+                ('pm1_count', models.IntegerField(default=0)),
+                ('pm1_min', models.FloatField(null=True)),
+                ('pm1_max', models.FloatField(null=True)),
+                ('pm2_5_sum', models.FloatField(null=True)),
+                ('pm2_5_count', models.IntegerField(default=0)),
+                ('pm2_5_min', models.FloatField(null=True)),
+                ('pm2_5_max', models.FloatField(null=True)),
+                ('pm10_sum', models.FloatField(null=True)),
+                ('pm10_count', models.IntegerField(default=0)),
+                ('pm10_min', models.FloatField(null=True)),
+                ('pm10_max', models.FloatField(null=True)),
+                ('humidity_sum', models.FloatField(null=True)),
+                ('humidity_count', models.IntegerField(default=0)),
+                ('humidity_min', models.FloatField(null=True)),
+                ('humidity_max', models.FloatField(null=True)),
+                ('temperature_sum', models.FloatField(null=True)),
+                ('temperature_count', models.IntegerField(default=0)),
+                ('temperature_min', models.FloatField(null=True)),
+                ('temperature_max', models.FloatField(null=True)),
+                ('dustbox', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='data.Dustbox')),
+            ],
+            options={
+                'abstract': False,
+                'unique_together': {('dustbox', 'bucket')},
+            },
+        ),
+    ]
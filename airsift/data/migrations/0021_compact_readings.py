@@ -0,0 +1,175 @@
+# Generated by Django 3.0.11 on 2026-10-18 16:10
+
+import airsift.data.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+ROLLUP_TABLES = ('data_dustboxreadingminute', 'data_dustboxreadinghour', 'data_dustboxreadingday')
+MEASURES = ('humidity', 'pm1', 'pm2_5', 'pm10', 'temperature')
+LATEST_MEASURES = ('latest_pm1', 'latest_pm2_5', 'latest_pm10')
+
+# Readings (and rollups) refer to dustboxes by a 4 byte number instead of a 36 character id,
+# and store their measures as 4 byte reals. All of a table's columns are converted in one
+# ALTER TABLE, so each table is only rewritten once.
+NUMBER_DUSTBOXES = '''
+CREATE SEQUENCE data_dustbox_number_seq;
+
+ALTER TABLE data_dustbox
+    ADD COLUMN number integer,
+    ALTER COLUMN latest_pm1 TYPE real,
+    ALTER COLUMN latest_pm2_5 TYPE real,
+    ALTER COLUMN latest_pm10 TYPE real;
+
+UPDATE data_dustbox SET number = nextval('data_dustbox_number_seq');
+
+ALTER TABLE data_dustbox
+    ALTER COLUMN number SET NOT NULL,
+    ALTER COLUMN number SET DEFAULT nextval('data_dustbox_number_seq'),
+    ADD CONSTRAINT data_dustbox_number_key UNIQUE (number);
+
+ALTER SEQUENCE data_dustbox_number_seq OWNED BY data_dustbox.number;
+
+CREATE FUNCTION pg_temp.dustbox_number(varchar) RETURNS integer
+AS 'SELECT number FROM data_dustbox WHERE id = $1' LANGUAGE sql STABLE;
+'''
+
+UNNUMBER_DUSTBOXES = '''
+ALTER TABLE data_dustbox
+    DROP COLUMN number,
+    ALTER COLUMN latest_pm1 TYPE double precision,
+    ALTER COLUMN latest_pm2_5 TYPE double precision,
+    ALTER COLUMN latest_pm10 TYPE double precision;
+'''
+
+
+def drop_dustbox_references(table):
+    # The foreign keys to dustboxes, and the varchar_pattern_ops indexes Django adds to
+    # varchar foreign keys, which can't be converted to integers
+    return f'''
+    DO $$
+    DECLARE
+        constraint_name name;
+        index_name text;
+    BEGIN
+        FOR constraint_name IN
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = '{table}'::regclass AND contype = 'f' AND conparentid = 0
+        LOOP
+            EXECUTE format('ALTER TABLE {table} DROP CONSTRAINT %I', constraint_name);
+        END LOOP;
+
+        FOR index_name IN
+            SELECT indexrelid::regclass::text FROM pg_index
+            JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+            WHERE indrelid = '{table}'::regclass AND relname LIKE '%\\_like'
+        LOOP
+            EXECUTE 'DROP INDEX ' || index_name;
+        END LOOP;
+    END $$;
+    '''
+
+
+def compact_table(table, measures=()):
+    alterations = [
+        'ALTER COLUMN dustbox_id TYPE integer USING pg_temp.dustbox_number(dustbox_id)',
+        *(f'ALTER COLUMN {measure} TYPE real' for measure in measures),
+    ]
+
+    return f'''
+    {drop_dustbox_references(table)}
+
+    ALTER TABLE {table} {', '.join(alterations)};
+
+    ALTER TABLE {table} RENAME COLUMN dustbox_id TO dustbox_number;
+
+    ALTER TABLE {table} ADD CONSTRAINT {table}_dustbox_number_fk
+    FOREIGN KEY (dustbox_number) REFERENCES data_dustbox (number) DEFERRABLE INITIALLY DEFERRED;
+    '''
+
+
+def expand_table(table, measures=()):
+    alterations = [
+        'ALTER COLUMN dustbox_number TYPE varchar(36) USING pg_temp.dustbox_id(dustbox_number)',
+        *(f'ALTER COLUMN {measure} TYPE double precision' for measure in measures),
+    ]
+
+    return f'''
+    CREATE OR REPLACE FUNCTION pg_temp.dustbox_id(integer) RETURNS varchar
+    AS 'SELECT id FROM data_dustbox WHERE number = $1' LANGUAGE sql STABLE;
+
+    {drop_dustbox_references(table)}
+
+    ALTER TABLE {table} {', '.join(alterations)};
+
+    ALTER TABLE {table} RENAME COLUMN dustbox_number TO dustbox_id;
+
+    ALTER TABLE {table} ADD CONSTRAINT {table}_dustbox_id_fk_data_dustbox_id
+    FOREIGN KEY (dustbox_id) REFERENCES data_dustbox (id) DEFERRABLE INITIALLY DEFERRED;
+    '''
+
+
+def dustbox_number_field():
+    return models.ForeignKey(
+        db_column='dustbox_number',
+        on_delete=django.db.models.deletion.CASCADE,
+        to='data.Dustbox',
+        to_field='number',
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0020_rollups'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    NUMBER_DUSTBOXES
+                    + compact_table('data_dustboxreading', MEASURES)
+                    + ''.join(compact_table(table) for table in ROLLUP_TABLES),
+                    ''.join(expand_table(table) for table in ROLLUP_TABLES)
+                    + expand_table('data_dustboxreading', MEASURES)
+                    + UNNUMBER_DUSTBOXES,
+                ),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='dustbox',
+                    name='number',
+                    field=airsift.data.models.SequenceField(editable=False, unique=True),
+                ),
+                *(
+                    migrations.AlterField(
+                        model_name='dustbox',
+                        name=measure,
+                        field=airsift.data.models.RealField(null=True),
+                    )
+                    for measure in LATEST_MEASURES
+                ),
+                migrations.AlterField(
+                    model_name='dustboxreading',
+                    name='dustbox',
+                    field=dustbox_number_field(),
+                ),
+                *(
+                    migrations.AlterField(
+                        model_name='dustboxreading',
+                        name=measure,
+                        field=airsift.data.models.RealField(null=True),
+                    )
+                    for measure in MEASURES
+                ),
+                *(
+                    migrations.AlterField(
+                        model_name=model_name,
+                        name='dustbox',
+                        field=dustbox_number_field(),
+                    )
+                    for model_name in ('dustboxreadingminute', 'dustboxreadinghour', 'dustboxreadingday')
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.11 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0021_compact_readings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateTimeField(unique=True)),
+                ('readings', models.IntegerField(default=0)),
+                ('archived_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['month'],
+            },
+        ),
+    ]
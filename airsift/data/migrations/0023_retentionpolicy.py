@@ -0,0 +1,27 @@
+# Generated by Django 3.0.11 on 2026-10-18 17:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0022_archivedmonth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dustbox',
+            name='compacted_before',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('dustbox', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='retention', serialize=False, to='data.Dustbox')),
+                ('raw_days', models.PositiveIntegerField()),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], default='hour', max_length=16)),
+            ],
+        ),
+    ]
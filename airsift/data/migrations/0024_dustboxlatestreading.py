@@ -0,0 +1,44 @@
+# Generated by Django 3.0.11 on 2026-10-18 17:50
+
+import airsift.data.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The newest reading of each dustbox that has readings, using the (dustbox_number, created_at) index
+BACKFILL_LATEST_READINGS = '''
+INSERT INTO data_dustboxlatestreading
+    (dustbox_number, reading_id, created_at, humidity, pm1, pm2_5, pm10, temperature)
+SELECT dustbox.number, latest.id, latest.created_at, latest.humidity, latest.pm1, latest.pm2_5, latest.pm10,
+    latest.temperature
+FROM data_dustbox dustbox
+CROSS JOIN LATERAL (
+    SELECT * FROM data_dustboxreading reading
+    WHERE reading.dustbox_number = dustbox.number
+    ORDER BY reading.created_at DESC
+    LIMIT 1
+) AS latest;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0023_retentionpolicy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DustboxLatestReading',
+            fields=[
+                ('dustbox', models.OneToOneField(db_column='dustbox_number', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_reading', serialize=False, to='data.Dustbox', to_field='number')),
+                ('reading_id', models.CharField(max_length=36)),
+                ('created_at', models.DateTimeField()),
+                ('humidity', airsift.data.models.RealField(null=True)),
+                ('pm1', airsift.data.models.RealField(null=True)),
+                ('pm2_5', airsift.data.models.RealField(null=True)),
+                ('pm10', airsift.data.models.RealField(null=True)),
+                ('temperature', airsift.data.models.RealField(null=True)),
+            ],
+        ),
+        migrations.RunSQL(BACKFILL_LATEST_READINGS, migrations.RunSQL.noop),
+    ]
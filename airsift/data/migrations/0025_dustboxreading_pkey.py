@@ -0,0 +1,22 @@
+# Generated by Django 3.0.11 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0024_dustboxlatestreading'),
+    ]
+
+    operations = [
+        # The primary key (id, created_at) of the partitioned table already enforces it (see 0018)
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='dustboxreading',
+                    constraint=models.UniqueConstraint(fields=('id', 'created_at'), name='data_dustboxreading_pkey'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.11 on 2026-10-18 19:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0025_dustboxreading_pkey'),
+    ]
+
+    # The latest values are in DustboxLatestReading (see 0024)
+    operations = [
+        migrations.RemoveField(
+            model_name='dustbox',
+            name='latest_pm1',
+        ),
+        migrations.RemoveField(
+            model_name='dustbox',
+            name='latest_pm2_5',
+        ),
+        migrations.RemoveField(
+            model_name='dustbox',
+            name='latest_pm10',
+        ),
+    ]
@@ -1,3 +1,4 @@
+import datetime
 from io import BytesIO
 import urllib
 from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
@@ -7,6 +8,7 @@ from wagtail.images.edit_handlers import ImageChooserPanel
 from airsift.utils.models import TweakedSeoMixin
 from django.db import models
 from django.contrib.gis.db.models import PointField
+from django.contrib.postgres.fields import JSONField
 from wagtail.api import APIField
 from wagtail.core.models import Page, Site
 from wagtailseo.models import SeoMixin, SeoType
@@ -17,8 +19,39 @@ from wagtail.images.models import Image
 from django.core.files.images import ImageFile
 from django.core.files.uploadedfile import UploadedFile
 
+class RealField(models.FloatField):
+    '''
+    A single precision (4 byte) float column, which is plenty for sensor values
+    '''
+
+    def db_type(self, connection):
+        return 'real'
+
+class DatabaseDefault(models.Expression):
+    '''
+    The database default of a column, as the value of a field in an INSERT
+    '''
+
+    def as_sql(self, compiler, connection):
+        return 'DEFAULT', []
+
+class SequenceField(models.IntegerField):
+    '''
+    An integer column numbered by the database (from the sequence that is its DEFAULT), which is read
+    back from the INSERT, including those of bulk_create, rather than fetched up front
+    '''
+    db_returning = True
+
+    def pre_save(self, model_instance, add):
+        if add and getattr(model_instance, self.attname) is None:
+            return DatabaseDefault(output_field=self)
+
+        return super().pre_save(model_instance, add)
+
 class Dustbox(models.Model):
     id = models.CharField(primary_key=True, max_length=36)
+    # A compact surrogate key, which readings and rollups refer to instead of the upstream id
+    number = SequenceField(unique=True, editable=False)
     created_at = models.DateTimeField()
     description = models.TextField()
     device_number = models.CharField(null=True, max_length=256)
@@ -30,6 +63,15 @@ class Dustbox(models.Model):
     title = models.CharField(max_length=256)
     updated_at = models.DateTimeField(null=True)
 
+    # A summary of the readings stored here (as opposed to the upstream entries_number and
+    # last_entry_at), kept up to date by the sync as it writes readings
+    reading_count = models.IntegerField(default=0)
+    has_data = models.BooleanField(default=False)
+    first_reading_at = models.DateTimeField(null=True)
+    last_reading_at = models.DateTimeField(null=True)
+    # Readings before this have been compacted into rollups (see airsift.data.retention)
+    compacted_before = models.DateTimeField(null=True)
+
     @property
     def url(self, *args, **kwargs):
         return f'/dustboxes/inspect/{self.id}'
@@ -46,6 +88,10 @@ class Dustbox(models.Model):
         APIField('slug'),
         APIField('title'),
         APIField('updated_at'),
+        APIField('reading_count'),
+        APIField('has_data'),
+        APIField('first_reading_at'),
+        APIField('last_reading_at'),
     ]
 
     def get_page_representation(self):
@@ -148,12 +194,169 @@ class DustboxPage(TweakedSeoMixin, Page):
     def seo_author(self) -> str:
         return None
 
+class UnsupportedOperation(TypeError):
+    '''
+    An operation of the ORM that a model can't support, e.g. saving a single reading
+    '''
+
 class DustboxReading(models.Model):
+    '''
+    A reading of a dustbox. The table is partitioned by month (see airsift.data.partitions), so its
+    primary key is (id, created_at): the keys of a partitioned table have to include the partition key.
+
+    Django has no composite primary keys, so `id` stands in for it, but nothing makes an id unique by
+    itself, and the ORM's lookups and writes by pk could match a reading in another month. Readings are
+    written by airsift.data.ingest, which upserts on (id, created_at), and filtered and deleted as
+    querysets; they are never saved through the ORM.
+    '''
+    # Upstream ids aren't guaranteed to be UUIDs, so they stay strings
     id = models.CharField(primary_key=True, max_length=36)
     created_at = models.DateTimeField()
-    humidity = models.FloatField(null=True)
-    pm1 = models.FloatField(null=True)
-    pm2_5 = models.FloatField(null=True)
-    pm10 = models.FloatField(null=True)
-    dustbox = models.ForeignKey(Dustbox, on_delete=models.CASCADE)
-    temperature = models.FloatField(null=True)
+    humidity = RealField(null=True)
+    pm1 = RealField(null=True)
+    pm2_5 = RealField(null=True)
+    pm10 = RealField(null=True)
+    dustbox = models.ForeignKey(Dustbox, on_delete=models.CASCADE, to_field='number', db_column='dustbox_number')
+    temperature = RealField(null=True)
+
+    class Meta:
+        # The real primary key
+        constraints = [
+            models.UniqueConstraint(fields=['id', 'created_at'], name='data_dustboxreading_pkey'),
+        ]
+
+    def save(self, *args, **kwargs):
+        raise UnsupportedOperation('Readings are written with airsift.data.ingest.upsert_readings')
+
+    def delete(self, *args, **kwargs):
+        raise UnsupportedOperation('Readings are deleted by (id, created_at), e.g. as a filtered queryset')
+
+class DustboxLatestReading(models.Model):
+    '''
+    The newest reading of each dustbox, kept up to date by the ingest path (see
+    airsift.data.ingest.summarised_upsert), for showing every dustbox on the map at once
+    '''
+    dustbox = models.OneToOneField(
+        Dustbox, primary_key=True, on_delete=models.CASCADE, to_field='number', db_column='dustbox_number',
+        related_name='latest_reading',
+    )
+    reading_id = models.CharField(max_length=36)
+    created_at = models.DateTimeField()
+    humidity = RealField(null=True)
+    pm1 = RealField(null=True)
+    pm2_5 = RealField(null=True)
+    pm10 = RealField(null=True)
+    temperature = RealField(null=True)
+
+class ReadingRollup(models.Model):
+    '''
+    Readings of a dustbox aggregated over a time bucket, for each measure the sum, count (of
+    readings with a value), min and max, maintained by the ingest path (see airsift.data.rollups)
+    '''
+    dustbox = models.ForeignKey(Dustbox, on_delete=models.CASCADE, to_field='number', db_column='dustbox_number')
+    bucket = models.DateTimeField()
+    pm1_sum = models.FloatField(null=True)
+    pm1_count = models.IntegerField(default=0)
+    pm1_min = models.FloatField(null=True)
+    pm1_max = models.FloatField(null=True)
+    pm2_5_sum = models.FloatField(null=True)
+    pm2_5_count = models.IntegerField(default=0)
+    pm2_5_min = models.FloatField(null=True)
+    pm2_5_max = models.FloatField(null=True)
+    pm10_sum = models.FloatField(null=True)
+    pm10_count = models.IntegerField(default=0)
+    pm10_min = models.FloatField(null=True)
+    pm10_max = models.FloatField(null=True)
+    humidity_sum = models.FloatField(null=True)
+    humidity_count = models.IntegerField(default=0)
+    humidity_min = models.FloatField(null=True)
+    humidity_max = models.FloatField(null=True)
+    temperature_sum = models.FloatField(null=True)
+    temperature_count = models.IntegerField(default=0)
+    temperature_min = models.FloatField(null=True)
+    temperature_max = models.FloatField(null=True)
+
+    class Meta:
+        abstract = True
+        unique_together = [('dustbox', 'bucket')]
+
+class DustboxReadingMinute(ReadingRollup):
+    pass
+
+class DustboxReadingHour(ReadingRollup):
+    pass
+
+class DustboxReadingDay(ReadingRollup):
+    pass
+
+class ArchivedMonth(models.Model):
+    '''
+    A month of readings that has been moved out of the database, into the columnar archive
+    (see airsift.data.archive)
+    '''
+    month = models.DateTimeField(unique=True)
+    readings = models.IntegerField(default=0)
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['month']
+
+    @classmethod
+    def horizon(cls):
+        '''
+        The end of the last archived month (months are archived oldest first, so every reading
+        before it is in the archive), or None if nothing has been archived
+        '''
+        last = cls.objects.aggregate(last=models.Max('month'))['last']
+
+        if last is None:
+            return None
+
+        return (last.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+class RetentionPolicy(models.Model):
+    '''
+    How many days the raw readings of a dustbox are kept for, after which they are only kept as
+    rollups of `resolution` and coarser (see airsift.data.retention).
+
+    Dustboxes without a policy of their own follow settings.READINGS_RETENTION_DAYS and
+    READINGS_RETENTION_RESOLUTION, if set.
+    '''
+    RESOLUTIONS = [('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')]
+
+    dustbox = models.OneToOneField(Dustbox, primary_key=True, on_delete=models.CASCADE, related_name='retention')
+    raw_days = models.PositiveIntegerField()
+    resolution = models.CharField(max_length=16, choices=RESOLUTIONS, default='hour')
+
+class DustboxSyncState(models.Model):
+    '''
+    How far the readings of a dustbox have been synced from the citizensense api.
+
+    The watermark (last_reading_at/last_reading_id) is only advanced at the end of a
+    complete run, so a crashed or partial run is picked up again by the next one.
+
+    entries_number and last_entry_at are the stream's upstream metadata as of that run,
+    which lets the sync skip streams that haven't reported anything since.
+    '''
+    dustbox = models.OneToOneField(Dustbox, primary_key=True, on_delete=models.CASCADE, related_name='sync_state')
+    last_reading_id = models.CharField(null=True, max_length=36)
+    last_reading_at = models.DateTimeField(null=True)
+    entries_number = models.IntegerField(null=True)
+    last_entry_at = models.DateTimeField(null=True)
+    last_run_at = models.DateTimeField(null=True)
+    last_success_at = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True, default='')
+
+class SyncRun(models.Model):
+    '''
+    The telemetry report of a sync run (see airsift.data.telemetry).
+
+    Only the last settings.SYNC_RUN_HISTORY runs are kept.
+    '''
+    command = models.CharField(max_length=64)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True)
+    report = JSONField()
+
+    class Meta:
+        ordering = ['-started_at']
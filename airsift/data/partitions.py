@@ -0,0 +1,141 @@
+'''
+Monthly range partitions of the readings table (partitioned by created_at, see migration 0018).
+
+Partitions are named after the month they hold, e.g. data_dustboxreading_p2021_01. Readings
+outside every monthly partition go to data_dustboxreading_default, which should stay (nearly)
+empty: `manage_partitions` creates partitions ahead of time so that new readings never land there.
+'''
+import datetime
+import re
+
+from django.db import connection
+
+from airsift.data.models import Dustbox, DustboxReading
+
+TABLE = DustboxReading._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+NAME_PATTERN = re.compile(rf'{TABLE}_p(\d{{4}})_(\d{{2}})')
+
+
+class Partition:
+    def __init__(self, name, start=None, end=None):
+        self.name = name
+        # [start, end) of the created_at values in the partition, None for the default partition
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f'<Partition {self.name} [{self.start}, {self.end})>'
+
+
+def month_start(date):
+    return datetime.datetime(date.year, date.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y_%m}'
+
+
+def list_partitions():
+    '''
+    The partitions of the readings table, oldest first (and the default partition last)
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            ''',
+            [TABLE],
+        )
+        names = [name for (name,) in cursor.fetchall()]
+
+    partitions = []
+
+    # The range of a monthly partition is in its name
+    for name in names:
+        match = NAME_PATTERN.fullmatch(name)
+
+        if match is None:
+            partitions.append(Partition(name))
+        else:
+            start = datetime.datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=datetime.timezone.utc)
+            partitions.append(Partition(name, start, add_months(start, 1)))
+
+    return sorted(partitions, key=lambda partition: (partition.start is None, partition.start))
+
+
+def create_partition(month):
+    '''
+    Create the partition for the month starting at `month`, if it doesn't exist yet.
+
+    Postgres checks that no rows of the month are in the default partition, so partitions
+    should be created before their month begins.
+    '''
+    name = partition_name(month)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)',
+            [month.isoformat(), add_months(month, 1).isoformat()],
+        )
+
+    return name
+
+
+def detach_partition(partition, summaries=True):
+    '''
+    Detach a partition, leaving it as a plain table, and take its readings out of the dustbox summaries
+    (unless `summaries` is False, for readings that are still served from elsewhere)
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION "{partition.name}"')
+
+    if summaries:
+        subtract_from_summaries(
+            f'SELECT dustbox_number, count(*), min(created_at) FROM "{partition.name}" GROUP BY dustbox_number'
+        )
+
+
+def drop_partition(partition):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE "{partition.name}"')
+
+
+def subtract_from_summaries(removed, params=(), rolled_up=False):
+    '''
+    Update the summary columns of dustboxes after some of their readings have been taken out of the
+    readings table. `removed` is a query of the dustbox_number, count and first created_at (or a
+    datetime at or before it) of those readings, by dustbox.
+
+    If the readings are `rolled_up` (e.g. compacted), their rollups still serve them, so only
+    reading_count changes: the dustboxes still have data, from the same first reading.
+    '''
+    dustbox_table = Dustbox._meta.db_table
+    history = '' if rolled_up else f''',
+                has_data = dustbox.reading_count > removed.count,
+                first_reading_at = CASE
+                    WHEN dustbox.first_reading_at < removed.first THEN dustbox.first_reading_at
+                    ELSE (
+                        SELECT min(created_at) FROM {TABLE} reading WHERE reading.dustbox_number = dustbox.number
+                    )
+                END'''
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            UPDATE {dustbox_table} dustbox SET
+                reading_count = GREATEST(dustbox.reading_count - removed.count, 0){history}
+            FROM ({removed}) AS removed (dustbox_number, count, first)
+            WHERE dustbox.number = removed.dustbox_number
+            ''',
+            params,
+        )
@@ -1,17 +1,21 @@
-from rest_framework.viewsets import ReadOnlyModelViewSet
+from rest_framework.viewsets import ReadOnlyModelViewSet, ViewSet
 from rest_framework_nested import routers
 from rest_framework.response import Response
+from rest_framework.decorators import action
 from django.shortcuts import get_object_or_404
 from rest_framework import pagination, generics, filters
 from django_filters import rest_framework as django_filters
 from airsift.data import models, serializers
-from django.db.models import Avg
+from rest_framework.exceptions import ValidationError
 from airsift.datastories.forms import create_choices
+from airsift.data.aggregates import MEANS, AggregateQuery, BatchAggregateQuery, InvalidAggregate
+from airsift.data.archive import with_archive
 class ItemSetPagination(pagination.LimitOffsetPagination):
      default_limit = 1
 
 class ItemSetFiltering(django_filters.FilterSet):
     date = django_filters.DateTimeFromToRangeFilter(
+        field_name="created_at",
         label="Date (Between)"
     )
     class Meta:
@@ -24,6 +28,12 @@ class DustboxesViewSet(ReadOnlyModelViewSet):
     queryset = models.Dustbox.objects.all()
     serializer_class = serializers.DustboxSerializer
 
+    @action(detail=False)
+    def latest(self, request):
+        # The newest reading of every dustbox in one query, rather than a readings request per dustbox
+        queryset = models.DustboxLatestReading.objects.select_related('dustbox')
+        return Response(serializers.DustboxLatestReadingSerializer(queryset, many=True).data)
+
 class DustboxesReadingsViewSet(ReadOnlyModelViewSet):
     queryset = models.DustboxReading.objects.all()
     serializer_class = serializers.DustboxReadingSerializer
@@ -36,56 +46,40 @@ class DustboxesReadingsViewSet(ReadOnlyModelViewSet):
     def get_queryset(self):
         queryset = self.queryset
         queryset = queryset.filter(
-            dustbox=self.kwargs['dustbox_pk']
-        )
+            dustbox__in=dustbox_number(self.kwargs['dustbox_pk'])
+        ).select_related('dustbox')
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        # Readings that have been archived are paged through after (or before) those in the database
+        after, before = self.date_range()
+        queryset = with_archive(
+            self.filter_queryset(self.get_queryset()), self.kwargs['dustbox_pk'], after=after, before=before,
+        )
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(list(queryset), many=True)
+        return Response(serializer.data)
+
+    def date_range(self):
+        # The (inclusive) bounds of the date filter, which the archived readings are filtered by too
+        filterset = self.filterset_class(self.request.query_params, queryset=self.get_queryset())
+        dates = filterset.form.cleaned_data.get('date') if filterset.is_valid() else None
+        return (dates.start, dates.stop) if dates else (None, None)
+
 class AggItemSetFiltering(django_filters.FilterSet):
     date = django_filters.DateTimeFromToRangeFilter(
         label="Date (Between)",
         required=False
     )
-    # allowed_measures = ('pm1', 'pm2_5', 'pm10',)
-    # measure = django_filters.ChoiceFilter(
-    #     choices=create_choices(*allowed_measures), null_value='pm2_5', label='Air quality measure'
-    # )
     limit = django_filters.NumberFilter(required=False, label='Return limit')
 
-    allowed_means = (
-        # Trunc
-        'millennium',
-        'century',
-        'decade',
-        'year',
-        'quarter',
-        'month',
-        'week',
-        'day',
-        'hour',
-        'minute',
-        'second',
-        'milliseconds',
-        'microseconds',
-        # Part
-        'century',
-        'decade',
-        'year',
-        'month',
-        'day',
-        'hour',
-        'minute',
-        'second',
-        'microseconds',
-        'milliseconds',
-        'dow',
-        'doy',
-        'epoch',
-        'isodow',
-        'isoyear',
-        'timezone',
-        'timezone_hour',
-        'timezone_minute',
-    )
+    # The units of date_trunc and date_part
+    allowed_means = tuple(dict.fromkeys((*MEANS['trunc'], *MEANS['part'])))
 
     mean = django_filters.ChoiceFilter(
         choices=create_choices(*allowed_means), null_value='day', label='Mean time period to average over',
@@ -101,7 +95,6 @@ class AggItemSetFiltering(django_filters.FilterSet):
         fields = [
             "date",
             "mean",
-            # "measure"
         ]
 class DustboxesReadingAggregatesViewSet(ReadOnlyModelViewSet):
     queryset = models.DustboxReading.objects.all()
@@ -113,48 +106,44 @@ class DustboxesReadingAggregatesViewSet(ReadOnlyModelViewSet):
     ordering = ['-created_at']
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-
-        queryset = queryset.filter(
-            dustbox=self.kwargs['dustbox_pk']
-        )
-        date_after = self.request.query_params.get('date_after', None)
-        if date_after:
-            queryset = queryset.filter(created_at__gte=date_after)
-        date_before = self.request.query_params.get('date_before', None)
-        if date_before:
-            queryset = queryset.filter(created_at__lte=date_before)
-
-        mean = self.request.query_params.get('mean', 'minute')
-
-        orderby = self.request.query_params.get('ordering') or self.ordering
-        orderby = orderby if type(orderby) is list or isinstance(orderby, list) else [orderby]
-
-        limit = int(self.request.query_params.get('limit') or self.pagination_class.default_limit)
-
-        mode = self.request.query_params.get('mode', 'trunc')
-
-        queryset = queryset\
-            .extra({
-                'created_at': f'date_{mode}(\'{mean}\', "created_at")'
-            })\
-            .values(
-                'created_at'
-            )\
-            .annotate(**{
-                'pm1': Avg('pm1'),
-                'pm2_5': Avg('pm2_5'),
-                'pm10': Avg('pm10'),
-                'humidity': Avg('humidity'),
-                'temperature': Avg('temperature'),
-            })\
-            .order_by(*orderby)\
-            [:limit]
-
-        return Response(queryset)
+        try:
+            query = AggregateQuery.from_params(
+                self.kwargs['dustbox_pk'], self.request.query_params, limit=self.pagination_class.default_limit,
+            )
+        except InvalidAggregate as error:
+            raise ValidationError({error.param: [error.message]})
+
+        return Response(query.execute())
+
+class AggregatesViewSet(ViewSet):
+    # The aggregates of several dustboxes in one request, on the same datetimes, with the dustboxes themselves
+    def list(self, request):
+        try:
+            query = BatchAggregateQuery.from_params(
+                self.request.query_params, limit=ItemSetPagination.default_limit,
+            )
+        except InvalidAggregate as error:
+            raise ValidationError({error.param: [error.message]})
+
+        datetimes, series = query.execute()
+
+        return Response({
+            'created_at': datetimes,
+            'dustboxes': [
+                {'dustbox': serializers.DustboxSerializer(dustbox).data, **measures}
+                for dustbox, measures in series
+            ],
+        })
+
+def dustbox_number(dustbox_id):
+    '''
+    A subquery of the number of a dustbox, which readings and rollups refer to it by
+    '''
+    return models.Dustbox.objects.filter(id=dustbox_id).values('number')
 
 router = routers.DefaultRouter()
 router.register(r'dustboxes', DustboxesViewSet, basename='dustboxes')
+router.register(r'aggregates', AggregatesViewSet, basename='aggregates')
 
 dustbox_router = routers.NestedSimpleRouter(router, r'dustboxes', lookup='dustbox')
 dustbox_router.register(r'readings', DustboxesReadingsViewSet, basename='readings')
@@ -0,0 +1,200 @@
+'''
+Retention of raw readings: after a number of days, the readings of a dustbox are only kept as their
+rollups (see airsift.data.rollups) of a resolution and coarser, which keep the sum, count, min and
+max of every measure.
+
+The policy of a dustbox is its RetentionPolicy, or else the global settings.READINGS_RETENTION_DAYS
+and READINGS_RETENTION_RESOLUTION. Compaction works through a dustbox's readings a day at a time,
+each day in its own short transaction, and records the end of the last day it compacted in
+Dustbox.compacted_before. The rollups of the days compacted before that are final: readings written
+there again (e.g. by re-syncing a stream) don't change them, and are deleted by the next compaction.
+Readings written later to the days in between that had none (e.g. a backfill) are compacted like
+any others.
+
+Readings before the archive horizon are left to the archive (see airsift.data.archive). Deleted
+readings are taken out of the dustbox's reading_count, but its rollups are still data, so it keeps
+has_data and first_reading_at.
+'''
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.functions import Coalesce, Greatest
+
+from airsift.data.models import ArchivedMonth, Dustbox, DustboxReading, DustboxReadingDay, RetentionPolicy
+from airsift.data.partitions import subtract_from_summaries
+from airsift.data.rollups import TIERS, refresh_rollups
+
+TABLE = DustboxReading._meta.db_table
+
+
+def policy_for(dustbox):
+    '''
+    The RetentionPolicy of a dustbox (an unsaved one for the global policy), or None to keep its readings
+    '''
+    try:
+        return dustbox.retention
+    except RetentionPolicy.DoesNotExist:
+        pass
+
+    if settings.READINGS_RETENTION_DAYS is None:
+        return None
+
+    return RetentionPolicy(
+        dustbox=dustbox,
+        raw_days=settings.READINGS_RETENTION_DAYS,
+        resolution=settings.READINGS_RETENTION_RESOLUTION,
+    )
+
+
+def compaction_cutoff(policy, now):
+    '''
+    The start of the first day whose readings a policy keeps
+    '''
+    cutoff = now - datetime.timedelta(days=policy.raw_days)
+    return datetime.datetime(cutoff.year, cutoff.month, cutoff.day, tzinfo=datetime.timezone.utc)
+
+
+def finer_rollups(resolution):
+    '''
+    The rollup models finer than `resolution`, which compaction deletes
+    '''
+    units = [unit for unit, _ in TIERS]
+    return [model for _, model in TIERS[:units.index(resolution)]]
+
+
+def next_day_with_readings(dustbox, since, before):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            SELECT date_trunc('day', min(created_at)) FROM {TABLE}
+            WHERE dustbox_number = %s AND created_at >= %s AND created_at < %s
+            ''',
+            [dustbox.number, since, before],
+        )
+        (day,) = cursor.fetchone()
+
+    return day
+
+
+def compact_day(dustbox, day, resolution):
+    '''
+    Replace a dustbox's readings of the day starting at `day` with its rollups of `resolution` and coarser.
+
+    Returns the number of readings deleted.
+    '''
+    end = day + datetime.timedelta(days=1)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # The rollups are recomputed first, so they are complete whatever wrote the readings (the
+        # day may be before compacted_before, if it had no readings when the days around it were compacted)
+        refresh_rollups(
+            f'SELECT dustbox_number, created_at FROM {TABLE} '
+            f'WHERE dustbox_number = %s AND created_at >= %s AND created_at < %s',
+            [dustbox.number, day, end],
+            compacted=True,
+        )
+
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE dustbox_number = %s AND created_at >= %s AND created_at < %s',
+            [dustbox.number, day, end],
+        )
+        deleted = cursor.rowcount
+        subtract_deleted(dustbox, deleted, day)
+
+        for model in finer_rollups(resolution):
+            model.objects.filter(dustbox=dustbox, bucket__gte=day, bucket__lt=end).delete()
+
+        Dustbox.objects.filter(number=dustbox.number).update(
+            compacted_before=Greatest(Coalesce('compacted_before', end), end)
+        )
+
+    return deleted
+
+
+def compact_late_days(dustbox, since, resolution):
+    '''
+    Compact the days of a dustbox before its compacted_before (from `since`) that have readings now,
+    but had none when they were compacted, so have no rollups that the readings would change.
+
+    Returns (days compacted, readings deleted).
+    '''
+    if dustbox.compacted_before is None:
+        return 0, 0
+
+    days, deleted = 0, 0
+    day = next_day_with_readings(dustbox, since, dustbox.compacted_before)
+
+    while day is not None:
+        # Days are rolled up to the day tier whatever the resolution, so a compacted day with readings has a bucket
+        if not DustboxReadingDay.objects.filter(dustbox=dustbox, bucket=day).exists():
+            deleted += compact_day(dustbox, day, resolution)
+            days += 1
+
+        day = next_day_with_readings(dustbox, day + datetime.timedelta(days=1), dustbox.compacted_before)
+
+    return days, deleted
+
+
+def delete_compacted_readings(dustbox, since, batch_size=10000):
+    '''
+    Delete readings that have been written again to the compacted days of a dustbox (from `since`),
+    `batch_size` at a time.
+
+    Returns the number of readings deleted.
+    '''
+    if dustbox.compacted_before is None:
+        return 0
+
+    deleted = 0
+
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'''
+                DELETE FROM {TABLE} WHERE (id, created_at) IN (
+                    SELECT id, created_at FROM {TABLE}
+                    WHERE dustbox_number = %s AND created_at >= %s AND created_at < %s
+                    LIMIT %s
+                )
+                ''',
+                [dustbox.number, since, dustbox.compacted_before, batch_size],
+            )
+            deleted += cursor.rowcount
+            subtract_deleted(dustbox, cursor.rowcount, since)
+
+        if cursor.rowcount < batch_size:
+            return deleted
+
+
+def subtract_deleted(dustbox, deleted, since):
+    # Take `deleted` readings, from `since` on, out of the dustbox's reading_count
+    if deleted > 0:
+        subtract_from_summaries('SELECT %s, %s, %s', [dustbox.number, deleted, since], rolled_up=True)
+
+
+def compact_dustbox(dustbox, now, max_days=None, batch_size=10000):
+    '''
+    Compact the readings of a dustbox that are older than its policy keeps, oldest day first, and
+    at most `max_days` days of them.
+
+    Returns (days compacted, readings deleted).
+    '''
+    policy = policy_for(dustbox)
+    if policy is None:
+        return 0, 0
+
+    cutoff = compaction_cutoff(policy, now)
+    since = ArchivedMonth.horizon() or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+    days, deleted = compact_late_days(dustbox, since, policy.resolution)
+    deleted += delete_compacted_readings(dustbox, since, batch_size=batch_size)
+
+    day = next_day_with_readings(dustbox, max(since, dustbox.compacted_before or since), cutoff)
+
+    while day is not None and (max_days is None or days < max_days):
+        deleted += compact_day(dustbox, day, policy.resolution)
+        days += 1
+
+        day = next_day_with_readings(dustbox, day + datetime.timedelta(days=1), cutoff)
+
+    return days, deleted
@@ -0,0 +1,269 @@
+'''
+Minute, hour and day rollups of the readings, which aggregates are served from.
+
+Whenever readings are written, the buckets they fall in are recomputed: minutes from the
+readings, hours from the minutes and days from the hours. Recomputing (rather than adding to)
+a bucket keeps it exact when readings are re-synced with different values.
+
+Buckets are in UTC, like the date_trunc of the database session. The buckets of archived months
+(see airsift.data.archive) are only recomputed when archive_readings moves readings into them, and
+those of compacted readings (see airsift.data.retention) never are.
+'''
+import datetime
+
+from django.db import connection
+
+from airsift.data.models import (
+    ArchivedMonth, Dustbox, DustboxReading, DustboxReadingDay, DustboxReadingHour, DustboxReadingMinute,
+)
+
+ROLLUP_MEASURES = ('pm1', 'pm2_5', 'pm10', 'humidity', 'temperature')
+
+# (unit, rollup model), finest first; each tier is computed from the one before it
+TIERS = (
+    ('minute', DustboxReadingMinute),
+    ('hour', DustboxReadingHour),
+    ('day', DustboxReadingDay),
+)
+
+
+# Readings before this are in the archive, rather than the readings table
+ARCHIVE_HORIZON = (
+    f"COALESCE((SELECT max(month) FROM {ArchivedMonth._meta.db_table}) + INTERVAL '1 month', '-infinity')"
+)
+
+
+def rollup_columns():
+    return [f'{measure}_{stat}' for measure in ROLLUP_MEASURES for stat in ('sum', 'count', 'min', 'max')]
+
+
+def reading_aggregates():
+    # The aggregates of a minute, from the readings, which are single precision (so are summed as double)
+    return [
+        aggregate
+        for measure in ROLLUP_MEASURES
+        for aggregate in (f'sum({measure}::float8)', f'count({measure})', f'min({measure})', f'max({measure})')
+    ]
+
+
+def rollup_aggregates():
+    # The aggregates of a coarser bucket, from the buckets of the tier before
+    return [
+        f'{function}({measure}_{stat})'
+        for measure in ROLLUP_MEASURES
+        for function, stat in (('sum', 'sum'), ('sum', 'count'), ('min', 'min'), ('max', 'max'))
+    ]
+
+
+def refresh_rollups(written, params=(), archived=None, compacted=False):
+    '''
+    Recompute the rollup buckets of readings that have just been written.
+
+    `written` is a query (with `params`) of the (dustbox_number, created_at) of those readings.
+    Readings before the archive horizon are ignored, unless `archived` is a table of the archived
+    readings of their months to compute the buckets from, instead of the readings table. So are
+    readings from before their dustbox's compacted_before, whose buckets are final, unless
+    `compacted` (for days that were compacted without any readings, so have no buckets).
+    '''
+    conditions = []
+
+    if not compacted:
+        conditions.append(
+            f'''
+            created_at >= COALESCE(
+                (SELECT compacted_before FROM {Dustbox._meta.db_table} WHERE number = written.dustbox_number),
+                '-infinity'
+            )
+            '''
+        )
+
+    if archived is None:
+        source_table = DustboxReading._meta.db_table
+        conditions.append(f'created_at >= {ARCHIVE_HORIZON}')
+    else:
+        source_table = archived
+
+    time_column, aggregates = 'created_at', reading_aggregates()
+    columns = rollup_columns()
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in columns)
+
+    with connection.cursor() as cursor:
+        for unit, model in TIERS:
+            table = model._meta.db_table
+
+            cursor.execute(
+                f'''
+                INSERT INTO {table} (dustbox_number, bucket, {', '.join(columns)})
+                SELECT source.dustbox_number, date_trunc('{unit}', source.{time_column}), {', '.join(aggregates)}
+                FROM (
+                    SELECT DISTINCT dustbox_number, date_trunc('{unit}', created_at) AS bucket
+                    FROM ({written}) AS written (dustbox_number, created_at)
+                    WHERE {' AND '.join(conditions) or 'TRUE'}
+                ) AS touched
+                JOIN {source_table} source
+                    ON source.dustbox_number = touched.dustbox_number
+                    AND source.{time_column} >= touched.bucket
+                    AND source.{time_column} < touched.bucket + INTERVAL '1 {unit}'
+                GROUP BY source.dustbox_number, date_trunc('{unit}', source.{time_column})
+                ON CONFLICT (dustbox_number, bucket) DO UPDATE SET {updates}
+                ''',
+                params,
+            )
+
+            source_table, time_column, aggregates = table, 'bucket', rollup_aggregates()
+
+
+def refresh_rollups_of_columns(columns):
+    '''
+    Recompute the rollup buckets of ReadingColumns that have just been written
+    '''
+    if len(columns) == 0:
+        return
+
+    # Only one reading per minute is needed to find the buckets
+    minutes = columns.created_at // 60000
+    touched = sorted(set(zip(columns.dustbox_ids, minutes.tolist())))
+
+    refresh_rollups(
+        f'''
+        SELECT dustbox.number, TIMESTAMPTZ 'epoch' + touched.minute * INTERVAL '1 minute'
+        FROM unnest(%s::varchar[], %s::bigint[]) AS touched (dustbox_id, minute)
+        JOIN {Dustbox._meta.db_table} dustbox ON dustbox.id = touched.dustbox_id
+        ''',
+        [[dustbox_id for dustbox_id, _ in touched], [minute for _, minute in touched]],
+    )
+
+
+def rebuild_rollups(dustbox_id, since=None):
+    '''
+    Recompute every rollup bucket of a dustbox from its readings.
+
+    Only buckets from `since` (by default, the day of the dustbox's first reading), and after
+    the archive horizon and the dustbox's compacted_before, are rebuilt, so the rollups of
+    archived and compacted readings are kept.
+    '''
+    reading_table = DustboxReading._meta.db_table
+    number, compacted_before = Dustbox.objects.values_list('number', 'compacted_before').get(id=dustbox_id)
+
+    with connection.cursor() as cursor:
+        if since is None:
+            cursor.execute(
+                f'SELECT date_trunc(\'day\', min(created_at)) FROM {reading_table} WHERE dustbox_number = %s',
+                [number],
+            )
+            (since,) = cursor.fetchone()
+
+            if since is None:
+                return
+
+        else:
+            cursor.execute('SELECT date_trunc(\'day\', %s::timestamptz)', [since])
+            (since,) = cursor.fetchone()
+
+        for final_before in (ArchivedMonth.horizon(), compacted_before):
+            if final_before is not None:
+                since = max(since, final_before)
+
+        for _, model in TIERS:
+            cursor.execute(
+                f'DELETE FROM {model._meta.db_table} WHERE dustbox_number = %s AND bucket >= %s',
+                [number, since],
+            )
+
+    refresh_rollups(
+        f'SELECT dustbox_number, created_at FROM {reading_table} WHERE dustbox_number = %s AND created_at >= %s',
+        [number, since],
+    )
+
+
+# The finest tier an aggregate needs, by `mean`, for date_trunc and date_part
+TRUNC_UNITS = {
+    'minute': 'minute',
+    'hour': 'hour',
+    **{mean: 'day' for mean in ('day', 'week', 'month', 'quarter', 'year', 'decade', 'century', 'millennium')},
+}
+PART_UNITS = {
+    'minute': 'minute',
+    'hour': 'hour',
+    **{
+        mean: 'day'
+        for mean in (
+            'day', 'dow', 'doy', 'isodow', 'week', 'month', 'quarter', 'year', 'isoyear', 'decade', 'century',
+            'millennium',
+        )
+    },
+}
+
+
+def rollup_tiers(mean, mode):
+    '''
+    The rollup tiers ((unit, model)) with the detail an aggregate of readings by `mean` (with date_trunc
+    or date_part, by `mode`) needs, coarsest first, or () if it needs the readings themselves
+    '''
+    units = {'trunc': TRUNC_UNITS, 'part': PART_UNITS}.get(mode, {})
+    unit = units.get(mean)
+
+    if unit is None:
+        return ()
+
+    coarsest = [tier_unit for tier_unit, _ in TIERS].index(unit)
+
+    return tuple(reversed(TIERS[:coarsest + 1]))
+
+
+def rollup_spans(mean, mode, start=None, end=None):
+    '''
+    Split the time from `start` (inclusive) to `end` (exclusive), either of them None for no bound,
+    into spans (model, start, end) for an aggregate by `mean` and `mode`: the whole buckets of the
+    coarsest tier that fit, those of finer tiers at the edges, and the readings themselves (model
+    None) for what is left, which is less than a minute at either end.
+    '''
+    spans = []
+
+    def split(start, end, tiers):
+        if start is not None and end is not None and start >= end:
+            return
+
+        if len(tiers) == 0:
+            spans.append((None, start, end))
+            return
+
+        (unit, model), finer = tiers[0], tiers[1:]
+        first = None if start is None else bucket_ceil(start, unit)
+        last = None if end is None else bucket_floor(end, unit)
+
+        if first is not None and last is not None and first >= last:
+            split(start, end, finer)
+            return
+
+        if start is not None:
+            split(start, first, finer)
+
+        spans.append((model, first, last))
+
+        if end is not None:
+            split(last, end, finer)
+
+    split(start, end, rollup_tiers(mean, mode))
+
+    return spans
+
+
+def bucket_floor(date, unit):
+    # The start of the bucket of `unit` that `date` is in
+    date = date.astimezone(datetime.timezone.utc).replace(second=0, microsecond=0)
+
+    if unit in ('hour', 'day'):
+        date = date.replace(minute=0)
+
+    if unit == 'day':
+        date = date.replace(hour=0)
+
+    return date
+
+
+def bucket_ceil(date, unit):
+    # The start of the first bucket of `unit` at or after `date`
+    floor = bucket_floor(date, unit)
+
+    return floor if floor == date else floor + datetime.timedelta(**{f'{unit}s': 1})
@@ -4,19 +4,44 @@ from rest_framework import serializers
 from airsift.data import models
 
 class DustboxSerializer(serializers.ModelSerializer):
-    has_data = serializers.SerializerMethodField('has_data_fn')
-
-    def has_data_fn(self, instance):
-        return models.DustboxReading.objects.filter(dustbox=instance).exists()
+    # has_data and the other reading summary fields are columns maintained by the sync
     class Meta:
         model = models.Dustbox
-        fields = '__all__'
+        exclude = ('number', 'compacted_before')
 
 class DustboxReadingSerializer(serializers.ModelSerializer):
+    # Readings refer to their dustbox by number, but the api has always given its id
+    dustbox = serializers.SlugRelatedField(slug_field='id', read_only=True)
+
     class Meta:
         model = models.DustboxReading
         fields = '__all__'
 
+# The bands of the map's air quality legend, by their upper bound of PM2.5
+AIR_QUALITY_BANDS = ((5, '0-5'), (10, '5-10'), (25, '10-25'), (50, '25-50'))
+
+def air_quality_band(pm2_5):
+    if pm2_5 is None:
+        return 'N/A'
+
+    for upper, band in AIR_QUALITY_BANDS:
+        if pm2_5 <= upper:
+            return band
+
+    return '50+'
+
+class DustboxLatestReadingSerializer(serializers.ModelSerializer):
+    dustbox = serializers.SlugRelatedField(slug_field='id', read_only=True)
+    id = serializers.CharField(source='reading_id')
+    band = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.DustboxLatestReading
+        fields = ('dustbox', 'id', 'created_at', 'humidity', 'pm1', 'pm2_5', 'pm10', 'temperature', 'band')
+
+    def get_band(self, latest):
+        return air_quality_band(latest.pm2_5)
+
 # class DustboxReadingAggregateSerializer(serializers.Serializer):
 #     created_at = serializers.DateTimeField(required=False)
 #     dustbox_id = serializers.CharField(required=False)
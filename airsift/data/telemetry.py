@@ -0,0 +1,251 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+from airsift.data.models import SyncRun
+
+
+class StreamStats:
+    '''
+    Counters and timings for syncing the readings of one stream, which the threads fetching its
+    pages add to through add(), add_latency() and timer()
+    '''
+
+    def __init__(self):
+        self.pages = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.http_latencies = []
+        self.transfer_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.db_seconds = 0.0
+        self.seconds = 0.0
+        self.status = 'synced'
+        self.lock = threading.Lock()
+
+    def add(self, attribute, amount):
+        with self.lock:
+            setattr(self, attribute, getattr(self, attribute) + amount)
+
+    def add_latency(self, latency):
+        with self.lock:
+            self.http_latencies.append(latency)
+
+    @contextmanager
+    def timer(self, attribute):
+        '''
+        Add the time spent in the block to one of the *_seconds attributes
+        '''
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(attribute, time.perf_counter() - started)
+
+    def as_dict(self):
+        return {
+            'status': self.status,
+            'pages': self.pages,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'rejected': self.rejected,
+            'http_latency': latency_summary(self.http_latencies),
+            'transfer_seconds': round(self.transfer_seconds, 3),
+            'decode_seconds': round(self.decode_seconds, 3),
+            'db_seconds': round(self.db_seconds, 3),
+            'seconds': round(self.seconds, 3),
+        }
+
+
+class SyncReport:
+    '''
+    Telemetry for a whole sync run, collected from the streams as they finish (possibly
+    from several threads)
+    '''
+
+    def __init__(self, command='sync_data'):
+        self.command = command
+        self.started_at = timezone.now()
+        self.started = time.perf_counter()
+        self.finished_at = None
+        self.seconds = None
+        self.boxes_created = 0
+        self.boxes_updated = 0
+        self.streams_skipped = 0
+        # Streams left to another sync that was working on them
+        self.streams_locked = 0
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def add_stream(self, stream_id, stats):
+        with self.lock:
+            self.streams[stream_id] = stats
+
+    def add_locked_stream(self):
+        with self.lock:
+            self.streams_locked += 1
+
+    def finish(self):
+        self.finished_at = timezone.now()
+        self.seconds = time.perf_counter() - self.started
+
+    def totals(self):
+        with self.lock:
+            streams = list(self.streams.values())
+
+        totals = {
+            'streams_synced': sum(1 for stats in streams if stats.status == 'synced'),
+            'streams_failed': sum(1 for stats in streams if stats.status == 'failed'),
+            'streams_skipped': self.streams_skipped,
+            'streams_locked': self.streams_locked,
+            'boxes_created': self.boxes_created,
+            'boxes_updated': self.boxes_updated,
+        }
+
+        for key in ('pages', 'inserted', 'updated', 'skipped', 'rejected'):
+            totals[key] = sum(getattr(stats, key) for stats in streams)
+
+        for key in ('transfer_seconds', 'decode_seconds', 'db_seconds'):
+            totals[key] = round(sum(getattr(stats, key) for stats in streams), 3)
+
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self.started
+        totals['rows_per_second'] = round((totals['inserted'] + totals['updated']) / max(seconds, 1e-6), 1)
+        totals['http_latency'] = latency_summary(
+            [latency for stats in streams for latency in stats.http_latencies]
+        )
+
+        return totals
+
+    def as_dict(self):
+        with self.lock:
+            streams = dict(self.streams)
+
+        return {
+            'command': self.command,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'seconds': round(self.seconds, 3) if self.seconds is not None else None,
+            'totals': self.totals(),
+            'streams': {stream_id: stats.as_dict() for stream_id, stats in streams.items()},
+        }
+
+    def save(self):
+        '''
+        Persist the report, keeping only the last settings.SYNC_RUN_HISTORY runs
+        '''
+        SyncRun.objects.create(
+            command=self.command,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            report=self.as_dict(),
+        )
+
+        stale = SyncRun.objects.values_list('id', flat=True)[settings.SYNC_RUN_HISTORY:]
+        SyncRun.objects.filter(id__in=list(stale)).delete()
+
+    def write_json(self, path):
+        write_atomically(path, json.dumps(self.as_dict(), indent=2))
+
+    def write_prometheus(self, path):
+        '''
+        Write the run totals in the Prometheus text format, for node_exporter's textfile collector
+        '''
+        totals = self.totals()
+        finished_at = self.finished_at or timezone.now()
+
+        lines = [
+            '# HELP airsift_sync_last_run_timestamp_seconds When the last sync run finished.',
+            '# TYPE airsift_sync_last_run_timestamp_seconds gauge',
+            f'airsift_sync_last_run_timestamp_seconds {finished_at.timestamp():.3f}',
+            '# HELP airsift_sync_duration_seconds How long the last sync run took.',
+            '# TYPE airsift_sync_duration_seconds gauge',
+            f'airsift_sync_duration_seconds {self.seconds or 0:.3f}',
+            '# HELP airsift_sync_rows Readings handled by the last sync run.',
+            '# TYPE airsift_sync_rows gauge',
+        ]
+
+        for result in ('inserted', 'updated', 'skipped', 'rejected'):
+            lines.append(f'airsift_sync_rows{{result="{result}"}} {totals[result]}')
+
+        lines += [
+            '# HELP airsift_sync_streams Streams handled by the last sync run.',
+            '# TYPE airsift_sync_streams gauge',
+            f'airsift_sync_streams{{status="synced"}} {totals["streams_synced"]}',
+            f'airsift_sync_streams{{status="failed"}} {totals["streams_failed"]}',
+            f'airsift_sync_streams{{status="skipped"}} {totals["streams_skipped"]}',
+            f'airsift_sync_streams{{status="locked"}} {totals["streams_locked"]}',
+            '# HELP airsift_sync_pages Pages fetched by the last sync run.',
+            '# TYPE airsift_sync_pages gauge',
+            f'airsift_sync_pages {totals["pages"]}',
+            '# HELP airsift_sync_rows_per_second Readings written per second by the last sync run.',
+            '# TYPE airsift_sync_rows_per_second gauge',
+            f'airsift_sync_rows_per_second {totals["rows_per_second"]}',
+            '# HELP airsift_sync_phase_seconds Time the last sync run spent in each phase, summed over streams.',
+            '# TYPE airsift_sync_phase_seconds gauge',
+        ]
+
+        for phase in ('transfer', 'decode', 'db'):
+            lines.append(f'airsift_sync_phase_seconds{{phase="{phase}"}} {totals[phase + "_seconds"]}')
+
+        lines += [
+            '# HELP airsift_sync_http_latency_seconds Time to the first byte of api responses in the last sync run.',
+            '# TYPE airsift_sync_http_latency_seconds summary',
+        ]
+
+        latency = totals['http_latency']
+        for quantile in ('p50', 'p90', 'p99'):
+            if latency[quantile] is not None:
+                lines.append(
+                    f'airsift_sync_http_latency_seconds{{quantile="0.{quantile[1:]}"}} {latency[quantile]}'
+                )
+
+        lines += [
+            f'airsift_sync_http_latency_seconds_count {latency["count"]}',
+            f'airsift_sync_http_latency_seconds_sum {latency["sum"]}',
+        ]
+
+        write_atomically(path, '\n'.join(lines) + '\n')
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+
+    return {
+        'count': len(latencies),
+        'sum': round(sum(latencies), 3),
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': round(latencies[-1], 3) if latencies else None,
+    }
+
+
+def percentile(values, p):
+    '''
+    Nearest-rank percentile of already sorted values
+    '''
+    if len(values) == 0:
+        return None
+
+    rank = max(math.ceil(p / 100 * len(values)), 1)
+    return round(values[rank - 1], 3)
+
+
+def write_atomically(path, content):
+    # Readers (e.g. the textfile collector) never see a half written file
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+
+    with open(temporary_path, 'w') as file:
+        file.write(content)
+
+    os.replace(temporary_path, path)
@@ -0,0 +1,20 @@
+from django.utils import timezone
+from factory import LazyAttribute, LazyFunction, Sequence
+from factory.django import DjangoModelFactory
+
+from airsift.data.models import Dustbox
+
+
+class DustboxFactory(DjangoModelFactory):
+
+    id = Sequence(lambda n: f'dustbox-{n}')
+    created_at = LazyFunction(timezone.now)
+    description = ''
+    entries_number = 0
+    public_key = ''
+    slug = LazyAttribute(lambda dustbox: dustbox.id)
+    title = LazyAttribute(lambda dustbox: dustbox.id.replace('-', ' ').capitalize())
+
+    class Meta:
+        model = Dustbox
+        django_get_or_create = ["id"]
@@ -0,0 +1,112 @@
+import datetime
+
+import pytest
+
+from airsift.data.aggregates import AggregateQuery
+from airsift.data.tests.factories import DustboxFactory
+
+pytestmark = pytest.mark.django_db
+
+START = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def dustbox(dustbox, write_readings):
+    # Readings every 10 minutes for a day
+    write_readings([
+        {
+            'id': str(n),
+            'streamId': dustbox.id,
+            'createdAt': (START + datetime.timedelta(minutes=10 * n)).timestamp() * 1000,
+            'pm1': n % 13,
+            'pm2.5': n % 5,
+            'pm10': n % 17,
+        }
+        for n in range(24 * 6)
+    ])
+
+    return dustbox
+
+
+def aggregates(client, **params):
+    return client.get('/api/v2/dustboxes/dustbox/aggregates/', {'limit': 100, **params})
+
+
+def test_only_the_measures_asked_for_are_averaged(client, dustbox):
+    everything = aggregates(client, mean='hour').json()
+    pm25 = aggregates(client, mean='hour', measure='pm25', date_before='2021-03-01T23:59:59Z').json()
+
+    assert len(pm25) == len(everything) == 24
+    assert pm25[0].keys() == {'createdAt', 'pm25'}
+    assert [row['pm25'] for row in pm25] == pytest.approx([row['pm25'] for row in everything])
+
+    from_rollups = aggregates(client, mean='hour', measure='pm1,pm10', ordering='-pm10').json()
+    assert from_rollups[0].keys() == {'createdAt', 'pm1', 'pm10'}
+    assert [row['pm10'] for row in from_rollups] == sorted((row['pm10'] for row in everything), reverse=True)
+
+
+def test_values_are_bound_parameters():
+    query = AggregateQuery('dustbox', mean='isodow', mode='part', measures=['pm2_5'], ordering=['pm2_5'])
+    sql, params = query.compile()
+
+    assert 'isodow' not in sql
+    assert 'sum(pm2_5_sum) / NULLIF(sum(pm2_5_count), 0) AS pm2_5' in sql and 'pm10' not in sql
+    assert params == ['isodow', 'dustbox', 1]
+
+    # The same shape of query compiles to the same SQL
+    other_sql, _ = AggregateQuery('other', mean='dow', mode='part', measures=['pm25'], ordering=['pm25']).compile()
+    assert other_sql == sql
+
+
+@pytest.mark.parametrize('params', [
+    {'mean': "day', created_at) AS created_at, 1 AS pm1 --"},
+    {'mean': 'dow', 'mode': 'trunc'},
+    {'mode': 'extract'},
+    {'measure': 'pm1,ozone'},
+    {'ordering': 'pm10', 'measure': 'pm1'},
+    {'limit': 'all'},
+    {'date_after': 'yesterday'},
+])
+def test_invalid_parameters_are_rejected(client, dustbox, params):
+    response = aggregates(client, **params)
+
+    assert response.status_code == 400
+    assert len(response.json()) == 1
+
+
+def test_batch_of_dustboxes_on_the_same_datetimes(client, dustbox, write_readings):
+    DustboxFactory(id='other')
+    # Readings every 10 minutes for the last 6 hours of the day
+    write_readings([
+        {
+            'id': f'other-{n}',
+            'streamId': 'other',
+            'createdAt': (START + datetime.timedelta(hours=18, minutes=10 * n)).timestamp() * 1000,
+            'pm2.5': n,
+        }
+        for n in range(6 * 6)
+    ])
+    single = aggregates(client, mean='hour', measure='pm2_5').json()
+
+    response = client.get(
+        '/api/v2/aggregates/',
+        {'dustboxes': 'other,unknown,dustbox', 'mean': 'hour', 'measure': 'pm2_5', 'limit': 100},
+    )
+
+    assert response.status_code == 200
+    batch = response.json()
+    assert batch['createdAt'] == [row['createdAt'] for row in single]
+    assert [series['dustbox']['title'] for series in batch['dustboxes']] == ['Other', 'Dustbox']
+    assert batch['dustboxes'][0].keys() == {'dustbox', 'pm25'}
+    assert batch['dustboxes'][1]['pm25'] == pytest.approx([row['pm25'] for row in single])
+    assert batch['dustboxes'][0]['pm25'][6:] == [None] * 18
+    assert batch['dustboxes'][0]['pm25'][:6] == pytest.approx([2.5 + 6 * n for n in reversed(range(6))])
+
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'dustboxes': 'dustbox', 'ordering': 'pm1'},
+    {'dustboxes': 'dustbox', 'mean': 'dow'},
+])
+def test_invalid_batches_are_rejected(client, dustbox, params):
+    assert client.get('/api/v2/aggregates/', params).status_code == 400
@@ -0,0 +1,132 @@
+import datetime
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from airsift.data.archive import ArchivedReadings, archive_month
+from airsift.data.models import ArchivedMonth, Dustbox, DustboxReading, DustboxReadingMinute
+
+pytestmark = pytest.mark.django_db
+
+JANUARY = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def dustbox(dustbox, write_readings, settings, tmp_path):
+    settings.READINGS_ARCHIVE_ROOT = str(tmp_path)
+
+    # Readings every 6 hours through January and February
+    write_readings([
+        {
+            'id': str(n),
+            'streamId': dustbox.id,
+            'createdAt': (JANUARY + datetime.timedelta(hours=6 * n)).timestamp() * 1000,
+            'pm1': n % 13 + 0.1,
+            'pm2.5': n % 5 if n % 4 else None,
+        }
+        for n in range(4 * 59)
+    ])
+
+    return dustbox
+
+
+def readings_page(client, **params):
+    response = client.get('/api/v2/dustboxes/dustbox/readings/', {'limit': 1000, **params})
+    assert response.status_code == 200
+    return response.json()['results']
+
+
+def test_archived_readings_are_served_as_before(client, dustbox):
+    newest_first = readings_page(client)
+    oldest_first = readings_page(client, ordering='created_at')
+    across_the_horizon = readings_page(client, limit=20, offset=4 * 28 - 10)
+    aggregates = client.get(
+        '/api/v2/dustboxes/dustbox/aggregates/', {'mean': 'week', 'limit': 100, 'date_after': '2021-01-10T03:00:00Z'},
+    ).json()
+
+    assert archive_month(JANUARY) == 4 * 31
+    assert DustboxReading.objects.count() == 4 * 28
+    assert len(ArchivedReadings(dustbox.id)) == 4 * 31
+
+    assert readings_page(client) == newest_first
+    assert readings_page(client, ordering='created_at') == oldest_first
+    assert readings_page(client, limit=20, offset=4 * 28 - 10) == across_the_horizon
+
+    archived_aggregates = client.get(
+        '/api/v2/dustboxes/dustbox/aggregates/', {'mean': 'week', 'limit': 100, 'date_after': '2021-01-10T03:00:00Z'},
+    ).json()
+    assert len(archived_aggregates) == len(aggregates)
+
+    for row, expected in zip(archived_aggregates, aggregates):
+        assert row['createdAt'] == expected['createdAt']
+        assert row['pm1'] == pytest.approx(expected['pm1'])
+        assert row['pm25'] == pytest.approx(expected['pm25'])
+
+
+def test_archived_readings_are_filtered_by_date(client, dustbox):
+    dates = {'date_after': '2021-01-20T06:00:00Z', 'date_before': '2021-02-10T12:00:00Z'}
+    newest_first = readings_page(client, **dates)
+    oldest_first = readings_page(client, ordering='created_at', **dates)
+
+    # Readings 77 (the 20th of January, 6am) to 162 (the 10th of February, noon), both ends included
+    assert len(newest_first) == 162 - 77 + 1
+
+    archive_month(JANUARY)
+
+    assert readings_page(client, **dates) == newest_first
+    assert readings_page(client, ordering='created_at', **dates) == oldest_first
+    assert readings_page(client, limit=5, offset=4 * 10, **dates) == newest_first[4 * 10:4 * 10 + 5]
+    assert readings_page(client, date_before='2021-01-01T12:00:00Z') == [
+        reading for reading in readings_page(client) if reading['createdAt'] <= '2021-01-01T12:00:00Z'
+    ]
+
+
+def test_readings_written_to_an_archived_month_are_folded_in(dustbox, write_readings):
+    archive_month(JANUARY)
+    reading_count = Dustbox.objects.get(id=dustbox.id).reading_count
+    resynced = JANUARY + datetime.timedelta(hours=6)
+
+    write_readings([{'id': '1', 'streamId': dustbox.id, 'createdAt': resynced.timestamp() * 1000, 'pm1': 100}])
+
+    # Until it's archived, the re-synced reading changes neither the archive nor the rollups
+    assert ArchivedReadings(dustbox.id).columns(1, 2).measures['pm1'][0] == pytest.approx(1.1)
+    assert DustboxReadingMinute.objects.get(bucket=resynced).pm1_max == pytest.approx(1.1)
+
+    # Up to (not including) March 2021
+    now = timezone.now()
+    call_command('archive_readings', older_than=(now.year - 2021) * 12 + now.month - 3)
+
+    assert list(ArchivedMonth.objects.values_list('month', flat=True)) == [JANUARY, add_month(JANUARY)]
+    assert ArchivedReadings(dustbox.id).columns(1, 2).measures['pm1'][0] == 100
+    assert len(ArchivedReadings(dustbox.id)) == 4 * 59
+    assert DustboxReadingMinute.objects.get(bucket=resynced).pm1_max == 100
+    assert DustboxReading.objects.count() == 0
+    assert Dustbox.objects.get(id=dustbox.id).reading_count == reading_count
+
+
+def add_month(month):
+    return month.replace(month=month.month + 1)
+
+
+def test_archiving_nothing(settings, tmp_path):
+    settings.READINGS_ARCHIVE_ROOT = str(tmp_path)
+
+    call_command('archive_readings')
+
+    assert not ArchivedMonth.objects.exists()
+    assert ArchivedReadings('dustbox').horizon is None
+
+
+def test_archiving_again_changes_nothing(dustbox):
+    now = timezone.now()
+    older_than = (now.year - 2021) * 12 + now.month - 3
+    call_command('archive_readings', older_than=older_than)
+    archived = list(ArchivedMonth.objects.values_list('month', 'readings'))
+    reading_count = Dustbox.objects.get(id=dustbox.id).reading_count
+
+    call_command('archive_readings', older_than=older_than)
+
+    assert list(ArchivedMonth.objects.values_list('month', 'readings')) == archived
+    assert len(ArchivedReadings(dustbox.id)) == 4 * 59
+    assert Dustbox.objects.get(id=dustbox.id).reading_count == reading_count
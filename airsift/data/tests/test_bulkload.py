@@ -0,0 +1,117 @@
+import datetime
+import json
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+
+from airsift.data.bulkload import CopyLoader, CsvRowStream, deferred_indexes
+from airsift.data.fakeapi import FakeCitizenSenseApi, synthetic_fixture
+from airsift.data.ingest import decode_readings
+from airsift.data.management.commands import sync_data
+from airsift.data.models import Dustbox, DustboxReading, DustboxReadingHour
+
+pytestmark = pytest.mark.django_db
+
+START = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+
+
+def columns(first, count, **values):
+    readings, _ = decode_readings([
+        {
+            'id': str(n),
+            'streamId': 'dustbox',
+            'createdAt': (START + datetime.timedelta(minutes=n)).timestamp() * 1000,
+            'pm1': n,
+            **values,
+        }
+        for n in range(first, first + count)
+    ])
+
+    return readings
+
+
+def secondary_indexes():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname NOT LIKE %s',
+            [DustboxReading._meta.db_table, '%pkey'],
+        )
+        return sorted(name for (name,) in cursor.fetchall())
+
+
+def test_copy_loader_merges_staged_readings(dustbox):
+    with CopyLoader(merge_every=15) as loader:
+        assert loader.write(columns(0, 10)) == 10
+        assert DustboxReading.objects.count() == 0
+
+        # Staging 15 readings merges them, and the copy of a reading staged last wins
+        loader.write(columns(5, 10, pm1=100))
+        assert DustboxReading.objects.count() == 15
+
+        loader.write(columns(10, 10, pm10=1))
+
+    assert (loader.inserted, loader.updated) == (20, 5)
+    assert DustboxReading.objects.get(id='7').pm1 == 100
+    assert DustboxReading.objects.get(id='12').pm10 == 1
+    assert Dustbox.objects.get(id='dustbox').reading_count == 20
+    assert DustboxReadingHour.objects.get(bucket=START).pm1_count == 20
+
+
+def test_copy_loader_merges_nothing_after_an_error(dustbox):
+    with pytest.raises(ValueError):
+        with CopyLoader() as loader:
+            loader.write(columns(0, 10))
+            raise ValueError
+
+    assert DustboxReading.objects.count() == 0
+
+
+def test_csv_rows_are_streamed_in_any_size_of_read():
+    rows = [('a', '1', ''), ('b, c', '2', '"3"')]
+    stream = CsvRowStream(rows)
+    chunks = []
+
+    while True:
+        chunk = stream.read(5)
+        if not chunk:
+            break
+        chunks.append(chunk)
+
+    assert b''.join(chunks) == b'a,1,\r\n"b, c",2,"""3"""\r\n'
+
+
+def test_indexes_are_rebuilt_after_a_bulk_load(dustbox):
+    indexes = secondary_indexes()
+    assert len(indexes) > 0
+
+    with pytest.raises(ValueError):
+        with deferred_indexes():
+            assert secondary_indexes() == []
+            raise ValueError
+
+    assert secondary_indexes() == indexes
+
+
+def test_import_through_copy_with_deferred_indexes(dustbox, tmp_path):
+    indexes = secondary_indexes()
+    (tmp_path / 'readings.json').write_text(json.dumps({'data': [
+        {'id': str(n), 'streamId': 'dustbox', 'createdAt': START.timestamp() * 1000 + n * 60000, 'pm1': n}
+        for n in range(100)
+    ]}))
+
+    call_command('import_readings', str(tmp_path / 'readings.json'), '--copy', '--defer-indexes', '--batchsize', '30')
+
+    assert DustboxReading.objects.count() == 100
+    assert secondary_indexes() == indexes
+
+
+def test_sync_through_copy(monkeypatch):
+    fixture = synthetic_fixture(streams=2, readings=120)
+
+    with FakeCitizenSenseApi(fixture) as api:
+        monkeypatch.setattr(sync_data, 'DATA_API_URL', api.url)
+        call_command('sync_data', '--all', '--copy', '--batchsize', '50')
+
+    assert DustboxReading.objects.count() == 240
+    assert sorted(Dustbox.objects.values_list('reading_count', flat=True)) == [120, 120]
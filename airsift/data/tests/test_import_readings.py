@@ -0,0 +1,85 @@
+import csv
+import gzip
+import json
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from airsift.data.management.commands.import_readings import guess_format
+from airsift.data.models import Dustbox, DustboxReading
+
+pytestmark = pytest.mark.django_db
+
+# 2021-03-01T00:00:00Z
+START = 1614556800000
+
+
+def dump(count, stream_id='dustbox', first=0):
+    return [
+        {'id': str(n), 'streamId': stream_id, 'createdAt': START + n * 60000, 'pm1': n, 'pm2.5': n / 2}
+        for n in range(first, first + count)
+    ]
+
+
+def test_formats(dustbox, tmp_path):
+    readings = dump(40)
+
+    (tmp_path / 'response.json').write_text(json.dumps({'data': readings[:10]}))
+    (tmp_path / 'list.json').write_text(json.dumps(readings[10:20]))
+
+    with gzip.open(tmp_path / 'readings.ndjson.gz', 'wt') as file:
+        file.writelines(json.dumps(reading) + '\n' for reading in readings[20:30])
+
+    with open(tmp_path / 'readings.csv', 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['id', 'streamId', 'createdAt', 'pm1', 'pm2.5'])
+        writer.writeheader()
+        writer.writerows(readings[30:])
+
+    call_command(
+        'import_readings',
+        *(str(tmp_path / name) for name in ('response.json', 'list.json', 'readings.ndjson.gz', 'readings.csv')),
+        '--batchsize', '7',
+    )
+
+    assert DustboxReading.objects.count() == 40
+    assert DustboxReading.objects.get(id='35').pm2_5 == 17.5
+    assert Dustbox.objects.get(id='dustbox').reading_count == 40
+
+
+def test_later_copies_of_a_reading_win(dustbox, tmp_path):
+    readings = dump(10) + [{**dump(1, first=3)[0], 'pm1': 100}]
+    (tmp_path / 'readings.json').write_text(json.dumps(readings))
+
+    call_command('import_readings', str(tmp_path / 'readings.json'))
+
+    assert DustboxReading.objects.count() == 10
+    assert DustboxReading.objects.get(id='3').pm1 == 100
+
+
+def test_readings_of_unknown_dustboxes_are_rejected(dustbox, tmp_path):
+    (tmp_path / 'readings.json').write_text(json.dumps(dump(5) + dump(5, stream_id='unknown', first=5)))
+
+    call_command('import_readings', str(tmp_path / 'readings.json'))
+
+    assert sorted(DustboxReading.objects.values_list('id', flat=True)) == ['0', '1', '2', '3', '4']
+
+
+def test_readings_can_be_imported_into_one_dustbox(dustbox, tmp_path):
+    (tmp_path / 'readings.json').write_text(json.dumps(dump(5, stream_id='unknown')))
+
+    call_command('import_readings', str(tmp_path / 'readings.json'), '--dustbox', 'dustbox')
+
+    assert DustboxReading.objects.filter(dustbox__id='dustbox').count() == 5
+
+    with pytest.raises(CommandError):
+        call_command('import_readings', str(tmp_path / 'readings.json'), '--dustbox', 'unknown')
+
+
+def test_formats_are_guessed_from_the_extension():
+    assert guess_format('dump.json') == 'json'
+    assert guess_format('dump.JSONL.gz') == 'ndjson'
+    assert guess_format('dump.csv.gz') == 'csv'
+
+    with pytest.raises(CommandError):
+        guess_format('dump.txt')
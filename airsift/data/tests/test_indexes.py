@@ -0,0 +1,84 @@
+import datetime
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from airsift.data.models import Dustbox, DustboxReading
+from airsift.data.tests.factories import DustboxFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def readings(write_readings):
+    now = timezone.now()
+
+    for i in range(3):
+        DustboxFactory(id=f'dustbox-{i}')
+
+    write_readings([
+        {
+            'id': f'{i}-{n}',
+            'streamId': f'dustbox-{i}',
+            'createdAt': (now - datetime.timedelta(minutes=n)).timestamp() * 1000,
+            'pm2.5': n,
+        }
+        for i in range(3)
+        for n in range(200)
+    ])
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE data_dustboxreading')
+        # With this few rows a sequential scan would be cheapest, which isn't the case we test
+        cursor.execute('SET LOCAL enable_seqscan = off')
+
+    return now
+
+
+def test_readings_of_a_dustbox_use_the_composite_index(readings):
+    dustbox = Dustbox.objects.get(id='dustbox-1')
+    plan = DustboxReading.objects.filter(dustbox=dustbox).order_by('-created_at')[:10].explain()
+
+    assert 'Index' in plan
+    assert 'dustbox_created' in plan
+
+
+def test_time_range_of_a_dustbox_uses_the_composite_index(readings):
+    plan = DustboxReading.objects.filter(
+        dustbox=Dustbox.objects.get(id='dustbox-1'),
+        created_at__gte=readings - datetime.timedelta(hours=1),
+        created_at__lte=readings,
+    ).values('created_at', 'pm2_5').explain()
+
+    assert 'dustbox_created' in plan
+
+
+def test_time_range_of_all_dustboxes_uses_the_brin_index(readings):
+    plan = DustboxReading.objects.filter(created_at__gte=readings - datetime.timedelta(minutes=10)).explain()
+
+    assert 'created_brin' in plan
+
+
+def test_readings_api_refers_to_dustboxes_by_id(client, readings):
+    response = client.get('/api/v2/dustboxes/dustbox-1/readings/', {'limit': 5})
+
+    assert response.status_code == 200
+    rows = response.json()['results']
+    assert len(rows) == 5
+    assert {row['dustbox'] for row in rows} == {'dustbox-1'}
+    assert 'number' not in client.get('/api/v2/dustboxes/dustbox-1/').json()
+
+
+def test_dustbox_numbers_are_assigned_by_the_insert(django_assert_num_queries):
+    dustboxes = [DustboxFactory.build(id=f'new-{i}') for i in range(3)]
+
+    with django_assert_num_queries(1):
+        Dustbox.objects.bulk_create(dustboxes)
+
+    numbers = [dustbox.number for dustbox in dustboxes]
+    assert numbers == sorted(Dustbox.objects.filter(id__startswith='new-').values_list('number', flat=True))
+    assert len(set(numbers)) == 3
+
+    dustbox = DustboxFactory(id='saved')
+    assert dustbox.number == Dustbox.objects.get(id='saved').number > max(numbers)
@@ -0,0 +1,71 @@
+import math
+
+import pytest
+
+from airsift.data.ingest import decode_reading, decode_readings
+
+READINGS = [
+    {'id': 'a', 'streamId': 's', 'createdAt': 1000, 'pm1': 1, 'pm2.5': '2.5', 'pm10': None, 'humidity': ''},
+    {'id': 'b', 'streamId': 's', 'createdAt': 'never', 'pm1': 1},
+    {'id': 'c', 'streamId': 's', 'createdAt': '2000', 'pm1': 'not a number'},
+    {'id': 'd', 'streamId': 's', 'createdAt': '3000', 'pm10': '4', 'temperature': -2.5},
+    {'id': 'e', 'streamId': 's', 'pm1': 1},
+]
+
+
+def decoded(reading):
+    try:
+        return decode_reading(reading)
+    except (TypeError, ValueError):
+        return None
+
+
+def test_decode_readings_matches_decode_reading():
+    columns, rejected = decode_readings(READINGS)
+
+    expected = [row for row in map(decoded, READINGS) if row is not None]
+    rows = [
+        (
+            columns.ids[i],
+            columns.created_at_datetime(i),
+            *(columns.measures[column][i] for column in ('humidity', 'pm1', 'pm2_5', 'pm10')),
+            columns.dustbox_ids[i],
+            columns.measures['temperature'][i],
+        )
+        for i in range(len(columns))
+    ]
+
+    assert rejected == ['b', 'c', 'e']
+    assert len(rows) == len(expected)
+
+    for row, expected_row in zip(rows, expected):
+        for value, expected_value in zip(row, expected_row):
+            if expected_value is None:
+                assert math.isnan(value)
+            else:
+                assert value == expected_value
+
+
+def test_without_duplicates_keeps_the_first_copy():
+    columns, _ = decode_readings([
+        {'id': 'a', 'streamId': 's', 'createdAt': 3000},
+        {'id': 'b', 'streamId': 's', 'createdAt': 2000},
+        {'id': 'a', 'streamId': 's', 'createdAt': 1000},
+    ])
+    visited = {'b'}
+
+    columns = columns.without_duplicates(visited)
+
+    assert list(columns.ids) == ['a']
+    assert list(columns.created_at) == [3000]
+    assert visited == {'a', 'b'}
+
+
+@pytest.mark.parametrize('value, expected', [(None, ''), (math.nan, ''), (1.5, '1.5')])
+def test_csv_rows_leave_missing_values_empty(value, expected):
+    columns, _ = decode_readings([{'id': 'a', 'streamId': 's', 'createdAt': 0, 'pm1': value}])
+
+    (row,) = columns.csv_rows()
+
+    assert row[1] == '1970-01-01T00:00:00.000Z'
+    assert row[3] == expected
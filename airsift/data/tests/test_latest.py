@@ -0,0 +1,29 @@
+import pytest
+
+from airsift.data.tests.factories import DustboxFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_latest_readings_of_every_dustbox(client, write_readings):
+    for i in range(3):
+        DustboxFactory(id=f'dustbox-{i}')
+
+    write_readings([
+        {'id': 'a', 'streamId': 'dustbox-0', 'createdAt': 2000, 'pm2.5': 7.5},
+        {'id': 'b', 'streamId': 'dustbox-0', 'createdAt': 1000, 'pm2.5': 60},
+        {'id': 'c', 'streamId': 'dustbox-1', 'createdAt': 1000},
+    ])
+    # An older reading written later doesn't replace the latest one
+    write_readings([
+        {'id': 'd', 'streamId': 'dustbox-0', 'createdAt': 500, 'pm2.5': 1},
+        {'id': 'e', 'streamId': 'dustbox-1', 'createdAt': 3000, 'pm2.5': 30},
+    ])
+
+    response = client.get('/api/v2/dustboxes/latest/')
+
+    assert response.status_code == 200
+    latest = {reading['dustbox']: reading for reading in response.json()}
+    assert latest.keys() == {'dustbox-0', 'dustbox-1'}
+    assert (latest['dustbox-0']['id'], latest['dustbox-0']['pm25'], latest['dustbox-0']['band']) == ('a', 7.5, '5-10')
+    assert (latest['dustbox-1']['id'], latest['dustbox-1']['band']) == ('e', '25-50')
@@ -0,0 +1,69 @@
+import datetime
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from airsift.data.models import DustboxReading, UnsupportedOperation
+from airsift.data.partitions import add_months, create_partition, list_partitions, month_start, partition_name
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def write_reading(dustbox, write_readings):
+    def write(reading_id, created_at):
+        write_readings([
+            {'id': reading_id, 'streamId': dustbox.id, 'createdAt': created_at.timestamp() * 1000, 'pm1': 1},
+        ])
+
+    return write
+
+
+def test_partitions_are_created_ahead():
+    call_command('manage_partitions', '--ahead', '5')
+
+    names = {partition.name for partition in list_partitions()}
+    current = month_start(timezone.now())
+
+    assert all(partition_name(add_months(current, months)) in names for months in range(6))
+
+
+def test_readings_are_routed_to_their_month(write_reading):
+    month = month_start(timezone.now())
+    write_reading('a', month + datetime.timedelta(days=3))
+    write_reading('a', month + datetime.timedelta(days=3))
+
+    assert DustboxReading.objects.count() == 1
+    assert DustboxReading.objects.get().pm1 == 1
+
+
+def test_old_partitions_are_detached(dustbox, write_reading):
+    old_month = add_months(month_start(timezone.now()), -24)
+    create_partition(old_month)
+    write_reading('old', old_month + datetime.timedelta(days=1))
+    write_reading('new', timezone.now())
+
+    call_command('manage_partitions', '--older-than', '12', '--detach')
+
+    assert list(DustboxReading.objects.values_list('id', flat=True)) == ['new']
+    assert partition_name(old_month) not in {partition.name for partition in list_partitions()}
+
+    dustbox.refresh_from_db()
+    assert dustbox.reading_count == 1
+    assert dustbox.first_reading_at == DustboxReading.objects.get().created_at
+
+
+def test_reading_ids_are_only_unique_within_a_month(write_reading):
+    call_command('manage_partitions', '--ahead', '1')
+    month = month_start(timezone.now())
+    write_reading('a', month + datetime.timedelta(days=3))
+    write_reading('a', add_months(month, 1) + datetime.timedelta(days=3))
+
+    assert DustboxReading.objects.filter(id='a').count() == 2
+
+    with pytest.raises(UnsupportedOperation):
+        DustboxReading.objects.first().save()
+
+    with pytest.raises(UnsupportedOperation):
+        DustboxReading.objects.first().delete()
@@ -0,0 +1,157 @@
+import datetime
+
+import pytest
+from django.core.management import call_command
+
+from airsift.data.models import (
+    Dustbox, DustboxReading, DustboxReadingDay, DustboxReadingHour, DustboxReadingMinute, RetentionPolicy,
+)
+from airsift.data.retention import compact_dustbox
+from airsift.data.tests.factories import DustboxFactory
+
+pytestmark = pytest.mark.django_db
+
+START = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+NOW = START + datetime.timedelta(days=3, hours=12)
+
+
+@pytest.fixture
+def dustbox(dustbox, write_readings):
+    # Readings every 10 minutes for three days
+    write_readings([
+        {
+            'id': str(n),
+            'streamId': dustbox.id,
+            'createdAt': (START + datetime.timedelta(minutes=10 * n)).timestamp() * 1000,
+            'pm1': n % 13,
+        }
+        for n in range(3 * 24 * 6)
+    ])
+
+    return dustbox
+
+
+def hours():
+    return list(DustboxReadingHour.objects.order_by('bucket').values_list('bucket', 'pm1_sum', 'pm1_count', 'pm1_max'))
+
+
+def summary(dustbox):
+    dustbox = Dustbox.objects.get(id=dustbox.id)
+    return dustbox.reading_count, dustbox.has_data, dustbox.first_reading_at
+
+
+def test_old_readings_are_replaced_by_rollups(dustbox, write_readings):
+    RetentionPolicy.objects.create(dustbox=dustbox, raw_days=2, resolution='hour')
+    second_day = START + datetime.timedelta(days=1)
+    before = hours()
+
+    days, deleted = compact_dustbox(Dustbox.objects.get(id=dustbox.id), NOW)
+
+    assert (days, deleted) == (1, 24 * 6)
+    assert not DustboxReading.objects.filter(created_at__lt=second_day).exists()
+    assert DustboxReading.objects.count() == 2 * 24 * 6
+    assert hours() == before
+    assert not DustboxReadingMinute.objects.filter(bucket__lt=second_day).exists()
+    assert DustboxReadingMinute.objects.filter(bucket__gte=second_day).count() == 2 * 24 * 6
+    assert Dustbox.objects.get(id=dustbox.id).compacted_before == second_day
+    assert summary(dustbox) == (2 * 24 * 6, True, START)
+
+    # A re-synced reading of a compacted day doesn't change its rollups, and is deleted again
+    write_readings([{'id': '0', 'streamId': dustbox.id, 'createdAt': START.timestamp() * 1000, 'pm1': 100}])
+    assert hours() == before
+
+    assert compact_dustbox(Dustbox.objects.get(id=dustbox.id), NOW) == (0, 1)
+    assert not DustboxReading.objects.filter(created_at__lt=second_day).exists()
+    assert summary(dustbox) == (2 * 24 * 6, True, START)
+
+
+def test_compacted_before_is_not_served(client, dustbox):
+    RetentionPolicy.objects.create(dustbox=dustbox, raw_days=2, resolution='hour')
+    compact_dustbox(Dustbox.objects.get(id=dustbox.id), NOW)
+
+    response = client.get(f'/api/v2/dustboxes/{dustbox.id}/')
+
+    assert response.status_code == 200
+    assert 'compactedBefore' not in response.json()
+    assert response.json()['hasData'] is True
+
+
+def test_global_policy_in_bounded_batches(dustbox, settings):
+    settings.READINGS_RETENTION_DAYS = 1
+    settings.READINGS_RETENTION_RESOLUTION = 'day'
+    day_sum = DustboxReadingDay.objects.get(bucket=START).pm1_sum
+
+    assert compact_dustbox(Dustbox.objects.get(id=dustbox.id), NOW, max_days=1) == (1, 24 * 6)
+    assert Dustbox.objects.get(id=dustbox.id).compacted_before == START + datetime.timedelta(days=1)
+    assert not DustboxReadingHour.objects.filter(bucket__lt=START + datetime.timedelta(days=1)).exists()
+    assert DustboxReadingDay.objects.get(bucket=START).pm1_sum == day_sum
+
+    assert compact_dustbox(Dustbox.objects.get(id=dustbox.id), NOW) == (1, 24 * 6)
+    assert Dustbox.objects.get(id=dustbox.id).compacted_before == START + datetime.timedelta(days=2)
+    assert DustboxReading.objects.count() == 24 * 6
+
+    assert compact_dustbox(Dustbox.objects.get(id=dustbox.id), NOW + datetime.timedelta(days=2)) == (1, 24 * 6)
+    assert summary(dustbox) == (0, True, START)
+
+
+def test_compacting_without_a_policy_changes_nothing(dustbox):
+    before = hours()
+
+    call_command('compact_readings')
+
+    assert DustboxReading.objects.count() == 3 * 24 * 6
+    assert hours() == before
+    assert Dustbox.objects.get(id=dustbox.id).compacted_before is None
+
+
+def test_compacting_again_changes_nothing(dustbox):
+    RetentionPolicy.objects.create(dustbox=dustbox, raw_days=1, resolution='hour')
+    before = hours()
+
+    call_command('compact_readings', 'another-dustbox')
+    assert DustboxReading.objects.count() == 3 * 24 * 6
+
+    call_command('compact_readings')
+    compacted_before = Dustbox.objects.get(id=dustbox.id).compacted_before
+    call_command('compact_readings')
+
+    assert DustboxReading.objects.count() == 0
+    assert hours() == before
+    assert Dustbox.objects.get(id=dustbox.id).compacted_before == compacted_before
+    assert summary(dustbox) == (0, True, START)
+
+
+def test_backfilled_readings_of_days_without_any_are_compacted(write_readings):
+    dustbox = DustboxFactory(id='sparse')
+    RetentionPolicy.objects.create(dustbox=dustbox, raw_days=1, resolution='hour')
+    now = START + datetime.timedelta(days=4, hours=12)
+
+    def day_of_readings(day, pm1):
+        write_readings([
+            {
+                'id': f'{day}-{n}',
+                'streamId': dustbox.id,
+                'createdAt': (START + datetime.timedelta(days=day, minutes=10 * n)).timestamp() * 1000,
+                'pm1': pm1,
+            }
+            for n in range(24 * 6)
+        ])
+
+    # Nothing to compact yet
+    assert compact_dustbox(Dustbox.objects.get(id=dustbox.id), now) == (0, 0)
+    assert Dustbox.objects.get(id=dustbox.id).compacted_before is None
+
+    day_of_readings(0, 1)
+    day_of_readings(2, 3)
+    assert compact_dustbox(Dustbox.objects.get(id=dustbox.id), now) == (2, 2 * 24 * 6)
+    assert Dustbox.objects.get(id=dustbox.id).compacted_before == START + datetime.timedelta(days=3)
+
+    # The day in between is backfilled after it was compacted
+    day_of_readings(1, 2)
+    assert compact_dustbox(Dustbox.objects.get(id=dustbox.id), now) == (1, 24 * 6)
+
+    assert DustboxReading.objects.filter(dustbox=dustbox).count() == 0
+    assert [day.pm1_sum for day in DustboxReadingDay.objects.filter(dustbox=dustbox).order_by('bucket')] == [
+        24 * 6, 2 * 24 * 6, 3 * 24 * 6,
+    ]
+    assert DustboxReadingHour.objects.filter(dustbox=dustbox).count() == 3 * 24
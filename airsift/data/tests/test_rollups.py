@@ -0,0 +1,110 @@
+import datetime
+
+import pytest
+
+from airsift.data.aggregates import AggregateQuery
+from airsift.data.models import DustboxReadingDay, DustboxReadingHour, DustboxReadingMinute
+from airsift.data.rollups import rebuild_rollups, rollup_spans, rollup_tiers
+
+START = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def dustbox(dustbox, write_readings):
+    # Readings every 7 minutes, half a minute past, so none are on a bucket boundary
+    write_readings([
+        {
+            'id': str(n),
+            'streamId': dustbox.id,
+            'createdAt': (START + datetime.timedelta(minutes=7 * n, seconds=30)).timestamp() * 1000,
+            'pm1': n % 13,
+            'pm2.5': n % 5 if n % 4 else None,
+            'pm10': n % 17,
+        }
+        for n in range(3 * 24 * 60 // 7)
+    ])
+
+    return dustbox
+
+
+def aggregates(client, dates, **params):
+    date_after, date_before = dates
+    response = client.get(
+        '/api/v2/dustboxes/dustbox/aggregates/',
+        {'date_after': date_after, 'date_before': date_before, 'limit': 10000, **params},
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+# Dates to the millisecond, like the analysis page sends, which are on no bucket boundary
+UNALIGNED = (
+    START + datetime.timedelta(hours=5, minutes=15, seconds=30, milliseconds=1),
+    START + datetime.timedelta(days=2, hours=20, minutes=1, seconds=45, milliseconds=500),
+)
+
+
+@pytest.mark.parametrize('dates', [(START, START + datetime.timedelta(days=3)), UNALIGNED])
+@pytest.mark.parametrize('mean, mode', [('minute', 'trunc'), ('hour', 'trunc'), ('day', 'trunc'), ('hour', 'part')])
+def test_aggregates_from_rollups_match_the_readings(client, dustbox, monkeypatch, dates, mean, mode):
+    dates = [date.isoformat() for date in dates]
+    from_rollups = aggregates(client, dates, mean=mean, mode=mode)
+
+    # Without any rollup spans, the readings are aggregated directly
+    monkeypatch.setattr('airsift.data.aggregates.rollup_spans', lambda *args: [])
+    from_readings = aggregates(client, dates, mean=mean, mode=mode)
+
+    assert len(from_rollups) == len(from_readings) > 0
+
+    for rollup_row, reading_row in zip(from_rollups, from_readings):
+        assert rollup_row.keys() == reading_row.keys()
+
+        for key, value in reading_row.items():
+            assert rollup_row[key] == (pytest.approx(value) if isinstance(value, float) else value)
+
+
+def test_unaligned_dates_read_whole_buckets_from_the_rollups():
+    after, before = UNALIGNED
+    spans = AggregateQuery('dustbox', mean='day', after=after, before=before).spans()
+
+    assert [model for model, _, _ in spans] == [
+        None, DustboxReadingMinute, DustboxReadingHour, DustboxReadingDay, DustboxReadingHour, DustboxReadingMinute,
+        None,
+    ]
+    assert spans[3][1:] == (START + datetime.timedelta(days=1), START + datetime.timedelta(days=2))
+    # Only less than a minute of readings at either end
+    assert all(end - start < datetime.timedelta(minutes=1) for model, start, end in spans if model is None)
+
+
+def test_rollups_follow_updated_readings(dustbox, write_readings):
+    write_readings([{'id': '0', 'streamId': dustbox.id, 'createdAt': (START.timestamp() + 30) * 1000, 'pm1': 100}])
+
+    assert DustboxReadingMinute.objects.get(dustbox=dustbox, bucket=START).pm1_sum == 100
+    assert DustboxReadingDay.objects.get(dustbox=dustbox, bucket=START).pm1_max == 100
+
+
+def test_rebuild_matches_incremental_rollups(dustbox):
+    def snapshot():
+        return [
+            list(model.objects.order_by('bucket').values_list('bucket', 'pm1_sum', 'pm2_5_count', 'pm10_max'))
+            for model in (DustboxReadingMinute, DustboxReadingHour, DustboxReadingDay)
+        ]
+
+    incremental = snapshot()
+    DustboxReadingHour.objects.all().delete()
+    rebuild_rollups(dustbox.id)
+
+    assert snapshot() == incremental
+
+
+def test_coarsest_tier_for_the_mean():
+    ten = START + datetime.timedelta(hours=10)
+
+    assert rollup_tiers('month', 'trunc')[0] == ('day', DustboxReadingDay)
+    assert rollup_tiers('isodow', 'part')[0] == ('day', DustboxReadingDay)
+    assert rollup_tiers('hour', 'part') == (('hour', DustboxReadingHour), ('minute', DustboxReadingMinute))
+    assert rollup_tiers('second', 'trunc') == ()
+
+    assert rollup_spans('hour', 'part') == [(DustboxReadingHour, None, None)]
+    assert rollup_spans('day', 'trunc', START, ten) == [(DustboxReadingHour, START, ten)]
+    assert rollup_spans('second', 'trunc', START, ten) == [(None, START, ten)]
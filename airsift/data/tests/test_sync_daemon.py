@@ -0,0 +1,95 @@
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.utils import timezone
+
+from airsift.data.management.commands.sync_daemon import Command, poll_interval
+from airsift.data.tests.factories import DustboxFactory
+
+pytestmark = pytest.mark.django_db
+
+NOW = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+@pytest.fixture
+def daemon():
+    daemon = Command()
+    daemon.min_interval = 60
+    daemon.max_interval = DAY
+    daemon.sync_boxes = lambda: None
+    daemon.start_schedule()
+    return daemon
+
+
+def scheduled_ids(daemon):
+    return sorted(stream_id for _, stream_id in daemon.schedule)
+
+
+def test_streams_are_polled_about_as_often_as_they_report():
+    def interval(silence, seconds_per_entry=None):
+        return poll_interval(
+            last_entry_at=NOW - datetime.timedelta(seconds=silence),
+            seconds_per_entry=seconds_per_entry,
+            now=NOW,
+            minimum=60,
+            maximum=DAY,
+        )
+
+    assert interval(30, seconds_per_entry=120) == 120
+    assert interval(30, seconds_per_entry=1) == 60
+    assert interval(4 * HOUR) == HOUR
+    assert interval(4 * DAY) == DAY
+    assert interval(40 * DAY) == DAY
+    assert poll_interval(None, None, NOW, minimum=60, maximum=DAY) == DAY
+
+
+def test_new_streams_are_due_at_once(daemon):
+    DustboxFactory(id='a')
+    DustboxFactory(id='b')
+
+    daemon.refresh_streams()
+
+    assert scheduled_ids(daemon) == ['a', 'b']
+    assert all(due <= time.monotonic() for due, _ in daemon.schedule)
+
+
+def test_a_stream_that_comes_back_is_scheduled_once(daemon):
+    DustboxFactory(id='a')
+    DustboxFactory(id='b')
+    daemon.refresh_streams()
+
+    # Stream a disappears and comes back before its entry is due
+    daemon.ids_to_sync = ('b',)
+    daemon.refresh_streams()
+    daemon.ids_to_sync = ()
+    daemon.refresh_streams()
+
+    assert scheduled_ids(daemon) == ['a', 'b']
+
+
+def test_polled_streams_are_rescheduled(daemon, monkeypatch):
+    DustboxFactory(id='a', entries_number=10, last_entry_at=timezone.now() - datetime.timedelta(hours=4))
+    polled = []
+    monkeypatch.setattr(daemon, 'poll_stream', lambda stream: polled.append(stream.id))
+    daemon.refresh_streams()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        daemon.dispatch_due(executor)
+
+        # An in-flight stream isn't scheduled again by a refresh
+        assert list(daemon.in_flight) == ['a']
+        daemon.refresh_streams()
+        assert daemon.schedule == []
+
+    daemon.collect_finished()
+
+    assert polled == ['a']
+    assert daemon.in_flight == {}
+    ((due, stream_id),) = daemon.schedule
+    assert stream_id == 'a'
+    # Silent for four hours, so polled again in about an hour
+    assert HOUR - 60 < due - time.monotonic() <= HOUR
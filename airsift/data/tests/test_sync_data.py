@@ -0,0 +1,209 @@
+import threading
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+
+from airsift.data.fakeapi import FakeCitizenSenseApi, SyntheticReadings, synthetic_fixture
+from airsift.data.ingest import convert_timestamp
+from airsift.data.locks import in_shard, stream_lock
+from airsift.data.management.commands import sync_data
+from airsift.data.models import Dustbox, DustboxLatestReading, DustboxReading, DustboxSyncState
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def fixture():
+    return synthetic_fixture(streams=2, readings=120)
+
+
+@pytest.fixture
+def api(fixture, monkeypatch):
+    with FakeCitizenSenseApi(fixture) as api:
+        monkeypatch.setattr(sync_data, 'DATA_API_URL', api.url)
+        yield api
+
+
+def add_readings(fixture, stream_index, count):
+    stream = fixture['streams'][stream_index]
+    history = fixture['readings'][stream['id']]
+
+    fixture['readings'][stream['id']] = SyntheticReadings(stream['id'], len(history) + count)
+    stream['entriesNumber'] = len(history) + count
+    stream['lastEntryAt'] = {'timestamp': fixture['readings'][stream['id']][0]['createdAt']}
+
+
+def reading_requests(api):
+    return [path for path in api.requests if path.startswith('/collections/stream/')]
+
+
+def test_sync_all(api, fixture):
+    call_command('sync_data', '--all', '--batchsize', '50')
+
+    assert Dustbox.objects.count() == 2
+    assert DustboxReading.objects.count() == 240
+
+    for stream in fixture['streams']:
+        state = DustboxSyncState.objects.get(dustbox_id=stream['id'])
+        assert state.last_reading_id == fixture['readings'][stream['id']][0]['id']
+        assert state.entries_number == 120
+
+
+def test_incremental_sync_stops_at_the_watermark(api, fixture):
+    call_command('sync_data', '--all')
+    add_readings(fixture, 0, 12)
+    api.requests.clear()
+
+    call_command('sync_data', '--pagesize', '5')
+
+    assert DustboxReading.objects.count() == 252
+    # Pages 0-2 hold the 12 new readings (and the watermark), the other stream is skipped
+    assert len(reading_requests(api)) == 3
+
+
+def test_sync_maintains_the_dustbox_summary(api, fixture):
+    call_command('sync_data', '--all', '--batchsize', '50')
+    add_readings(fixture, 0, 12)
+    call_command('sync_data', '--pagesize', '5')
+
+    stream = fixture['streams'][0]
+    history = fixture['readings'][stream['id']]
+    dustbox = Dustbox.objects.get(id=stream['id'])
+
+    assert dustbox.has_data
+    assert dustbox.reading_count == 132
+    assert dustbox.first_reading_at.timestamp() * 1000 == history[-1]['createdAt']
+    assert dustbox.last_reading_at.timestamp() * 1000 == history[0]['createdAt']
+    assert DustboxLatestReading.objects.get(dustbox=dustbox).pm2_5 == history[0]['pm2.5']
+
+
+def test_reconcile_fills_gaps_from_a_few_pages(monkeypatch):
+    fixture = synthetic_fixture(streams=1, readings=1000)
+    stream_id = fixture['streams'][0]['id']
+    history = fixture['readings'][stream_id]
+
+    with FakeCitizenSenseApi(fixture) as api:
+        monkeypatch.setattr(sync_data, 'DATA_API_URL', api.url)
+        call_command('sync_data', '--all')
+
+        # A hole in the middle of the history, e.g. left by a run that bailed
+        DustboxReading.objects.filter(id__in=[reading['id'] for reading in history[500:530]]).delete()
+        api.requests.clear()
+
+        call_command('sync_data', '--reconcile', '--pagesize', '20')
+
+    assert DustboxReading.objects.count() == 1000
+    # Bisection probes and the two pages with the gap, rather than all 50 pages
+    assert len(reading_requests(api)) < 30
+
+
+def test_reconcile_skips_compacted_readings(monkeypatch):
+    fixture = synthetic_fixture(streams=1, readings=1000)
+    stream_id = fixture['streams'][0]['id']
+    history = fixture['readings'][stream_id]
+
+    with FakeCitizenSenseApi(fixture) as api:
+        monkeypatch.setattr(sync_data, 'DATA_API_URL', api.url)
+        call_command('sync_data', '--all')
+
+        # The oldest 300 readings have been compacted away, and there's a hole after them
+        compacted_before = convert_timestamp(history[699]['createdAt'])
+        Dustbox.objects.filter(id=stream_id).update(compacted_before=compacted_before)
+        DustboxReading.objects.filter(created_at__lt=compacted_before).delete()
+        DustboxReading.objects.filter(id__in=[reading['id'] for reading in history[500:530]]).delete()
+        api.requests.clear()
+
+        call_command('sync_data', '--reconcile', '--pagesize', '20')
+        fetched = len(reading_requests(api))
+
+        # Once the hole is filled, everything after the compaction is synced
+        call_command('sync_data', '--reconcile', '--pagesize', '20')
+
+    assert DustboxReading.objects.count() == 700
+    assert not DustboxReading.objects.filter(created_at__lt=compacted_before).exists()
+    assert fetched < 40
+    assert len(reading_requests(api)) - fetched < 15
+
+
+def test_page_window_sync(api, fixture):
+    call_command('sync_data', '--page-window', '4', '--pagesize', '10', '--batchsize', '25')
+
+    assert DustboxReading.objects.count() == 240
+
+    add_readings(fixture, 0, 12)
+    api.requests.clear()
+
+    call_command('sync_data', '--page-window', '4', '--pagesize', '5')
+
+    assert DustboxReading.objects.count() == 252
+    # Stops at the watermark in page 2, with at most one window of pages fetched past it
+    assert len(reading_requests(api)) <= 3 + 4
+
+
+def test_unchanged_streams_are_skipped(api):
+    call_command('sync_data', '--all')
+    api.requests.clear()
+
+    call_command('sync_data')
+
+    assert reading_requests(api) == []
+
+
+def test_failing_stream_does_not_stop_the_others(fixture, monkeypatch):
+    failing_stream = fixture['streams'][0]['id']
+
+    with FakeCitizenSenseApi(fixture, failing_streams=[failing_stream]) as api:
+        monkeypatch.setattr(sync_data, 'DATA_API_URL', api.url)
+        call_command('sync_data', '--pagesize', '50')
+
+    assert DustboxReading.objects.filter(dustbox__id=fixture['streams'][1]['id']).count() == 120
+    assert DustboxReading.objects.filter(dustbox__id=failing_stream).count() == 0
+    assert DustboxSyncState.objects.get(dustbox_id=failing_stream).last_error != ''
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_sync(api):
+    call_command('sync_data', '--concurrency', '2', '--pagesize', '25')
+
+    assert DustboxReading.objects.count() == 240
+
+
+@pytest.mark.django_db(transaction=True)
+def test_streams_locked_by_another_sync_are_skipped(api, fixture):
+    locked_stream = fixture['streams'][0]['id']
+    holding = threading.Event()
+    release = threading.Event()
+
+    # Another sync process, which has its own database connection
+    def hold_lock():
+        try:
+            with stream_lock(locked_stream):
+                holding.set()
+                release.wait(timeout=10)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    holding.wait(timeout=10)
+
+    try:
+        call_command('sync_data')
+    finally:
+        release.set()
+        thread.join()
+
+    assert DustboxReading.objects.filter(dustbox__id=locked_stream).count() == 0
+    assert DustboxReading.objects.filter(dustbox__id=fixture['streams'][1]['id']).count() == 120
+
+
+def test_shards_split_the_streams(api, fixture):
+    for index in range(3):
+        call_command('sync_data', '--shard', f'{index}/3')
+
+    assert DustboxReading.objects.count() == 240
+    assert all(
+        sum(in_shard(stream['id'], (index, 3)) for index in range(3)) == 1
+        for stream in fixture['streams']
+    )
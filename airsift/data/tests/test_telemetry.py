@@ -0,0 +1,115 @@
+import json
+import threading
+
+import pytest
+from django.core.management import call_command
+
+from airsift.data.fakeapi import FakeCitizenSenseApi, synthetic_fixture
+from airsift.data.management.commands import sync_data
+from airsift.data.models import SyncRun
+from airsift.data.telemetry import StreamStats, SyncReport, latency_summary
+
+pytestmark = pytest.mark.django_db
+
+
+def stream_stats(status='synced', inserted=0, latencies=()):
+    stats = StreamStats()
+    stats.status = status
+    stats.add('pages', 1)
+    stats.add('inserted', inserted)
+
+    for latency in latencies:
+        stats.add_latency(latency)
+
+    return stats
+
+
+def test_latency_summary():
+    summary = latency_summary([0.5, 0.1, 0.2, 0.4, 0.3])
+
+    assert summary == {'count': 5, 'sum': 1.5, 'p50': 0.3, 'p90': 0.5, 'p99': 0.5, 'max': 0.5}
+    assert latency_summary([])['p50'] is None
+
+
+def test_stream_stats_add_up_across_threads():
+    stats = StreamStats()
+
+    def work():
+        for _ in range(1000):
+            stats.add('inserted', 1)
+            stats.add_latency(0.001)
+
+            with stats.timer('decode_seconds'):
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stats.inserted == 8000
+    assert len(stats.http_latencies) == 8000
+    assert stats.decode_seconds > 0
+
+
+def test_report_totals(tmp_path):
+    report = SyncReport()
+    report.streams_skipped = 3
+    report.add_locked_stream()
+    report.add_stream('a', stream_stats(inserted=10, latencies=[0.1, 0.3]))
+    report.add_stream('b', stream_stats(status='failed', latencies=[0.2]))
+    report.finish()
+
+    totals = report.totals()
+
+    assert (totals['streams_synced'], totals['streams_failed'], totals['streams_skipped']) == (1, 1, 3)
+    assert totals['streams_locked'] == 1
+    assert (totals['pages'], totals['inserted']) == (2, 10)
+    assert totals['http_latency']['count'] == 3
+
+    report.write_json(tmp_path / 'report.json')
+    written = json.loads((tmp_path / 'report.json').read_text())
+
+    assert written['totals'] == totals
+    assert written['streams']['b']['status'] == 'failed'
+
+
+def test_prometheus_textfile(tmp_path):
+    report = SyncReport()
+    report.add_stream('a', stream_stats(inserted=10, latencies=[0.1, 0.3]))
+    report.finish()
+
+    report.write_prometheus(tmp_path / 'sync.prom')
+    lines = (tmp_path / 'sync.prom').read_text().splitlines()
+
+    assert 'airsift_sync_rows{result="inserted"} 10' in lines
+    assert 'airsift_sync_streams{status="synced"} 1' in lines
+    assert 'airsift_sync_http_latency_seconds{quantile="0.50"} 0.1' in lines
+    assert 'airsift_sync_http_latency_seconds_count 2' in lines
+
+
+def test_only_the_last_runs_are_kept(settings):
+    settings.SYNC_RUN_HISTORY = 2
+
+    for _ in range(3):
+        report = SyncReport()
+        report.finish()
+        report.save()
+
+    assert SyncRun.objects.count() == 2
+
+
+def test_sync_data_reports(monkeypatch, tmp_path):
+    with FakeCitizenSenseApi(synthetic_fixture(streams=2, readings=30)) as api:
+        monkeypatch.setattr(sync_data, 'DATA_API_URL', api.url)
+        call_command(
+            'sync_data', '--all',
+            '--report', str(tmp_path / 'report.json'), '--prometheus', str(tmp_path / 'sync.prom'),
+        )
+
+    totals = SyncRun.objects.get().report['totals']
+
+    assert (totals['streams_synced'], totals['inserted']) == (2, 60)
+    assert json.loads((tmp_path / 'report.json').read_text())['totals'] == totals
+    assert 'airsift_sync_rows{result="inserted"} 60' in (tmp_path / 'sync.prom').read_text()
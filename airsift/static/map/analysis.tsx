@@ -3,7 +3,7 @@ import { Footer } from './scaffolding';
 import { useLocationNameCoordinates, useCoordinateData } from '../utils/geo';
 import useDebounce from '../utils/time';
 import useSWR from 'swr';
-import { Dustbox, DustboxReadingResult, DustboxReading } from './types';
+import { Dustbox, DustboxReadingResult, DustboxReading, DustboxAggregates } from './types';
 import querystring from 'query-string';
 import distance from '@turf/distance'
 import { point } from '@turf/helpers'
@@ -159,39 +159,52 @@ export function AnalysisView() {
   )
 
 
-  const keys = [dustboxSelections, dateFrom, dateTo, mode, mean]
+  const keys = [dustboxSelections, dateFrom, dateTo, mode, mean, measure]
+
+  // Every selected dustbox's series of some measures (all of them by default), and the dustboxes
+  // themselves, in one request
+  const fetchAggregates = async (dustboxIds: string[], dateFrom, dateTo, mode, mean, measures: string[] = []) => {
+    const url = querystring.stringifyUrl({
+      url: `/api/v2/aggregates/`,
+      query: {
+        dustboxes: dustboxIds.join(','),
+        date_after: dateFrom?.toISOString(),
+        date_before: dateTo?.toISOString(),
+        mode,
+        mean,
+        measure: measures.length ? measures.join(',') : undefined,
+        limit: 10000000
+      }
+    })
+
+    const response = await fetch(url)
+    const result: DustboxAggregates = await response.json()
+
+    return result.dustboxes.map(({ dustbox, ...series }) => {
+      const names = Object.keys(series)
+
+      return {
+        dustboxId: dustbox.id,
+        dustbox,
+        // The datetimes this dustbox has a mean at, of any of the measures
+        readings: result.createdAt
+          .map((createdAt, i) => Object.assign(
+            { createdAt },
+            ...names.map(name => ({ [name]: (series[name] as Array<number | null>)[i] }))
+          ))
+          .filter(reading => names.some(name => reading[name] != null)) as any as DustboxReading[]
+      }
+    })
+  }
 
   const dustboxStreams = useSWR(
     keys,
-    async (dustboxIds, dateFrom, dateTo, mode, mean) => Promise.all(dustboxIds.map(
-      async (dustboxId: string) => {
-        const url = querystring.stringifyUrl({
-          url: `/api/v2/dustboxes/${dustboxId}/aggregates/`,
-          query: {
-            date_after: dateFrom?.toISOString(),
-            date_before: dateTo?.toISOString(),
-            mode,
-            mean,
-            limit: 10000000
-          }
-        })
-
-        const response = await fetch(url)
-        const result = await response.json()
-
-        const dres = await fetch(querystring.stringifyUrl({
-          url: `/api/v2/dustboxes/${dustboxId}`,
-          query: {}
-        }))
-        const dresult = await dres.json()
-
-        return {
-          dustboxId,
-          dustbox: dresult,
-          readings: result as DustboxReading[]
-        }
-      }
-    )),
+    async (dustboxIds: string[], dateFrom, dateTo, mode, mean, measure) => {
+      if (!dustboxIds.length) return []
+
+      // Only the plotted measure
+      return fetchAggregates(dustboxIds, dateFrom, dateTo, mode, mean, [measure])
+    },
     // {
     //   refreshWhenHidden: false,
     //   revalidateOnFocus: false,
@@ -200,8 +213,13 @@ export function AnalysisView() {
     // }
   )
 
-  const download = () => {
-    for (const stream of dustboxStreams?.data || []) {
+  const download = async () => {
+    if (!dustboxSelections.length) return
+
+    // The download has every measure, not just the plotted one
+    const streams = await fetchAggregates(dustboxSelections, dateFrom, dateTo, mode, mean)
+
+    for (const stream of streams) {
       jsonexport(stream?.readings, function(err, csv) {
         const from = format(dateFrom, 'yyyy-MM-dd')
         const to = format(dateTo, 'yyyy-MM-dd')
@@ -1,6 +1,6 @@
 import React, { memo } from 'react'
 import { useCoordinateData } from '../utils/geo';
-import { useDustboxReading, parseTimestamp, airQualityColour } from './data';
+import { useLatestDustboxReading, parseTimestamp, airQualityColour } from './data';
 import { Dustbox } from './types';
 import { firstOf } from '../utils/array';
 import { isValid } from 'date-fns';
@@ -9,12 +9,10 @@ import { formatRelative } from 'date-fns/esm';
 import { enGB } from 'date-fns/esm/locale';
 
 export const DustboxCard: React.FC<{ dustbox: Dustbox, withFuzzball?: boolean, renderDetail?: (d: Dustbox) => any }> = memo(({ dustbox, withFuzzball, renderDetail }) => {
-  const dustboxReading = useDustboxReading(dustbox.id, {
-    limit: 1
-  })
+  const dustboxReading = useLatestDustboxReading(dustbox.id)
 
   let latestReadingDate = parseTimestamp(dustbox.lastEntryAt)
-  let latestReading = dustboxReading?.data?.[0]
+  let latestReading = dustboxReading?.data
   let latestReadingValue
   if (latestReading) {
     latestReadingDate = parseTimestamp(latestReading.createdAt)
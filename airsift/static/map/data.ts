@@ -1,5 +1,5 @@
 import useSWR from 'swr';
-import { DustboxReading, DustboxReadingResult } from './types';
+import { DustboxReading, DustboxReadingResult, LatestDustboxReading } from './types';
 import querystring from 'query-string';
 
 export const useDustboxReading = (dustboxId: string, query: {
@@ -26,6 +26,29 @@ export const useDustboxReading = (dustboxId: string, query: {
   })
 }
 
+// The newest reading of every dustbox comes from one request, which all the markers share
+export const useLatestDustboxReadings = () => {
+  return useSWR<Record<string, LatestDustboxReading>>('/api/v2/dustboxes/latest/', async url => {
+    const res = await fetch(url)
+    const data = await res.json() as LatestDustboxReading[]
+    return Object.fromEntries(data.map(reading => [reading.dustbox, reading]))
+  }, {
+    revalidateOnMount: true,
+    revalidateOnFocus: false,
+    revalidateOnReconnect: false,
+    refreshInterval: 60 * 1000,
+    focusThrottleInterval: 60 * 1000
+  })
+}
+
+export const useLatestDustboxReading = (dustboxId: string) => {
+  const latestReadings = useLatestDustboxReadings()
+  return {
+    ...latestReadings,
+    data: latestReadings.data?.[dustboxId]
+  }
+}
+
 export const airQualityLegend = {
   "N/A": "#8299a5",
   "0-5": "#39f986",
@@ -1,6 +1,6 @@
 import { DustboxFeature, ObservationFeature } from './types';
 import React, { Fragment, useState, useRef, useEffect, useContext, memo } from 'react';
-import { useDustboxReading, airQualityColour, airQualityLegend } from './data';
+import { useLatestDustboxReading, airQualityColour, airQualityLegend } from './data';
 import MapGL, { MapContext, Marker, Popup, NavigationControl, GeolocateControl } from '@urbica/react-map-gl'
 import { AirQualityFuzzball, DustboxCard } from './card';
 import { useHoverContext, hoverIdAtom, hoverSourceAtom, hoverTypeAtom } from './layout';
@@ -200,11 +200,8 @@ export const DustboxItems: React.FC<{ addresses: DustboxFeature[] }> = ({ addres
 
 export const DustboxMapMarker: React.FC<{ dustbox: DustboxFeature }> = memo(({ dustbox }) => {
   const [isHovering, setIsHovering] = useHoverContext(dustbox.properties.id, 'dustbox')
-  const dustboxReading = useDustboxReading(dustbox.properties.id, {
-    // createdAt: dustbox.properties.lastEntryAt.timestamp
-    limit: 1
-  })
-  const dustboxReadingValue = dustboxReading?.data?.[0]?.pm25
+  const dustboxReading = useLatestDustboxReading(dustbox.properties.id)
+  const dustboxReadingValue = dustboxReading?.data?.pm25
 
   return (
     <Fragment>
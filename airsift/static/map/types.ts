@@ -37,6 +37,20 @@ export interface DustboxReading {
   temperature: number;
 }
 
+export interface LatestDustboxReading extends DustboxReading {
+  dustbox: string;
+  band:    string;
+}
+
+export interface DustboxAggregates {
+  createdAt: Array<string | number>;
+  dustboxes: Array<{
+    dustbox: Dustbox;
+    // The mean of each measure at the createdAt of the same index, or null
+    [measure: string]: Array<number | null> | Dustbox;
+  }>;
+}
+
 export namespace DustboxDetail {
   export interface Data {
     hasData?: boolean
@@ -343,4 +343,15 @@ WEBPACK_LOADER = {
 
 WAGTAILAPI_LIMIT_MAX = 1000
 
-CITIZENSENSE_DATA_API = 'https://citizensense.co.uk:7000'
+CITIZENSENSE_DATA_API = env.str('CITIZENSENSE_DATA_API', default='https://citizensense.co.uk:7000')
+
+# Number of sync_data run reports to keep in the database
+SYNC_RUN_HISTORY = env.int('SYNC_RUN_HISTORY', default=100)
+
+# Directory of the columnar archive that archive_readings moves old readings into
+READINGS_ARCHIVE_ROOT = env.str('READINGS_ARCHIVE_ROOT', default=str(ROOT_DIR / 'archive'))
+
+# Days to keep raw readings for, after which compact_readings only keeps their rollups of
+# READINGS_RETENTION_RESOLUTION (minute, hour or day) and coarser. Unset keeps them forever.
+READINGS_RETENTION_DAYS = env.int('READINGS_RETENTION_DAYS', default=None)
+READINGS_RETENTION_RESOLUTION = env.str('READINGS_RETENTION_RESOLUTION', default='hour')